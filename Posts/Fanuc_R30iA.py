@@ -62,6 +62,7 @@ def get_safe_name(progname, max_chars = 20):
 # Import RoboDK tools
 import numbers
 import math
+import re
 from robodk import *
 import sys
 
@@ -100,9 +101,15 @@ class RobotPost(object):
     
     PROG_NAME = 'unknown'  # Original name of the current program (example: ProgA)
     PROG_NAME_CURRENT = 'unknown' # Auto generated name (different from PROG_NAME if we have more than 1 page per program. Example: ProgA2)
+    PROG_NAME_SAVED = None # Name of the program given to ProgSave (group of the files of FTP_SYNC)
     
     nPages = 0           # Count the number of pages
     PROG_NAMES_MAIN = [] # List of programs called by a main program due to splitting
+    SPLIT_PROGS = []     # Lists of pages of the programs already split (one main program each)
+
+    # maximum number of CALLs per main program (None: MAX_LINES_X_PROG). Split programs with more
+    # pages are called through a tree of dispatcher programs M<level>_<index>_<name> (see add_main_programs)
+    MAIN_FANOUT = None
     
     PROG = []     # Save the program lines
     PROG_TARGETS = []  # Save the program lines (targets section)
@@ -127,6 +134,59 @@ class RobotPost(object):
 
     #labels
     END_LBL = 8999
+    LAST_LBL = ''   # name of the last label (pass) added to the program
+
+    # joint continuity check of every page (Python/jointcheck.py), issues are added to the LOG
+    CHECK_JOINTS = False
+
+    # automatic CNT: linear moves get the largest CNT value (up to CNT_MAX) that keeps the corner
+    # deviation with the next move below CNT_TOLERANCE (mm), FINE moves included. FINE is used when
+    # the corner requires less than CNT1 or when an instruction (WAIT, DO, CALL, JMP...) follows the move.
+    AUTO_CNT = False
+    CNT_TOLERANCE = 1.0
+    CNT_MAX = 100
+
+    # turntable unwinding (Python/turntable.py): the turntable angles of every page are written
+    # with the turns (+-360 deg) that minimize the rotary travel, starting from the last angle
+    # of the previous page. TURNTABLE_LIMITS: None or [min, max] deg (or a [min, max] per axis)
+    TURNTABLE_UNWIND = False
+    TURNTABLE_LIMITS = None
+
+    # peephole optimizer of the program lines of every page (see peephole): removes frame/tool
+    # selections that do not change anything, merges consecutive waits and comment chunks, removes
+    # timer resets of a reset timer and the lines (not the moves) that can't be reached after a JMP.
+    # It runs when a page is full (the page is only split if it is still full) and when the page is finished.
+    PEEPHOLE = False
+    COMMENT_MAX = 32    # maximum length of a comment line (merged comment chunks)
+
+    # compact LS files (see compact_ls): the pages are written without the padding of the numbers and
+    # the alignment whitespace, with a short /ATTR header and the numbers of the targets rounded to
+    # COMPACT_DECIMALS decimals per axis type ('mm': X, Y, Z, 'deg': angles, 'track': linear track).
+    # The bytes saved on every page are added to the LOG.
+    COMPACT_LS = False
+    COMPACT_DECIMALS = {'mm': 2, 'deg': 3, 'track': 2}
+
+    # pass index (see index_passes): <progname>_passes.json is saved with the programs, with the page,
+    # line range, P[] range and estimated time (linear moves at the programmed speed) of every pass label.
+    # Python/passresume.py uses it to write a main program that starts at a given pass.
+    WRITE_PASS_INDEX = False
+
+    # pipelined send (see pipeline_page): every page is saved in PIPELINE_FOLDER (and compiled) when it is
+    # finished and sent to the robot by a background FTP session (FTP_HOST, FTP_PATH, FTP_USER, FTP_PASS)
+    # while the next pages are generated. ProgSave waits for the transfers and adds the errors to the LOG.
+    PIPELINED_SEND = False
+    PIPELINE_FOLDER = None
+    FTP_HOST = None
+    FTP_PATH = '/md:'
+    FTP_USER = 'anonymous'
+    FTP_PASS = ''
+    # FTP transfers (ProgSendRobot and PIPELINED_SEND): number of sessions at the same time (if the robot
+    # allows it) and block size of the transfers (bytes)
+    FTP_SESSIONS = 1
+    FTP_BLOCK_SIZE = 8192
+    # FTP sync (ProgSendRobot): only the files changed since the last transfer are sent and the pages of
+    # a longer version of the program sent before are deleted (robodk.SyncFTP, manifest .ftpsync.json)
+    FTP_SYNC = False
     
     def __init__(self, robotpost=None, robotname=None, robot_axes = 6, **kwargs):
         self.ROBOT_POST = robotpost
@@ -134,6 +194,28 @@ class RobotPost(object):
         self.nAxes = robot_axes
         self.PROG = []
         self.LOG = ''
+        # per instance lists (class level lists are shared when the post is reused in the same process)
+        self.PROG_FILES = []
+        self.PROG_NAMES = []
+        self.PROG_LIST = []
+        self.PROG_NAMES_MAIN = []
+        self.SPLIT_PROGS = []
+        self.MAIN_CALLS = {} # programs called by every main/dispatcher program
+        self.PROG_TARGETS = []
+        self.LblDict = {}
+        self.AXES_TRACK = []
+        self.AXES_TURNTABLE = []
+        self.JOINTS_PAGE = [] # (target id, label, joints) of the current page for CHECK_JOINTS
+        self.MOVES_PAGE = [] # (line index, xyz, offsets) of the linear moves of the current page for AUTO_CNT
+        self.TURNTABLE_PAGE = [] # (targets line index, angles) of the current page for TURNTABLE_UNWIND
+        self.TURNTABLE_WRITTEN = None # angles written by unwind_turntable for the current page (for CHECK_JOINTS)
+        self.TURNTABLE_LAST = None # last turntable angles written
+        self.PEEPHOLE_PAGE = False # the current page was optimized when it was full
+        self.COMMENT_NEXT = set() # line indexes of the current page that continue the comment of the line before (RunMessage)
+        self.PASS_INDEX = [] # passes of the program for WRITE_PASS_INDEX (see index_passes)
+        self.PIPELINE = None # background uploader of PIPELINED_SEND
+        self.PIPELINE_NAMES = set() # pages saved by pipeline_page
+        self.PIPELINE_CALLS = {} # programs called by the pages saved by pipeline_page
         #for k,v in kwargs.iteritems(): # python2
         for k,v in kwargs.items():
             if k == 'lines_x_prog':
@@ -156,9 +238,9 @@ class RobotPost(object):
             #nPages = len(self.PROG_LIST)
             if self.nPages == 0:
                 if len(self.PROG_NAMES_MAIN) > 0:
-                    print("Can't split %s: Two or more programs are split into smaller programs" % progname)
-                    print(self.PROG_NAMES_MAIN)
-                    raise Exception("Only one program at a time can be split into smaller programs")
+                    # pages of a previous program that was not finished
+                    self.SPLIT_PROGS.append(self.PROG_NAMES_MAIN)
+                    self.PROG_NAMES_MAIN = []
                 self.PROG_NAMES_MAIN.append(self.PROG_NAME) # add the first program in the list to be genrated as a subprogram call
                 self.nPages = self.nPages + 1
 
@@ -181,10 +263,18 @@ class RobotPost(object):
         if not new_page:
             # Reset page count
             self.nPages = 0
+            if len(self.PROG_NAMES_MAIN) > 0:
+                # the program was split: keep its pages for the main program
+                self.SPLIT_PROGS.append(self.PROG_NAMES_MAIN)
+                self.PROG_NAMES_MAIN = []
             
         #if self.nPROGS > 1:
         #    # Fanuc does not support defining multiple programs in the same file, so one program per file
         #    return
+        if self.PEEPHOLE:
+            # before the header: LINE_COUNT is the count of the optimized page
+            self.peephole()
+            self.PEEPHOLE_PAGE = False
         header = ''
         header = header + ('/PROG  %s' % self.PROG_NAME_CURRENT) + '\n' # Use the latest name set at ProgStart
         header = header + '/ATTR' + '\n'
@@ -225,15 +315,31 @@ class RobotPost(object):
         header = header + '/MN'
         #header = header + '/MN' + '\n'    # Important! Last line should not have \n
         
+        if self.TURNTABLE_UNWIND:
+            self.unwind_turntable()
+        if self.CHECK_JOINTS:
+            self.check_joints()
+        if self.AUTO_CNT:
+            self.auto_cnt()
+        if self.WRITE_PASS_INDEX:
+            self.index_passes()
+
         self.PROG.insert(0, header)
         self.PROG.append('/POS')
         self.PROG += self.PROG_TARGETS
         self.PROG.append('/END')
+        if self.COMPACT_LS:
+            self.compact_ls()
         
         # Save PROG in PROG_LIST
-        self.PROG_LIST.append(self.PROG)
+        if self.PIPELINED_SEND and self.PROG_NAME_CURRENT not in self.PIPELINE_NAMES:
+            self.pipeline_page()
+            self.PROG_LIST.append(None)
+        else:
+            self.PROG_LIST.append(self.PROG)
         self.PROG = []
         self.PROG_TARGETS = []
+        self.COMMENT_NEXT = set()
         #self.nLines = 0
         self.LINE_COUNT = 0
         self.P_COUNT = 0
@@ -299,6 +405,7 @@ class RobotPost(object):
             
     def ProgSave(self, folder, progname, ask_user = False, show_result = False):
         progname = get_safe_name(progname)
+        self.PROG_NAME_SAVED = progname
         nfiles = len(self.PROG_LIST)
         if nfiles >= 1:
             if self.LINE_COUNT > 0:
@@ -309,20 +416,23 @@ class RobotPost(object):
                 self.PROG = []
                 self.LINE_COUNT = 0
             
-            if len(self.PROG_NAMES_MAIN) > 1:
-                # Warning: the program might be cut to a maximum number of chars
-                progname_main = "M_" + self.PROG_NAMES_MAIN[0]
-                self.INCLUDE_SUB_PROGRAMS = True # Force generation of main program
-                self.ProgStart(progname_main)
-                for prog_call in self.PROG_NAMES_MAIN:
-                    self.RunCode(prog_call, True)
-                    
-                self.ProgFinish(progname_main)
+            split_progs = self.SPLIT_PROGS + [self.PROG_NAMES_MAIN]
+            self.SPLIT_PROGS = []
+            self.PROG_NAMES_MAIN = []
+            programs = self.pass_index_programs(split_progs)
+            mains = {}
+            for pages in split_progs:
+                if len(pages) > 1:
+                    self.INCLUDE_SUB_PROGRAMS = True # Force generation of main program
+                    mains[pages[0]] = self.add_main_programs(pages)
+            if mains:
+                self.redirect_calls(mains)
             
             # Save the last program added to the PROG_LIST
             self.PROG = self.PROG_LIST.pop()
             progname_last = self.PROG_NAMES.pop()
-            self.progsave(folder, progname_last, ask_user, show_result)
+            if self.PROG is not None:
+                self.progsave(folder, progname_last, ask_user, show_result)
             #-------------------------
             #self.LOG = ''
             if len(self.PROG_FILES) == 0:
@@ -335,8 +445,14 @@ class RobotPost(object):
             
             # Generate each program
             for i in range(len(self.PROG_LIST)):
+                if self.PROG_LIST[i] is None:
+                    # saved and sent when finished (PIPELINED_SEND)
+                    continue
                 self.PROG = self.PROG_LIST[i]
                 self.progsave(folder_user, self.PROG_NAMES[i], False, show_result)
+
+            if self.WRITE_PASS_INDEX:
+                self.save_pass_index(folder_user, progname, programs)
                 
         elif nfiles == 1:
             self.PROG = self.PROG_NAMES[0]
@@ -346,13 +462,85 @@ class RobotPost(object):
             print("Warning! Program has not been properly finished")
             self.progsave(folder, progname, ask_user, show_result)
 
+        if self.PIPELINE is not None:
+            self.pipeline_finish()
+
         if show_result and len(self.LOG) > 0:
             mbox('Program generation LOG:\n\n' + self.LOG)
         
+    def add_main_programs(self, pages):
+        """Add the main program M_<first page> that calls the pages of a split program. With more pages
+        than MAIN_FANOUT the pages are called by dispatcher programs of MAIN_FANOUT calls, called by
+        the next level of dispatchers and so on: M1_1_<first page> calls the first MAIN_FANOUT pages."""
+        fanout = min(self.MAIN_FANOUT or self.MAX_LINES_X_PROG, self.MAX_LINES_X_PROG)
+        fanout = max(fanout, 2)
+        calls = pages
+        level = 0
+        while len(calls) > fanout:
+            level = level + 1
+            dispatchers = []
+            for i in range(0, len(calls), fanout):
+                if i + 1 == len(calls):
+                    # a single program left: called by the next level
+                    dispatchers.append(calls[i])
+                    continue
+                # Warning: the program might be cut to a maximum number of chars (the numbers go first)
+                progname = "M%i_%i_%s" % (level, i//fanout + 1, pages[0])
+                dispatchers.append(self.add_dispatcher(progname, calls[i:i+fanout]))
+            calls = dispatchers
+        return self.add_dispatcher("M_" + pages[0], calls)
+
+    def redirect_calls(self, mains):
+        """Call the main program of a split program instead of its first page: a program that calls
+        a split program (CALL ProgA) calls M_ProgA. mains is {first page: main program}."""
+        pattern = re.compile(r'\bCALL (%s)(?=[ ;(]|$)' % '|'.join(re.escape(name) for name in mains))
+        for i, prog in enumerate(self.PROG_LIST):
+            name = self.PROG_NAMES[i] if i < len(self.PROG_NAMES) else None
+            if name in self.MAIN_CALLS:
+                # main and dispatcher programs call the pages
+                continue
+            if prog is None:
+                # saved and sent when finished (PIPELINED_SEND): the call can't be changed
+                for called in sorted(self.PIPELINE_CALLS.get(name, set()) & set(mains)):
+                    self.addlog('%s was sent before %s was split: CALL %s only runs its first page (call %s)' % (name, called, called, mains[called]))
+                continue
+            for j in range(1, len(prog)):
+                line = prog[j]
+                if line == '/POS':
+                    break
+                if 'CALL ' in line:
+                    prog[j] = pattern.sub(lambda match: 'CALL ' + mains[match.group(1)], line)
+
+    def add_dispatcher(self, progname, calls):
+        """Add a program that calls the programs in calls. Returns the program name."""
+        self.ProgStart(progname)
+        progname = self.PROG_NAME_CURRENT
+        self.MAIN_CALLS[progname] = list(calls)
+        for prog_call in calls:
+            self.RunCode(prog_call, True)
+
+        self.ProgFinish(progname)
+        return progname
+
     def ProgSendRobot(self, robot_ip, remote_path, ftp_user, ftp_pass):
         """Send a program to the robot using the provided parameters. This method is executed right after ProgSave if we selected the option "Send Program to Robot".
         The connection parameters must be provided in the robot connection menu of RoboDK"""
-        UploadFTP(self.PROG_FILES, robot_ip, remote_path, ftp_user, ftp_pass)
+        if self.PIPELINED_SEND:
+            # the pages were sent with FTP_HOST during the generation
+            print("POPUP: Done: the programs were sent during the generation (PIPELINED_SEND)")
+            sys.stdout.flush()
+            return
+        if self.FTP_SYNC:
+            results, unchanged, deleted = SyncFTP(self.PROG_FILES, robot_ip, remote_path, ftp_user, ftp_pass, group=self.PROG_NAME_SAVED,
+                                                  sessions=self.FTP_SESSIONS, block_size=self.FTP_BLOCK_SIZE)
+            errors = [result for result in results if result[1] is not None]
+            if errors:
+                print("POPUP: <font color=\"red\">%i of %i files could not be transferred</font>" % (len(errors), len(results)))
+            else:
+                print("POPUP: <font color=\"blue\">Done: %i files sent, %i up to date, %i deleted</font>" % (len(results), len(unchanged), len(deleted)))
+            sys.stdout.flush()
+            return
+        UploadFTP(self.PROG_FILES, robot_ip, remote_path, ftp_user, ftp_pass, sessions=self.FTP_SESSIONS, block_size=self.FTP_BLOCK_SIZE)
         
     def MoveJ(self, pose, joints, conf_RLF=None):
         """Add a joint movement"""
@@ -397,6 +585,10 @@ class RobotPost(object):
             move_ins = '%s %s' % (move_ins, self.TOOL_OFFSET)
 
         self.addline('%s ;' % (move_ins), 'L')
+        if self.AUTO_CNT and pose is not None:
+            self.MOVES_PAGE.append((len(self.PROG) - 1, pose.Pos(), (getattr(self, 'P_OFFSET', None), getattr(self, 'TOOL_OFFSET', None))))
+        if self.WRITE_PASS_INDEX and pose is not None and self.LAST_POSE is not None:
+            self.add_pass_time(distance(pose.Pos(), self.LAST_POSE.Pos()))
         self.LAST_POSE = pose
         self.LAST_JOINTS = joints
         
@@ -411,6 +603,17 @@ class RobotPost(object):
         self.LAST_POSE = pose2
         self.LAST_JOINTS = joints2
         
+    def MoveL_batch(self, poses, joints, conf_RLF=None):
+        """Add linear movements to N targets at once.
+        poses: (N,4,4) poses, N x 6 XYZWPR (mm and deg), a list of poses or None (joint targets)
+        joints: N x nAxes joints. conf_RLF: None, one [rear, lower, flip] for all the targets or N x 3.
+        The current speed, zone data and modifiers (COORD, TIMEAFTER, offsets) apply to every move."""
+        self.move_batch('L', poses, joints, conf_RLF)
+
+    def MoveJ_batch(self, poses, joints, conf_RLF=None):
+        """Add joint movements to N targets at once (see MoveL_batch)"""
+        self.move_batch('J', poses, joints, conf_RLF)
+
     def setFrame(self, pose, frame_id=None, frame_name=None):
         """Change the robot reference frame"""
         xyzwpr = Pose_2_Fanuc(pose)
@@ -519,8 +722,14 @@ class RobotPost(object):
         if labelName is not None:
             label = '%s:%s' % (label, labelName)
         label = '%s] ;' % (label)
+        if counterName != 'END_LBL':
+            self.LAST_LBL = labelName if labelName is not None else str(counter)
 
         self.addline(label, checkProgSize=checkProgSize)  # add to post
+        if self.WRITE_PASS_INDEX and counterName == 'PASS_LBL_COUNT':
+            self.PASS_INDEX.append({'pass': getattr(self, 'PASS_COUNT', len(self.PASS_INDEX)), 'label': counter,
+                                    'name': labelName, 'program': self.PROG_NAME, 'page': self.PROG_NAME_CURRENT,
+                                    'line': None, 'end_page': None, 'end_line': None, 'p_first': None, 'p_last': None, 'time': 0.0})
 
         # set counter
         counter += 1
@@ -664,7 +873,11 @@ class RobotPost(object):
             #pass
             for i in range(0,len(message), 20):
                 i2 = min(i + 20, len(message))
+                page = self.PROG_NAME_CURRENT
                 self.addline('! %s ;' % message[i:i2])
+                if i > 0 and page == self.PROG_NAME_CURRENT and self.PROG and self.PROG[-1].endswith('! %s ;' % message[i:i2]):
+                    # next chunk of the same message (peephole merges them)
+                    self.COMMENT_NEXT.add(len(self.PROG) - 1)
                 
         else:
             for i in range(0,len(message), 20):
@@ -700,6 +913,10 @@ class RobotPost(object):
 
 # ------------------ private ----------------------
     def page_size_control(self):
+        if self.LINE_COUNT >= self.MAX_LINES_X_PROG and self.PEEPHOLE and not self.PEEPHOLE_PAGE:
+            # optimize the page once before splitting it
+            self.PEEPHOLE_PAGE = True
+            self.peephole()
         if self.LINE_COUNT >= self.MAX_LINES_X_PROG:
             #self.nLines = 0
             self.stopPassLoop()
@@ -723,6 +940,463 @@ class RobotPost(object):
         """Add a line at the end of the program (used for targets)"""
         self.PROG_TARGETS.append(newline)
         
+    def peephole(self):
+        """Remove the redundant lines of the current page and number the lines again.
+        The frame, tool and timer state is forgotten at every label (jump target) and call."""
+        uframe = None
+        utool = None
+        timers_reset = set()
+        reachable = True
+        dropping = None     # comment of a removed frame/tool selection: 'UF'/'UT', '' for the next chunks
+        comment = None      # (message, number of lines) of the last comment
+        keep = []           # indexes of the lines kept
+        lines = []          # movetype and instruction of the lines kept
+        continued = []      # the line kept continues the comment of the line before
+        for index, line in enumerate(self.PROG):
+            code = line.split(':', 1)[1]
+            ins = code[2:]
+            if ins.startswith('LBL['):
+                # jump target: the state is unknown
+                reachable = True
+                uframe = None
+                utool = None
+                timers_reset = set()
+            elif not reachable and not ins.startswith('P['):
+                # unreachable code is removed, except the moves: their targets stay in /POS
+                continue
+
+            if ins.startswith('! '):
+                text = ins[2:-2]
+                following = index in self.COMMENT_NEXT
+                if dropping is not None and (following if dropping == '' else text.startswith(dropping)):
+                    # comment written with a removed frame/tool selection
+                    dropping = ''
+                    continue
+                dropping = None
+                if comment is not None and following:
+                    # next chunk of a message (RunMessage splits messages every 20 characters):
+                    # split the message again in lines of COMMENT_MAX characters
+                    text = comment[0] + text
+                    del lines[-comment[1]:]
+                    del keep[-comment[1]:]
+                    del continued[-comment[1]:]
+                chunks = [text[i:i+self.COMMENT_MAX] for i in range(0, len(text), self.COMMENT_MAX)]
+                for i, chunk in enumerate(chunks):
+                    keep.append(index)
+                    lines.append('%s! %s ;' % (code[0:2], chunk))
+                    continued.append(i > 0)
+                comment = (text, len(chunks))
+                continue
+            dropping = None
+            comment = None
+
+            match = re.match(r'(UFRAME_NUM|UTOOL_NUM)=(\d+) ;$', ins)
+            if match is not None:
+                value = int(match.group(2))
+                if match.group(1) == 'UFRAME_NUM':
+                    if uframe == value:
+                        dropping = 'UF'
+                        continue
+                    uframe = value
+                else:
+                    if utool == value:
+                        dropping = 'UT'
+                        continue
+                    utool = value
+
+            match = re.match(r'WAIT( +)([\d.]+)\(sec\) ;$', ins)
+            if match is not None and lines:
+                previous = re.match(r'WAIT( +)([\d.]+)\(sec\) ;$', lines[-1][2:])
+                if previous is not None:
+                    lines[-1] = '%sWAIT%s%.2f(sec) ;' % (code[0:2], previous.group(1), float(previous.group(2)) + float(match.group(2)))
+                    continue
+
+            match = re.match(r'TIMER\[(\d+)\]=(RESET|START|STOP) ;$', ins)
+            if match is not None:
+                if match.group(2) != 'RESET':
+                    timers_reset.discard(match.group(1))
+                elif match.group(1) in timers_reset:
+                    continue
+                else:
+                    timers_reset.add(match.group(1))
+
+            if 'CALL ' in ins:
+                # the program called can change the frames and timers
+                uframe = None
+                utool = None
+                timers_reset = set()
+            if ins.startswith('JMP LBL['):
+                # unconditional jump: the next lines are not reached until the next label
+                reachable = False
+            keep.append(index)
+            lines.append(code)
+            continued.append(False)
+
+        if len(lines) == len(self.PROG) and all(code == line.split(':', 1)[1] for code, line in zip(lines, self.PROG)):
+            return
+        self.PROG = ['%4i:%s' % (i + 1, code) for i, code in enumerate(lines)]
+        self.LINE_COUNT = len(self.PROG)
+        self.COMMENT_NEXT = set(i for i, flag in enumerate(continued) if flag)
+        if self.MOVES_PAGE:
+            position = {index: i for i, index in enumerate(keep)}
+            self.MOVES_PAGE = [(position[move[0]],) + tuple(move[1:]) for move in self.MOVES_PAGE if move[0] in position]
+
+    def turntable_str(self, angles):
+        """Target line with the turntable angles"""
+        return ','.join('\tJ%i=%10.3f deg' % (i+1, angle) for i, angle in enumerate(angles))
+
+    def unwind_turntable(self):
+        """Write the turntable angles of the current page with the turns that minimize the rotary travel"""
+        page = self.TURNTABLE_PAGE
+        self.TURNTABLE_PAGE = []
+        if len(page) == 0:
+            return
+        import turntable
+        written = turntable.unwind([target[1] for target in page], self.TURNTABLE_LAST, self.TURNTABLE_LIMITS)
+        for (index, angles), row in zip(page, written):
+            self.PROG_TARGETS[index] = self.turntable_str(row)
+        self.TURNTABLE_LAST = list(written[-1])
+        self.TURNTABLE_WRITTEN = written
+
+    def compact_ls(self):
+        """Write the current page (header, /MN and /POS) with minimal whitespace and the target numbers
+        rounded to COMPACT_DECIMALS. The values are the ones of the standard page rounded half away from zero."""
+        decimals = self.COMPACT_DECIMALS
+        for unit in ('mm', 'deg', 'track'):
+            if not 0 <= decimals[unit] <= 3:
+                raise Exception('COMPACT_DECIMALS must be between 0 and 3 (%s: %s)' % (unit, decimals[unit]))
+
+        def number(match):
+            name, integer, fraction, unit = match.groups()
+            if unit == 'mm' and name[0] in 'JE':
+                kind = 'track'
+            else:
+                kind = unit
+            # exact rounding of the 3 decimals written in the standard page
+            value = int(integer + fraction)
+            step = 10**(3 - decimals[kind])
+            rounded = (abs(value) + step//2)//step
+            digits = str(rounded).rjust(decimals[kind] + 1, '0')
+            if decimals[kind] > 0:
+                text = digits[:-decimals[kind]] + '.' + (digits[-decimals[kind]:].rstrip('0') or '0')
+            else:
+                text = digits + '.0'
+            if value < 0 and rounded > 0:
+                text = '-' + text
+            return '%s=%s %s' % (name, text, unit)
+
+        size = sum(len(line) + 1 for line in self.PROG)
+        header = [line for line in self.PROG[0].split('\n') if line.startswith(('/', 'DEFAULT_GROUP', 'LINE_TRACK', 'CONTINUE_TRACK'))]
+        lines = ['\n'.join(re.sub(r'\s+', ' ', line) for line in header)]
+        pos = self.PROG.index('/POS')
+        lines += [line.lstrip(' ') for line in self.PROG[1:pos]]
+        token = re.compile(r'([A-Z]\d?) *= *(-?\d+)\.(\d{3}) *(mm|deg)')
+        for line in self.PROG[pos:]:
+            line = token.sub(number, line).replace('\t', '')
+            lines.append(re.sub(r' {2,}', ' ', line).strip(' '))
+        self.PROG = lines
+        compact = sum(len(line) + 1 for line in lines)
+        self.addlog('%s: %i bytes (%i bytes standard, %.1f%% smaller)' % (self.PROG_NAME_CURRENT, compact, size, 100.0*(size - compact)/size))
+
+    def move_batch(self, movetype, poses, joints, conf_RLF=None):
+        """Add N moves with the targets and the program lines formatted in bulk, page by page"""
+        import numpy as np
+        import jointcheck
+        joints = np.asarray(joints, dtype=float)
+        n = joints.shape[0]
+        if n == 0:
+            return
+        xyzwpr = None
+        if poses is not None and len(poses) and isinstance(poses[0], Mat):
+            poses = [pose.rows for pose in poses]
+        if poses is not None:
+            poses = np.asarray(poses, dtype=float)
+            if poses.ndim == 2:
+                xyzwpr = poses
+                poses = None
+            else:
+                # vectorized Pose_2_Fanuc
+                xyzwpr = np.empty((n, 6))
+                xyzwpr[:, 0:3] = poses[:, 0:3, 3]
+                r = poses[:, 0:3, 0:3]
+                xyzwpr[:, 3] = np.arctan2(r[:, 2, 1], r[:, 2, 2])
+                xyzwpr[:, 4] = np.arctan2(-r[:, 2, 0], np.sqrt(r[:, 0, 0]*r[:, 0, 0] + r[:, 1, 0]*r[:, 1, 0]))
+                xyzwpr[:, 5] = np.arctan2(r[:, 1, 0], r[:, 0, 0])
+                up = r[:, 2, 0] > 1.0 - 1e-6
+                down = r[:, 2, 0] < -1.0 + 1e-6
+                xyzwpr[up, 3:6] = np.stack((np.zeros(up.sum()), np.full(up.sum(), -math.pi/2), np.arctan2(-r[up, 1, 2], r[up, 1, 1])), axis=1)
+                xyzwpr[down, 3:6] = np.stack((np.zeros(down.sum()), np.full(down.sum(), math.pi/2), np.arctan2(r[down, 1, 2], r[down, 1, 1])), axis=1)
+                xyzwpr[:, 3:6] *= 180/math.pi
+
+        def pose_i(i):
+            if poses is not None:
+                return Mat(poses[i].tolist())
+            if xyzwpr is not None:
+                return Fanuc_2_Pose(xyzwpr[i].tolist())
+            return None
+
+        if movetype == 'L':
+            cartesian = xyzwpr is not None
+            speed = self.REG_SPEED if hasattr(self, 'REG_SPEED') else self.SPEED
+            move_ins = '%s %s' % (speed, self.CNT_VALUE)
+            if hasattr(self, 'COORD'):
+                move_ins = '%s COORD' % (move_ins)
+            if hasattr(self, 'TIMEAFTER'):
+                move_ins = '%s %s' % (move_ins, self.TIMEAFTER)
+            if hasattr(self, 'P_OFFSET'):
+                move_ins = '%s %s' % (move_ins, self.P_OFFSET)
+            if hasattr(self, 'TOOL_OFFSET'):
+                move_ins = '%s %s' % (move_ins, self.TOOL_OFFSET)
+        else:
+            cartesian = False
+            move_ins = '%s %s' % (self.JOINT_SPEED, self.CNT_VALUE)
+
+        if self.REPEAT_POSE or (self.nProgs > 1 and not self.INCLUDE_SUB_PROGRAMS):
+            # same target for every move or program not written: one move at a time
+            conf = np.asarray(conf_RLF) if conf_RLF is not None else None
+            move = self.MoveL if movetype == 'L' else self.MoveJ
+            for i in range(n):
+                move(pose_i(i), joints[i].tolist(), (conf[i] if conf.ndim == 2 else conf).tolist() if conf is not None else None)
+            return
+
+        if cartesian:
+            config = [[c]*n for c in self.JOINT_CONFIG]
+            if conf_RLF is not None:
+                conf = np.broadcast_to(np.asarray(conf_RLF).reshape(-1, 3), (n, 3)) > 0
+                for column, axis, flag in ((0, 2, 'F'), (1, 1, 'D'), (2, 0, 'B')):
+                    config[column] = [flag if on else c for on, c in zip(conf[:, axis].tolist(), config[column])]
+            turns = [jointcheck.angle_2_turn(joints[:, axis]).tolist() for axis in (0, 3, 5)]
+            # one row of values per target line
+            rows_config = list(zip(*(config + turns)))
+            rows_xyz = [tuple(row) for row in xyzwpr[:, 0:3].tolist()]
+            rows_wpr = [tuple(row) for row in xyzwpr[:, 3:6].tolist()]
+        else:
+            rows_123 = [tuple(row) for row in joints[:, 0:3].tolist()]
+            rows_456 = [tuple(row) for row in joints[:, 3:6].tolist()]
+        add_comma = "," if self.HAS_TRACK and self.GRP_TRACK == 0 else ""
+        uf_ut = (self.ACTIVE_UF, self.ACTIVE_UT)
+        fmt_config = '    UF : %i, UT : %i,        CONFIG : \'%%s %%s %%s, %%i, %%i, %%i\',' % uf_ut
+        fmt_xyz = '\tX =%10.3f  mm,\tY =%10.3f  mm,\tZ =%10.3f  mm,'
+        fmt_wpr = '\tW =%10.3f deg,\tP =%10.3f deg,\tR =%10.3f deg' + add_comma
+        fmt_123 = '\tJ1=    %.3f deg,\tJ2=    %.3f deg,\tJ3=    %.3f deg,'
+        fmt_456 = '\tJ4=    %.3f deg,\tJ5=    %.3f deg,\tJ6=    %.3f deg' + add_comma
+
+        # external axes lines (same as add_target_external)
+        external = []   # (constant line, None) or (format, values per target)
+        if self.HAS_TRACK:
+            track = [tuple(row) for row in joints[:, self.AXES_TRACK].tolist()]
+            if self.GRP_TRACK > 0:
+                external.append(('   GP%i:' % (self.GRP_TRACK), None))
+                external.append(('    UF : %i, UT : %i,' % uf_ut, None))
+                external.append((','.join('\tJ%i=%%10.3f mm' % (i+1) for i in range(len(self.AXES_TRACK))), track))
+            elif self.GRP_TRACK == 0:
+                external.append((','.join('\tE%i=%%10.3f  mm' % (i+1) for i in range(len(self.AXES_TRACK))), track))
+            else:
+                external.append(('', None))
+        turntable = None
+        if self.HAS_TURNTABLE:
+            external.append(('   GP%i:' % (self.GRP_TURNTABLE), None))
+            external.append(('    UF : %i, UT : %i,' % uf_ut, None))
+            turntable = joints[:, self.AXES_TURNTABLE]
+            if self.TURNTABLE_UNWIND:
+                # written at ProgFinish (unwind_turntable)
+                turntable_line = 5 + len(external)
+                external.append(('', None))
+            else:
+                angles = np.where(turntable > 360, np.mod(turntable, 360), turntable)
+                external.append((','.join('\tJ%i=%%10.3f deg' % (i+1) for i in range(len(self.AXES_TURNTABLE))), [tuple(row) for row in angles.tolist()]))
+        lines_x_target = 6 + len(external)
+
+        line_ins = '%%4i:%s P[%%i] %s ;' % (movetype, move_ins.replace('%', '%%'))
+        offsets = (getattr(self, 'P_OFFSET', None), getattr(self, 'TOOL_OFFSET', None))
+        auto_cnt = self.AUTO_CNT and movetype == 'L' and cartesian
+
+        i = 0
+        while i < n:
+            self.page_size_control()
+            end = min(n, i + max(self.MAX_LINES_X_PROG - self.LINE_COUNT, 1))
+            count = end - i
+            ids = range(self.P_COUNT + 1, self.P_COUNT + 1 + count)
+            columns = [['P[%i]{' % pid for pid in ids], ['   GP1:']*count]
+            if cartesian:
+                columns.append([fmt_config % row for row in rows_config[i:end]])
+                columns.append([fmt_xyz % row for row in rows_xyz[i:end]])
+                columns.append([fmt_wpr % row for row in rows_wpr[i:end]])
+            else:
+                columns.append(['    UF : %i, UT : %i,    ' % uf_ut]*count)
+                columns.append([fmt_123 % row for row in rows_123[i:end]])
+                columns.append([fmt_456 % row for row in rows_456[i:end]])
+            for fmt, values in external:
+                columns.append([fmt]*count if values is None else [fmt % row for row in values[i:end]])
+            columns.append(['};']*count)
+            first = len(self.PROG_TARGETS)
+            for block in zip(*columns):
+                self.PROG_TARGETS.extend(block)
+            if turntable is not None and self.TURNTABLE_UNWIND:
+                self.TURNTABLE_PAGE.extend((first + k*lines_x_target + turntable_line, turntable[i + k].tolist()) for k in range(count))
+            if self.CHECK_JOINTS:
+                self.JOINTS_PAGE.extend(zip(ids, [self.LAST_LBL]*count, joints[i:end].tolist()))
+            first = len(self.PROG)
+            self.PROG.extend(line_ins % (self.LINE_COUNT + 1 + k, pid) for k, pid in enumerate(ids))
+            if auto_cnt:
+                self.MOVES_PAGE.extend((first + k, xyzwpr_row[0:3], offsets) for k, xyzwpr_row in enumerate(xyzwpr[i:end].tolist()))
+            self.P_COUNT += count
+            self.LINE_COUNT += count
+            i = end
+        if self.WRITE_PASS_INDEX and movetype == 'L' and cartesian:
+            xyz = xyzwpr[:, 0:3]
+            if self.LAST_POSE is not None:
+                xyz = np.vstack((self.LAST_POSE.Pos(), xyz))
+            self.add_pass_time(float(np.linalg.norm(np.diff(xyz, axis=0), axis=1).sum()))
+        self.LAST_POSE = pose_i(n - 1)
+        self.LAST_JOINTS = joints[-1].tolist()
+
+    def pipeline_page(self):
+        """Save the finished page in PIPELINE_FOLDER and queue it for the background upload (PIPELINED_SEND)"""
+        import os
+        if self.FTP_HOST is None or self.PIPELINE_FOLDER is None:
+            raise Exception("PIPELINED_SEND requires FTP_HOST and PIPELINE_FOLDER")
+        if self.PIPELINE is None:
+            if not os.path.isdir(self.PIPELINE_FOLDER):
+                os.makedirs(self.PIPELINE_FOLDER)
+            self.PIPELINE = UploadQueueFTP(self.FTP_HOST, self.FTP_PATH, self.FTP_USER, self.FTP_PASS, self.FTP_BLOCK_SIZE)
+        nfiles = len(self.PROG_FILES)
+        self.PIPELINE_CALLS[self.PROG_NAME_CURRENT] = set(re.findall(r'\bCALL (\w+)', '\n'.join(line for line in self.PROG if 'CALL ' in line)))
+        self.progsave(self.PIPELINE_FOLDER, self.PROG_NAME_CURRENT)
+        self.PIPELINE_NAMES.add(self.PROG_NAME_CURRENT)
+        for filesave in self.PROG_FILES[nfiles:]:
+            self.PIPELINE.put(filesave)
+
+    def pipeline_finish(self):
+        """Wait for the background upload (PIPELINED_SEND) and add the errors to the LOG"""
+        results = self.PIPELINE.close()
+        self.PIPELINE = None
+        errors = [(filesave, error) for filesave, error, size, elapsed in results if error is not None]
+        for filesave, error in errors:
+            self.addlog('Not sent: %s (%s)' % (filesave, error))
+        size = sum(result[2] for result in results)
+        if errors:
+            print("POPUP: <font color=\"red\">%i of %i files could not be sent to %s</font>" % (len(errors), len(results), self.FTP_HOST))
+        else:
+            print("POPUP: <font color=\"blue\">Done: %i files (%i bytes) sent to %s</font>" % (len(results), size, self.FTP_HOST))
+        sys.stdout.flush()
+
+    def add_pass_time(self, length):
+        """Add the time of a linear move of length mm at the programmed speed to the current pass"""
+        if len(self.PASS_INDEX) == 0 or not self.SPEED.endswith('mm/sec'):
+            return
+        speed = float(self.SPEED[:-len('mm/sec')])
+        if speed > 0:
+            self.PASS_INDEX[-1]['time'] += length/speed
+
+    def index_passes(self):
+        """Set the lines and P[] of the passes in the current page (WRITE_PASS_INDEX). A pass goes from its
+        label to its last move, on the same page or on the next pages of the program."""
+        labels = {}
+        current = None
+        for entry in self.PASS_INDEX:
+            if entry['page'] == self.PROG_NAME_CURRENT:
+                labels[entry['label']] = entry
+            elif entry['program'] == self.PROG_NAME:
+                # pass started in a previous page
+                current = entry
+        for line in self.PROG:
+            match = re.match(r' *(\d+):(?:  LBL\[(\d+))?', line)
+            if match is None:
+                continue
+            if match.group(2) is not None and int(match.group(2)) in labels:
+                current = labels[int(match.group(2))]
+                current['line'] = int(match.group(1))
+                continue
+            refs = re.findall(r'(?<![A-Z])P\[(\d+)\]', line)
+            if current is None or len(refs) == 0:
+                continue
+            if current['p_first'] is None:
+                current['p_first'] = int(refs[0])
+            current['p_last'] = int(refs[-1])
+            current['end_page'] = self.PROG_NAME_CURRENT
+            current['end_line'] = int(match.group(1))
+
+    def pass_index_programs(self, split_progs):
+        """Programs of the pass index: [{'name', 'main', 'pages'}, ...]"""
+        programs = []
+        pages_split = dict((pages[0], pages) for pages in split_progs if len(pages) > 1)
+        names_split = set(name for pages in pages_split.values() for name in pages)
+        for name in self.PROG_NAMES:
+            if name in pages_split:
+                programs.append({'name': name, 'main': get_safe_name("M_" + name), 'pages': pages_split[name]})
+            elif name not in names_split:
+                programs.append({'name': name, 'main': name, 'pages': [name]})
+        return programs
+
+    def save_pass_index(self, folder, progname, programs):
+        """Save the pass index <progname>_passes.json (WRITE_PASS_INDEX)"""
+        import os
+        import json
+        index = {'register': getattr(self, 'J_LBL_REGISTER', None), 'programs': programs, 'calls': self.MAIN_CALLS,
+                 'passes': self.PASS_INDEX}
+        filesave = os.path.join(folder, progname + '_passes.json')
+        with open(filesave, 'w') as fid:
+            json.dump(index, fid, indent=1)
+        self.addlog('Pass index: %s (%i passes)' % (filesave, len(self.PASS_INDEX)))
+
+    def check_joints(self):
+        """Add the joint continuity issues of the current page to the log"""
+        if len(self.JOINTS_PAGE) > 1:
+            import jointcheck
+            naxes = min(len(target[2]) for target in self.JOINTS_PAGE)
+            joints = [target[2][:naxes] for target in self.JOINTS_PAGE]
+            labels = [target[1] for target in self.JOINTS_PAGE]
+            # unwound turntable angles of the page (unwind_turntable runs before)
+            written = self.TURNTABLE_WRITTEN if self.TURNTABLE_UNWIND and self.TURNTABLE_WRITTEN is not None and len(self.TURNTABLE_WRITTEN) == len(joints) else None
+            for index, label, kind, message in jointcheck.analyze(joints, self.AXES_TYPE, labels, written=written):
+                if label:
+                    self.addlog('%s P[%i] (%s): %s' % (self.PROG_NAME_CURRENT, self.JOINTS_PAGE[index][0], label, message))
+                else:
+                    self.addlog('%s P[%i]: %s' % (self.PROG_NAME_CURRENT, self.JOINTS_PAGE[index][0], message))
+        self.JOINTS_PAGE = []
+        self.TURNTABLE_WRITTEN = None
+
+    def auto_cnt(self):
+        """Set the CNT value (FINE or CNT1 to CNT_MAX) of the linear moves of the current page from the corner
+        they make with the next move"""
+        moves = self.MOVES_PAGE
+        self.MOVES_PAGE = []
+        events = ('WAIT', 'DO[', 'RO[', 'AO[', 'GO[', 'CALL', 'PAUSE', 'JMP', 'IF')
+        for i in range(1, len(moves) - 1):
+            index, point, offsets = moves[i]
+            line = self.PROG[index]
+            match = re.search(r' (CNT\d+|FINE)', line)
+            if match is None or ' TA ' in line:
+                # moves with a time after event are not changed
+                continue
+            if moves[i-1][2] != offsets or moves[i+1][2] != offsets:
+                # approach, depart and other moves where the offset changes are not changed
+                continue
+            cnt = int(self.CNT_MAX)
+            # instructions before the next move run when the robot starts rounding the corner
+            for other in self.PROG[index+1:moves[i+1][0]]:
+                if other[6:].lstrip().startswith(events):
+                    cnt = 0
+                    break
+            if cnt > 0:
+                v_in = subs3(point, moves[i-1][1])
+                v_out = subs3(moves[i+1][1], point)
+                l_in = norm(v_in)
+                l_out = norm(v_out)
+                if l_in <= 1e-6 or l_out <= 1e-6:
+                    # repeated target (start/stop sequences): no corner to measure
+                    continue
+                angle = math.acos(max(-1.0, min(1.0, dot(v_in, v_out)/(l_in*l_out))))
+                # deviation from the corner when the rounding starts at CNT% of half the shortest segment
+                deviation = 0.5*min(l_in, l_out)*math.sin(0.5*angle)
+                if deviation > self.CNT_TOLERANCE:
+                    cnt = min(cnt, int(100.0*self.CNT_TOLERANCE/deviation))
+            if cnt < 1:
+                self.PROG[index] = line[:match.start()] + ' FINE' + line[match.end():]
+            else:
+                self.PROG[index] = line[:match.start()] + ' CNT%i' % cnt + line[match.end():]
+
     def addlog(self, newline):
         """Add a log message"""
         if self.nProgs > 1 and not self.INCLUDE_SUB_PROGRAMS:
@@ -730,22 +1404,8 @@ class RobotPost(object):
         self.LOG = self.LOG + newline + '\n'
         
 # ------------------ targets ----------------------         
-    def add_target_joints(self, pose, joints):
-        if self.nProgs > 1 and not self.INCLUDE_SUB_PROGRAMS:
-            return
-
-        if self.REPEAT_POSE:
-            return self.P_COUNT
-
-        self.P_COUNT = self.P_COUNT + 1
-        add_comma = ""
-        if self.HAS_TRACK and self.GRP_TRACK == 0:
-            add_comma = ","
-        self.addline_targets('P[%i]{' % self.P_COUNT)
-        self.addline_targets('   GP1:')
-        self.addline_targets('    UF : %i, UT : %i,    ' % (self.ACTIVE_UF, self.ACTIVE_UT))
-        self.addline_targets('\tJ1=    %.3f deg,\tJ2=    %.3f deg,\tJ3=    %.3f deg,' % (joints[0], joints[1], joints[2]))
-        self.addline_targets('\tJ4=    %.3f deg,\tJ5=    %.3f deg,\tJ6=    %.3f deg%s' % (joints[3], joints[4], joints[5], add_comma))
+    def add_target_external(self, joints):
+        """Add the external axes (track and turntable) of a target"""
         if self.HAS_TRACK:
             # adding external axes (linear track):
             track_str = ''
@@ -763,12 +1423,33 @@ class RobotPost(object):
             # adding rotative axes (turntable):
             self.addline_targets('   GP%i:' % (self.GRP_TURNTABLE))
             self.addline_targets('    UF : %i, UT : %i,' % (self.ACTIVE_UF, self.ACTIVE_UT))
-            turntable_str = ''
-            for i in range(len(self.AXES_TURNTABLE)):
-                angle = (joints[self.AXES_TURNTABLE[i]] % 360) if joints[self.AXES_TURNTABLE[i]] > 360 else joints[self.AXES_TURNTABLE[i]]
-                turntable_str = turntable_str + '\tJ%i=%10.3f deg,' % (i+1, angle)
-            turntable_str = turntable_str[:-1]
-            self.addline_targets(turntable_str)
+            if self.TURNTABLE_UNWIND:
+                # written at ProgFinish (unwind_turntable)
+                self.TURNTABLE_PAGE.append((len(self.PROG_TARGETS), [joints[i] for i in self.AXES_TURNTABLE]))
+                self.addline_targets('')
+            else:
+                angles = [(joints[i] % 360) if joints[i] > 360 else joints[i] for i in self.AXES_TURNTABLE]
+                self.addline_targets(self.turntable_str(angles))
+
+    def add_target_joints(self, pose, joints):
+        if self.nProgs > 1 and not self.INCLUDE_SUB_PROGRAMS:
+            return
+
+        if self.REPEAT_POSE:
+            return self.P_COUNT
+
+        self.P_COUNT = self.P_COUNT + 1
+        if self.CHECK_JOINTS:
+            self.JOINTS_PAGE.append((self.P_COUNT, self.LAST_LBL, joints))
+        add_comma = ""
+        if self.HAS_TRACK and self.GRP_TRACK == 0:
+            add_comma = ","
+        self.addline_targets('P[%i]{' % self.P_COUNT)
+        self.addline_targets('   GP1:')
+        self.addline_targets('    UF : %i, UT : %i,    ' % (self.ACTIVE_UF, self.ACTIVE_UT))
+        self.addline_targets('\tJ1=    %.3f deg,\tJ2=    %.3f deg,\tJ3=    %.3f deg,' % (joints[0], joints[1], joints[2]))
+        self.addline_targets('\tJ4=    %.3f deg,\tJ5=    %.3f deg,\tJ6=    %.3f deg%s' % (joints[3], joints[4], joints[5], add_comma))
+        self.add_target_external(joints)
         self.addline_targets('};')
         return self.P_COUNT
     
@@ -786,7 +1467,7 @@ class RobotPost(object):
                 return -math.floor((-angle+180.0)/360.0)
         #return add_target_joints(pose, joints) # using joints as targets is safer to avoid problems setting up the reference frame and configurations
         xyzwpr = Pose_2_Fanuc(pose)
-        config = self.JOINT_CONFIG #normal        
+        config = list(self.JOINT_CONFIG) #normal (copy: the flags of one target must not change the next ones)        
         #config= ['F','D','B'] #alternative
         if conf_RLF is not None:
             if conf_RLF[2] > 0:
@@ -801,6 +1482,8 @@ class RobotPost(object):
         turnJ6 = angle_2_turn(joints[5])
 
         self.P_COUNT = self.P_COUNT + 1
+        if self.CHECK_JOINTS:
+            self.JOINTS_PAGE.append((self.P_COUNT, self.LAST_LBL, joints))
 
         add_comma = ""
         if self.HAS_TRACK and self.GRP_TRACK == 0:
@@ -810,29 +1493,7 @@ class RobotPost(object):
         self.addline_targets('    UF : %i, UT : %i,        CONFIG : \'%c %c %c, %i, %i, %i\',' % (self.ACTIVE_UF, self.ACTIVE_UT, config[0], config[1], config[2], turnJ1, turnJ4, turnJ6))        
         self.addline_targets('\tX =%10.3f  mm,\tY =%10.3f  mm,\tZ =%10.3f  mm,' % (xyzwpr[0], xyzwpr[1], xyzwpr[2]))
         self.addline_targets('\tW =%10.3f deg,\tP =%10.3f deg,\tR =%10.3f deg%s' % (xyzwpr[3], xyzwpr[4], xyzwpr[5], add_comma))
-        if self.HAS_TRACK:
-            # adding external axes (linear track):
-            track_str = ''
-            if self.GRP_TRACK > 0:
-                self.addline_targets('   GP%i:' % (self.GRP_TRACK))
-                self.addline_targets('    UF : %i, UT : %i,' % (self.ACTIVE_UF, self.ACTIVE_UT))
-                for i in range(len(self.AXES_TRACK)):
-                    track_str = track_str + '\tJ%i=%10.3f mm,' % (i+1, joints[self.AXES_TRACK[i]])
-            elif self.GRP_TRACK == 0:
-                for i in range(len(self.AXES_TRACK)):
-                    track_str = track_str + '\tE%i=%10.3f  mm,' % (i+1, joints[self.AXES_TRACK[i]])
-            track_str = track_str[:-1]
-            self.addline_targets(track_str)
-        if self.HAS_TURNTABLE:
-            # adding rotative axes (turntable):
-            self.addline_targets('   GP%i:' % (self.GRP_TURNTABLE))
-            self.addline_targets('    UF : %i, UT : %i,' % (self.ACTIVE_UF, self.ACTIVE_UT))
-            turntable_str = ''
-            for i in range(len(self.AXES_TURNTABLE)):
-                angle = (joints[self.AXES_TURNTABLE[i]] % 360) if joints[self.AXES_TURNTABLE[i]] > 360 else joints[self.AXES_TURNTABLE[i]]
-                turntable_str = turntable_str + '\tJ%i=%10.3f deg,' % (i+1, angle)
-            turntable_str = turntable_str[:-1]
-            self.addline_targets(turntable_str)
+        self.add_target_external(joints)
         self.addline_targets('};')
         return self.P_COUNT
     
@@ -45,13 +45,31 @@ DRIPFEED_FILE = """# Drip Feed python script generated by RoboDK for Fanuc robot
 # You can double click this file to run the script
 # Make sure to install RoboDK on the computer you want to use to dripfeed your program
 # (a RoboDK license is not required to run this script)
+#
+# The feeder keeps two FTP connections to the robot: one reads the program state
+# (md:prgstate.dg, in memory) and the other one sends and deletes the pages. Both run in
+# their own thread under asyncio, so the next pages are sent while the state is read.
+#
+# The number of pages on the robot adapts to the job: pages are sent ahead of the running
+# page until the program ahead of it runs LEAD_FACTOR times longer than sending the next
+# page takes, within STORAGE_BUDGET bytes on the robot. The run time of every page is
+# estimated from the distances and speeds of its moves (LS file), scaled by the run time
+# measured on the pages already run, and the upload time is measured on the files sent.
+#
+# The page running and the files uploaded and deleted are saved in CHECKPOINT_FILE after
+# every page and transfer. If the feeder stops (crash, network down), run it again: it
+# compares the checkpoint with the files on the robot and prgstate.dg, sends only the
+# missing pages and carries on from the page running.
 
+import io
 import os
 import sys
+import json
 import time
-import socket
+import asyncio
 import ftplib
-from ftplib import FTP
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 RobotFTPIP = "%s"
 RobotFTPPath = "%s"
@@ -62,120 +80,522 @@ flFilesToSend = %s
 
 # Define timeout to reconnect or send in Seconds
 TIMEOUT = 1
+# Time between reads of the program state in Seconds
+POLL = 0.2
+# Smallest and largest number of files on the robot from the running file (included)
+WINDOW_MIN = 3
+WINDOW_MAX = 20
+# Bytes of programs on the robot at the same time (main program included)
+STORAGE_BUDGET = %i
+# Program to keep on the robot ahead of the running file, in times the time to send the next file
+LEAD_FACTOR = 4.0
+# Log the files that start with less program ahead of them than NEAR_STARVE times the time to send the next file
+NEAR_STARVE = 2.0
+# Folder of the state files of the controller
+STATUS_PATH = "md:"
+# Progress of the job, to resume it when the feeder is run again (next to this script)
+CHECKPOINT_FILE = fMainFile[:-3] + "_dripfeed.json"
 
-# Fix robot path
-# RobotFTPPath = r'''\''' + RobotFTPPath
 
-def SafeFTPDelete(filename, show_warning=False):
-    filesave_TP = filename[:-3] + '.tp'
-    try:
-        ftpRobot.delete(filesave_TP.lower())
-    except:
-        if show_warning and filesave_TP == filename:
-            print("Warning! Unable to delete file: " + filesave_TP.lower())
-        
-    filesave_LS = filename[:-3] + '.ls'
-    try:
-        ftpRobot.delete(filesave_LS.lower())
-    except:
-        if show_warning and filesave_LS == filename:
-            print("Warning! Unable to delete file: " + filesave_LS.lower())
-        
+class Session(object):
+    # One FTP connection to the robot, used from its own thread
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.ftp = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def connect(self):
+        self.ftp = ftplib.FTP(RobotFTPIP, timeout=10)
+        self.ftp.login(RobotFTPUsername, RobotFTPPassword)
+        self.ftp.cwd(self.path)
+
+    def close(self):
+        if self.ftp is not None:
+            try:
+                self.ftp.quit()
+            except ftplib.all_errors:
+                self.ftp.close()
+            self.ftp = None
+
+    def call(self, function, *args):
+        if self.ftp is None:
+            self.connect()
+        try:
+            return function(self.ftp, *args)
+        except ftplib.all_errors:
+            # connect again on the next call
+            self.close()
+            raise
+
+    async def run(self, function, *args):
+        # Run function(ftp, *args) in the thread of the session
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self.call, function, *args)
+
+    async def run_retry(self, function, *args):
+        # Run function(ftp, *args) until it works
+        while True:
+            try:
+                return await self.run(function, *args)
+            except ftplib.all_errors as e:
+                print("    " + self.name + " connection: " + str(e))
+                await asyncio.sleep(TIMEOUT)
+
+
+def ReadFTPFile(ftp, filename):
+    buffer = io.BytesIO()
+    ftp.retrbinary('RETR ' + filename, buffer.write)
+    return buffer.getvalue().decode('ascii', 'replace')
+
+def SafeFTPDelete(ftp, filename, show_warning=False):
+    for filesave in (filename[:-3] + '.tp', filename[:-3] + '.ls'):
+        try:
+            ftp.delete(filesave.lower())
+        except ftplib.error_perm:
+            if show_warning and filesave.lower() == filename.lower():
+                print("Warning! Unable to delete file: " + filesave.lower())
     return 0
-    
-def SendFTPFile(filename):
+
+def LocalFile(filename):
     # first, try TP file:
     filesave_TP = filename[:-3] + '.TP'
     if filename.endswith(".LS") and os.path.isfile(filesave_TP):
-        filename = filesave_TP
-    
-    while True:
-        writeCmdFTP = ""
-        writeCmdFTP = "STOR " + filename
-        try:
-            print("Sending file: " + filename)
-            ftpRobot.storbinary(writeCmdFTP, open(filename, 'rb'))
-            return 0
-            
-        except:
-            print("    Error Sending File: " + filename + ". Is the robot running this program?")
-            time.sleep(TIMEOUT)
-        
-    return 0
-    
-def GetFilesFromFTP():
-    ftpRobot.cwd("md:")
-    ftpRobot.retrbinary('RETR curpos.dg', open('curpos.dg', 'wb+').write)
-    ftpRobot.retrbinary('RETR prgstate.dg', open('prgstate.dg', 'wb+').write)
-    ftpRobot.cwd(RobotFTPPath)
-    return
-    
-def GetCurrentTask():
-    curSubName = GetCurRunningTasks()
-    if (curSubName == []):
-        return -1
-        
-    curSubName = curSubName[0]
-    counter = 0
-    for compSubName in flFilesToSend:
-        compSubName = compSubName[:-3] #Truncate file extension
-        if (curSubName.upper() == compSubName.upper()):
-            return counter
-            
-        counter = counter + 1
-        
-    return -1
-    
-def GetCurJoints():
-    FILE_CURPOS = 'curpos.dg'
-    joints = [0]*20
-    nDOFs = 0
-    with open(FILE_CURPOS,'r') as fid:
-        lines = fid.readlines()
-        for line in lines:
+        return filesave_TP
+    return filename
+
+def SendFTPFile(ftp, filename):
+    filename = LocalFile(filename)
+    with open(filename, 'rb') as fid:
+        ftp.storbinary("STOR " + filename, fid)
+    return filename
+
+def PointNumber(token):
+    # P[12] or P[12:comment] -> 12
+    try:
+        return int(token[2:].split(']')[0].split(':')[0])
+    except ValueError:
+        return None
+
+def MoveSpeed(tokens):
+    # Speed of a move: (mm/s, None) or (None, s) for moves given in time, (None, None) if unknown (registers)
+    speed = tokens[0] if tokens else ''
+    for unit, factor in (('mm/sec', 1.0), ('cm/min', 10.0/60.0), ('inch/min', 25.4/60.0), ('msec', 0.001), ('sec', 1.0)):
+        if speed.endswith(unit):
+            try:
+                value = float(speed[:-len(unit)])*factor
+            except ValueError:
+                break
+            if unit.endswith('sec') and '/' not in unit:
+                return None, value
+            return value, None
+    return None, None
+
+def Distance(a, b):
+    return ((a[0]-b[0])**2 + (a[1]-b[1])**2 + (a[2]-b[2])**2)**0.5
+
+def EstimateRunTime(filename):
+    # Run time of a program from the distances and speeds of its linear and circular moves and its waits (Seconds).
+    # Joint moves and moves to joint targets are not counted, so the estimate is rather short than long.
+    # None if the LS file is not available.
+    filename = filename[:-3] + '.LS'
+    if not os.path.isfile(filename):
+        return None
+    moves = []
+    points = {}
+    section = ''
+    point = None
+    with open(filename) as fid:
+        for line in fid:
             line = line.strip()
-            if line.startswith("Joint ") and ':' in line:
-                lineinfo = line.replace(':',' ').split(' ')
-                lineinfo = [x for x  in lineinfo if x]
-                if len(lineinfo) >= 3:
-                    jid = int(lineinfo[1])
-                    jval = float(lineinfo[2])
-                    joints[nDOFs] = jval
-                    nDOFs += 1
-                    
-                else:
-                    print("Something is wrong: " + str(lineinfo))
-                    
-    joints = joints[:nDOFs]
+            if line.startswith('/'):
+                section = line.split()[0]
+            elif section == '/MN':
+                # "  5:L P[3] 200mm/sec CNT5 ;", the end point of circular moves is on the next line
+                if line[:1].isdigit() or line.startswith(':'):
+                    line = line.split(':', 1)[1]
+                tokens = line.replace(';', ' ').split()
+                if len(tokens) >= 2 and tokens[0] in ('J', 'L', 'C') and tokens[1].startswith('P['):
+                    moves.append([tokens[0], PointNumber(tokens[1]), None, tokens[2:]])
+                elif tokens and tokens[0].startswith('P[') and moves and moves[-1][0] == 'C' and moves[-1][2] is None:
+                    moves[-1][2] = PointNumber(tokens[0])
+                    moves[-1][3] = tokens[1:]
+                elif len(tokens) >= 2 and tokens[0] == 'WAIT' and tokens[1].endswith('(sec)'):
+                    moves.append(['WAIT', None, None, [tokens[1][:-5] + 'sec']])
+            elif section == '/POS':
+                if line.startswith('P['):
+                    point = PointNumber(line)
+                elif point is not None and point not in points and 'X' in line and 'mm' in line:
+                    # first group: X = 100.000 mm, Y = ...
+                    tokens = line.replace('=', ' = ').replace(',', ' ').split()
+                    xyz = []
+                    for name in ('X', 'Y', 'Z'):
+                        if name in tokens and tokens.index(name) + 2 < len(tokens):
+                            try:
+                                xyz.append(float(tokens[tokens.index(name) + 2]))
+                            except ValueError:
+                                pass
+                    if len(xyz) == 3:
+                        points[point] = xyz
+    seconds = 0.0
+    last = None
+    for kind, p1, p2, speed in moves:
+        mm_s, time_s = MoveSpeed(speed)
+        if kind == 'WAIT':
+            seconds += time_s or 0.0
+            continue
+        target = points.get(p2 if kind == 'C' else p1)
+        if kind != 'J' and last is not None and target is not None:
+            if kind == 'C' and points.get(p1) is not None:
+                path = Distance(last, points[p1]) + Distance(points[p1], target)
+            else:
+                path = Distance(last, target)
+            if time_s is not None:
+                seconds += time_s
+            elif mm_s:
+                seconds += path/mm_s
+        last = target
+    return seconds
+
+def ListFTPFiles(ftp):
+    try:
+        return [name.replace(':', '/').split('/')[-1] for name in ftp.nlst()]
+    except ftplib.error_perm:
+        return [] # empty folder
+
+def GetCurJoints(curpos):
+    joints = []
+    for line in curpos.splitlines():
+        line = line.strip()
+        if line.startswith("Joint ") and ':' in line:
+            lineinfo = [x for x in line.replace(':',' ').split(' ') if x]
+            if len(lineinfo) >= 3:
+                joints.append(float(lineinfo[2]))
+            else:
+                print("Something is wrong: " + str(lineinfo))
     return joints
-    
-def GetCurRunningTasks():
+
+def GetCurRunningTasks(prgstate):
+    # Subprograms called by the main program (running or paused)
     proglist = []
-    FILE_PRGSTAT = 'prgstate.dg'
-    with open(FILE_PRGSTAT,'r') as fid:
-        lines = fid.readlines()
-        for line in lines:
-            line = line.strip()
-            FindMainProgRunning = fMainFile
-            FindMainProgRunning = FindMainProgRunning[:-3] + " "
-            FindMainProgRunning = FindMainProgRunning + 'RUNNING @ '
-            FindMainProgRunning = FindMainProgRunning.upper()
-            FindMainProgPaused = fMainFile
-            FindMainProgPaused = FindMainProgRunning[:-3] + " "
-            FindMainProgPaused = FindMainProgRunning + 'PAUSED @ '
-            FindMainProgPaused = FindMainProgRunning.upper()
-            if FindMainProgRunning in line:
-                lineinfo = line.split(' ')
-                lineinfo = [x for x  in lineinfo if x]
-                proglist.append(lineinfo[6])
-                
-            elif FindMainProgPaused in line:
-                lineinfo = line.split(' ')
-                lineinfo = [x for x  in lineinfo if x]
-                proglist.append(lineinfo[6])
-                
+    main = fMainFile[:-3].upper()
+    for line in prgstate.splitlines():
+        lineinfo = [x for x in line.strip().split(' ') if x]
+        line = ' '.join(lineinfo).upper()
+        if (main + ' RUNNING @ ' in line or main + ' PAUSED @ ' in line) and '->' in lineinfo:
+            i = lineinfo.index('->')
+            if i + 1 < len(lineinfo):
+                proglist.append(lineinfo[i + 1])
     return proglist
-    
+
+def GetCurrentTask(prgstate):
+    curSubName = GetCurRunningTasks(prgstate)
+    if (curSubName == []):
+        return -1
+    curSubName = curSubName[0].upper()
+    for counter, compSubName in enumerate(flFilesToSend):
+        if curSubName == compSubName[:-3].upper():
+            return counter
+    return -1
+
+
+class Link(object):
+    # Measured time to send the files: latency of every file (FTP commands) + bytes/bandwidth
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.bytes2 = 0.0
+        self.bytes_seconds = 0.0
+
+    def add(self, nbytes, seconds):
+        self.count += 1
+        self.bytes += nbytes
+        self.seconds += seconds
+        self.bytes2 += nbytes*nbytes
+        self.bytes_seconds += nbytes*seconds
+
+    def SendTime(self, nbytes):
+        # Estimated time to send nbytes (None before the first page is sent)
+        if self.count == 0:
+            return None
+        mean_bytes = self.bytes/self.count
+        mean_seconds = self.seconds/self.count
+        variance = self.bytes2/self.count - mean_bytes*mean_bytes
+        if variance <= (0.1*mean_bytes)**2:
+            # files of about the same size: latency and bandwidth can not be told apart
+            return nbytes*self.seconds/max(self.bytes, 1)
+        per_byte = max((self.bytes_seconds/self.count - mean_bytes*mean_seconds)/variance, 0.0)
+        latency = mean_seconds - per_byte*mean_bytes
+        if latency < 0:
+            latency = 0.0
+            per_byte = self.bytes_seconds/self.bytes2
+        return latency + nbytes*per_byte
+
+
+class Checkpoint(object):
+    # Page running and programs uploaded and deleted (names without extension), saved after every change
+    def __init__(self):
+        self.page = -1
+        self.uploaded = set()
+        self.deleted = set()
+
+    def load(self):
+        # False if there is no checkpoint of this job (same main program and files)
+        try:
+            with open(CHECKPOINT_FILE) as fid:
+                data = json.load(fid)
+        except (OSError, ValueError):
+            return False
+        if data.get('main') != fMainFile or data.get('files') != flFilesToSend:
+            return False
+        self.page = data['page']
+        self.uploaded = set(data['uploaded'])
+        self.deleted = set(data['deleted'])
+        return True
+
+    def save(self):
+        data = {'main': fMainFile, 'files': flFilesToSend, 'page': self.page, 'uploaded': sorted(self.uploaded), 'deleted': sorted(self.deleted), 'time': time.time()}
+        with open(CHECKPOINT_FILE + '.tmp', 'w') as fid:
+            json.dump(data, fid)
+        os.replace(CHECKPOINT_FILE + '.tmp', CHECKPOINT_FILE)
+
+    def transfer(self, action, filename):
+        name = filename[:-3].upper()
+        if action == 'send':
+            self.uploaded.add(name)
+            self.deleted.discard(name)
+        else:
+            self.uploaded.discard(name)
+            self.deleted.add(name)
+        self.save()
+
+    def remove(self):
+        for filename in (CHECKPOINT_FILE, CHECKPOINT_FILE + '.tmp'):
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+
+TRANSFER_ORDER = itertools.count()
+
+def QueueTransfer(queue, action, filename, show_warning=False):
+    # Deletes go before the files waiting to be sent: they free memory on the robot
+    queue.put_nowait((0 if action == 'delete' else 1, next(TRANSFER_ORDER), action, filename, show_warning))
+
+
+async def Uploader(upload, queue, sent, link, checkpoint):
+    # Send or delete the files of the queue: ('send' or 'delete', file name, show warning)
+    while True:
+        transfer = await queue.get()
+        priority, order, action, filename, show_warning = transfer
+        t0 = time.time()
+        if action == 'send':
+            try:
+                filename = await upload.run(SendFTPFile, filename)
+            except ftplib.all_errors as e:
+                print("    Error Sending File: " + filename + ". Is the robot running this program? (" + str(e) + ")")
+                await asyncio.sleep(TIMEOUT)
+                # try again after the deletes queued meanwhile (the robot may be out of memory)
+                queue.put_nowait(transfer)
+                queue.task_done()
+                continue
+            sent[filename[:-3].upper()] = time.time()
+            if filename[:-3].upper() != fMainFile[:-3].upper():
+                # the main file is small: its time is mostly latency
+                link.add(os.path.getsize(filename), time.time() - t0)
+            print("Sent file: %%s (%%.2f s)" %% (filename, time.time() - t0))
+        else:
+            await upload.run_retry(SafeFTPDelete, filename, show_warning)
+        checkpoint.transfer(action, filename)
+        queue.task_done()
+
+
+async def DripFeed():
+    numFilesToSend = len(flFilesToSend)
+    status = Session("Status", STATUS_PATH)
+    upload = Session("Upload", RobotFTPPath)
+    while True:
+        print("")
+        print("Trying to connect to Fanuc robot controller: " + RobotFTPIP + " ...")
+        try:
+            await status.run(lambda ftp: None)
+            await upload.run(lambda ftp: None)
+            break
+        except ftplib.all_errors as e:
+            print("    " + str(e))
+            print("    Unable to connect. Make sure the FTP server is running and no other clients are connected.")
+            await asyncio.sleep(TIMEOUT)
+
+    print("")
+    print("Connected!")
+    print("")
+    print("Current robot position:")
+    print(GetCurJoints(await status.run_retry(ReadFTPFile, 'curpos.dg')))
+    print("")
+    print("Current running tasks:")
+    prgstate = await status.run_retry(ReadFTPFile, 'prgstate.dg')
+    print(GetCurRunningTasks(prgstate))
+    print("")
+    print("Files to send:")
+    print(flFilesToSend)
+
+    sizes = [os.path.getsize(LocalFile(filename)) for filename in flFilesToSend]
+    estimates = [EstimateRunTime(filename) for filename in flFilesToSend]
+    measured = []    # (file, run time) of the files seen running
+    print("")
+    print("Estimated run time: %%.1f s (%%i files without LS file)" %% (sum(x for x in estimates if x is not None), estimates.count(None)))
+
+    def RunTime(first, last):
+        # Estimated run time of the files first to last-1, scaled by the measured run time of the files run
+        # (the files without estimate take the mean measured time)
+        mean = sum(x for i, x in measured)/len(measured) if measured else 0.0
+        estimated = sum(estimates[i] for i, x in measured if estimates[i] is not None)
+        scale = sum(x for i, x in measured if estimates[i] is not None)/estimated if estimated > 0 else 1.0
+        return sum(mean if estimates[i] is None else estimates[i]*scale for i in range(first, last))
+
+    queue = asyncio.PriorityQueue()
+    sent = {}
+    link = Link()
+    checkpoint = Checkpoint()
+    resume = checkpoint.load()
+    uploader = asyncio.ensure_future(Uploader(upload, queue, sent, link, checkpoint))
+    nQueued = 0
+    nStored = os.path.getsize(LocalFile(fMainFile))
+    budgetFull = False
+    nFirst = 0      # first file of the job (page running when resuming)
+
+    def FillWindow(running):
+        # Queue the next files until the program ahead of the running file is long enough or the storage budget is used
+        nonlocal nQueued, nStored, budgetFull
+        while nQueued < numFilesToSend and nQueued - running < WINDOW_MAX:
+            if nQueued - running >= WINDOW_MIN:
+                sendtime = link.SendTime(sizes[nQueued])
+                if sendtime is None or RunTime(running + 1, nQueued) >= LEAD_FACTOR*(sendtime + POLL):
+                    break
+                if nStored + sizes[nQueued] > STORAGE_BUDGET:
+                    if not budgetFull:
+                        print("    Storage budget reached: %%i files on the robot (%%.0f kB), the files ahead run less than %%.0fx the time to send %%s" %% (nQueued - running, nStored*0.001, LEAD_FACTOR, flFilesToSend[nQueued]))
+                    budgetFull = True
+                    break
+            QueueTransfer(queue, 'send', flFilesToSend[nQueued], False)
+            nStored += sizes[nQueued]
+            nQueued += 1
+            budgetFull = False
+
+    nCurrentTaskRunning = -1
+    tTaskStart = time.time()
+    if resume:
+        # Files on the robot uploaded by this job (a file with the same name from another job is sent again)
+        onRobot = set(name[:-3].upper() for name in await upload.run_retry(ListFTPFiles)) & checkpoint.uploaded
+        task = GetCurrentTask(prgstate)
+        nFirst = task if task >= 0 else max(checkpoint.page, 0)
+        print("")
+        print("Resuming from " + CHECKPOINT_FILE + " at: " + flFilesToSend[nFirst] + " (delete it to start the job again)")
+        #Delete the files already run
+        for i in range(nFirst):
+            if flFilesToSend[i][:-3].upper() in onRobot:
+                QueueTransfer(queue, 'delete', flFilesToSend[i], True)
+        if fMainFile[:-3].upper() not in onRobot:
+            QueueTransfer(queue, 'send', fMainFile, False)
+        #Files already on the robot from the page running
+        nQueued = nFirst
+        while nQueued < numFilesToSend and flFilesToSend[nQueued][:-3].upper() in onRobot:
+            sent[flFilesToSend[nQueued][:-3].upper()] = time.time()
+            nStored += sizes[nQueued]
+            nQueued += 1
+        print("    %%i files on the robot, %%i to send" %% (nQueued - nFirst, numFilesToSend - nQueued))
+        if task >= 0:
+            nCurrentTaskRunning = task
+            print("Running: " + flFilesToSend[task])
+    else:
+        for filename in [fMainFile] + flFilesToSend:
+            QueueTransfer(queue, 'delete', filename, False)
+        QueueTransfer(queue, 'send', fMainFile, False)
+    checkpoint.page = nFirst
+    checkpoint.save()
+    FillWindow(nFirst)
+
+    if nCurrentTaskRunning == -1:
+        print("Waiting for: " + fMainFile + " to be run" + (" from " + flFilesToSend[nFirst] if nFirst > 0 else "") + ".")
+        print("")
+        print("    If the feeder stops, run it again to carry on:")
+        print("    the files on the robot are not sent again.")
+        print("")
+    nNearStarve = 0
+    minAhead = None
+    stopped = False
+    tStopped = None
+    while True:
+        try:
+            prgstate = await status.run(ReadFTPFile, 'prgstate.dg')
+        except ftplib.all_errors as e:
+            print("    Status connection: " + str(e))
+            await asyncio.sleep(TIMEOUT)
+            continue
+        task = GetCurrentTask(prgstate)
+        if task >= 0:
+            if stopped:
+                print("Running again: " + flFilesToSend[task])
+            stopped = False
+            tStopped = None
+        elif tStopped is None:
+            tStopped = time.time()
+        if task > nCurrentTaskRunning:
+            if nCurrentTaskRunning == -1:
+                print("Starting drip feed sequence")
+            elif tTaskStart is not None:
+                for i in range(nCurrentTaskRunning, task):
+                    measured.append((i, (time.time() - tTaskStart)/(task - nCurrentTaskRunning)))
+            tTaskStart = time.time()
+            #Delete the previous files for space
+            for i in range(max(nCurrentTaskRunning, nFirst), task):
+                QueueTransfer(queue, 'delete', flFilesToSend[i], True)
+                nStored -= sizes[i]
+            #Program on the robot ahead of the running file
+            nSent = task + 1
+            while nSent < numFilesToSend and flFilesToSend[nSent][:-3].upper() in sent:
+                nSent += 1
+            ahead = RunTime(task + 1, nSent)
+            print("Running: %%s (%%i files ahead, %%.1f s)" %% (flFilesToSend[task], nSent - task - 1, ahead))
+            sendtime = link.SendTime(sizes[nSent]) if nSent < numFilesToSend else None
+            if sendtime is not None:
+                minAhead = ahead if minAhead is None else min(minAhead, ahead)
+                if ahead < NEAR_STARVE*(sendtime + POLL):
+                    nNearStarve += 1
+                    print("    Near starvation: %%.2f s of program ahead of %%s, %%.2f s to send %%s" %% (ahead, flFilesToSend[task], sendtime, flFilesToSend[nSent]))
+            nCurrentTaskRunning = task
+            checkpoint.page = task
+            checkpoint.save()
+        elif task == -1 and nCurrentTaskRunning == numFilesToSend - 1:
+            # the last file is finished
+            break
+        elif task == -1 and nCurrentTaskRunning >= 0 and not stopped and time.time() - tStopped >= TIMEOUT:
+            # aborted or paused without a subprogram (not only between two calls): keep the files and the checkpoint
+            print("Robot stopped at: " + flFilesToSend[nCurrentTaskRunning] + " (the files and " + CHECKPOINT_FILE + " are kept)")
+            print("    Run " + fMainFile + " again from the call of " + flFilesToSend[nCurrentTaskRunning] + " to carry on.")
+            stopped = True
+            tTaskStart = None   # the run time of the page is not measured
+        #Send the next ones
+        FillWindow(max(nCurrentTaskRunning, nFirst))
+        await asyncio.sleep(POLL)
+
+    await queue.join()
+    print("Cleaning up")
+    QueueTransfer(queue, 'delete', fMainFile, True)
+    for i in range(nCurrentTaskRunning, numFilesToSend):
+        QueueTransfer(queue, 'delete', flFilesToSend[i], True)
+    await queue.join()
+    uploader.cancel()
+    status.close()
+    upload.close()
+    checkpoint.remove()
+    if link.bytes > 0:
+        print("Sent %%.0f kB at %%.0f kB/s" %% (link.bytes*0.001, link.bytes*0.001/max(link.seconds, 1e-6)))
+    if minAhead is not None:
+        print("Near starvation: %%i times (least program ahead of a running file: %%.2f s)" %% (nNearStarve, minAhead))
+    print("Job Completed Successfully")
+
+
 if __name__ == "__main__":
 
     try:
@@ -187,134 +607,26 @@ if __name__ == "__main__":
         print("    https://robodk.com/doc/en/Robots-Fanuc.html")
         print("")
         # Change current directory to this directory (in case we run this file from another directory)
-        folder_files = os.path.dirname(__file__)
+        folder_files = os.path.dirname(os.path.abspath(__file__))
         print("Program files directory: " + folder_files)
         os.chdir(folder_files)
-        
+
         print("Main program to run: " + fMainFile)
-        
-        numFilesToSend = len(flFilesToSend)
-        print("    Number of subprograms: " + str(numFilesToSend))
-        
-        if numFilesToSend <= 3:
-            #raise Exception("Program is less than 3 files, no drip feed nessesary")
+        print("    Number of subprograms: " + str(len(flFilesToSend)))
+        if len(flFilesToSend) <= WINDOW_MIN:
             print("")
-            print("    (the program is split in less than 3 files: Drip feeding is not nessesary)")
+            print("    (the program is split in less than %%i files: Drip feeding is not nessesary)" %% (WINDOW_MIN + 1))
             print("    (sending programs anyway...)")
-            #input("Press any key to close")
-            #quit()
-
-        #input("Press enter to load the files")
-
-        numFilesToSend = len(flFilesToSend)
-        nCurrentTaskRunning = 0
 
         if (RobotFTPIP == ""):
             input("Robot FTP IP not defined, edit the top of the script to fix")
             sys.exit()
-            
+
         if (RobotFTPUsername == ""):
             RobotFTPUsername = "anonymous"
-            #input("Robot FTP username not defined, edit the top of the script to fix")
-            #sys.exit()        
-             
-        ftpRobot = None
-        while True:
-            print("")
-            print("Trying to connect to Fanuc robot controller: " + RobotFTPIP + " ...")
-            try:
-                ftpRobot = FTP(RobotFTPIP) #Connect
-                ftpRobot.login()
-                break
-                
-            except Exception as e:
-                print("    " + str(e))
-                print("    Unable to connect. Make sure the FTP server is running and no other clients are connected.")
-                time.sleep(TIMEOUT)
-            
-        print("")
-        print("Connected!")
-        GetFilesFromFTP()
-        
-        print("")
-        print("Current robot position:")
-        print(GetCurJoints())
-        
-        print("")
-        print("Current running tasks:")
-        print(GetCurRunningTasks())
-        
-        print("")
-        print("Files to send:")
-        print(flFilesToSend)
-        
-        SafeFTPDelete(fMainFile)
-        
-        for subFileName in flFilesToSend:
-            SafeFTPDelete(subFileName)
-            
-        SendFTPFile(fMainFile)
-        for i in range(min(3, numFilesToSend)):
-            SendFTPFile(flFilesToSend[i])
-            
-        ftpRobot.quit()
-        displayMessage = "Waiting for: " + fMainFile + " to be run."
-        print(displayMessage)
-        print("")
-        print("    If you are resuming a partially completed program,")
-        print("    make sure the robot has the current subroutine it's on")
-        print("    and the next two subroutines after that. Disconect")
-        print("    your ftp client and then resume the robot program.")
-        print("")
-        nCurrentTaskRunning = -1
-        while (nCurrentTaskRunning == -1):
-            try:
-                ftpRobot = FTP(RobotFTPIP) #Connect
-                ftpRobot.login()
-                ftpRobot.cwd(RobotFTPPath)
-                GetFilesFromFTP()
-                ftpRobot.quit()
-                #Disconect and reconect to allow the user to manually ftp a file over
-                nCurrentTaskRunning = GetCurrentTask()
-            except:
-                time.sleep(TIMEOUT)
-                
-            time.sleep(TIMEOUT)
-            
-        print("Starting drip feed sequence")
-        #Reconect for drip feeding
-        ftpRobot = FTP(RobotFTPIP) #Connect
-        ftpRobot.login()
-        ftpRobot.cwd(RobotFTPPath)
-
-        fExit = False
-        previousTaskRunning = nCurrentTaskRunning
-        while (fExit != True):
-            GetFilesFromFTP() # update the local files
-            tempNum = GetCurrentTask()
-            if (tempNum != -1):
-                nCurrentTaskRunning = tempNum
-                
-            if ( (nCurrentTaskRunning > previousTaskRunning) ):
-                previousTaskRunning = nCurrentTaskRunning #Increment a position
-                #Delete the previous file for space
-                if (nCurrentTaskRunning > 0):
-                    SafeFTPDelete(flFilesToSend[nCurrentTaskRunning-1], True)
-                    
-                #Send the next one
-                if ( (nCurrentTaskRunning+3-1) < numFilesToSend):
-                    SendFTPFile(flFilesToSend[nCurrentTaskRunning+3-1])
-                    
-            if (previousTaskRunning == (numFilesToSend-1) ):
-                fExit = True
-                
-            time.sleep(TIMEOUT)
-            
-        print("Cleaning up")
-        SafeFTPDelete(fMainFile, True)
-        SafeFTPDelete(flFilesToSend[numFilesToSend-1], True)
-        print("Job Completed Successfully")
-        
+
+        asyncio.run(DripFeed())
+
     except Exception as e:
         print("Unexpected Error: " + str(e))
 
@@ -397,6 +709,9 @@ class RobotPost(object):
     #DRIPFEED_FILE_NAME = "Fanuc_SendProgram_DripFeed.py"   
     DRIPFEED_FILE_NAME = None       # Don't do any dripfeeding      
     
+    # Bytes of programs the dripfeeder keeps on the controller at the same time (the pages sent ahead depend on their run time and the upload speed)
+    DRIPFEED_STORAGE_BUDGET = 1000000
+    
     # Force user input to save the folder
     FORCE_POPUP_SAVE = False
     
@@ -449,6 +764,14 @@ class RobotPost(object):
         self.nAxes = robot_axes
         self.PROG = []
         self.LOG = ''
+        # per instance lists (class level lists are shared when the post is reused in the same process)
+        self.PROG_FILES = []
+        self.PROG_NAMES = []
+        self.PROG_LIST = []
+        self.PROG_NAMES_MAIN = []
+        self.PROG_TARGETS = []
+        self.AXES_TRACK = []
+        self.AXES_TURNTABLE = []
         #for k,v in kwargs.iteritems(): # python2
         for k,v in kwargs.items():
             if k == 'lines_x_prog':
@@ -648,6 +971,7 @@ class RobotPost(object):
         param_list = ftpparam
         param_list.append(progMain + sFileExtention)
         param_list.append(str(localProgNamesCopy))
+        param_list.append(self.DRIPFEED_STORAGE_BUDGET)
         with open(filenameToOpen,"w+") as fid:
             fid.write(DRIPFEED_FILE % tuple(param_list))
 
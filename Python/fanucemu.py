@@ -0,0 +1,580 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Local stand-in of a Fanuc controller to test drip feeding and FTP uploads without a robot.
+#
+# The emulator runs an FTP server (socketserver, no other dependencies) with the files
+# the drip feeder and UploadFTP use:
+#     md:/curpos.dg      current joints ("Joint 1: 0.000")
+#     md:/prgstate.dg    state of the main program (" 1  M_JOB  RUNNING  @ 5 -> JOB3  1")
+#     *.LS, *.TP         programs uploaded (STOR), deleted (DELE) and listed (NLST/MLSD)
+# File names are not case sensitive and every folder (md:/, fr:/...) shows the same
+# program memory. Deleting a program that is running fails, like on the controller.
+#
+# The controller runs a main program (start(main, line), or run_delay s after it is uploaded
+# with run=name): the CALL lines are executed in order (main programs, dispatchers and pages)
+# and every program runs for the time estimated from its LS file (distances and speeds
+# of the linear and circular moves and WAITs) at the override of the controller. A CALL
+# of a program that is not on the controller pauses the robot until the program arrives
+# (starvation, recorded in starvations) or aborts it with stall=False.
+#
+# Latency (per FTP command), bandwidth (per data transfer) and storage (bytes of
+# programs) are configurable.
+#
+# Usage:
+#     python fanucemu.py [--port 2121] [--run M_JOB] [--latency 0.02] [--bandwidth 200] [--storage 1000]
+# --------------------------------------------
+
+import sys
+import time
+import socket
+import threading
+import socketserver
+
+HOST = '127.0.0.1'
+PORT = 2121
+STATUS_FILES = ('CURPOS.DG', 'PRGSTATE.DG')
+PROGRAM_EXT = ('.LS', '.TP')
+
+
+#----------------------------------------------------
+#--------        Program run time       -------------
+
+def _point_number(token):
+    """P[12] or P[12:comment] -> 12"""
+    try:
+        return int(token[2:].split(']')[0].split(':')[0])
+    except ValueError:
+        return None
+
+
+def _move_speed(tokens):
+    """Speed of a move: (mm/s, None) or (None, s) for moves given in time, (None, None) if unknown (registers)"""
+    speed = tokens[0] if tokens else ''
+    for unit, factor in (('mm/sec', 1.0), ('cm/min', 10.0/60.0), ('inch/min', 25.4/60.0), ('msec', 0.001), ('sec', 1.0)):
+        if speed.endswith(unit):
+            try:
+                value = float(speed[:-len(unit)])*factor
+            except ValueError:
+                break
+            if '/' not in unit:
+                return None, value
+            return value, None
+    return None, None
+
+
+def _distance(a, b):
+    return ((a[0]-b[0])**2 + (a[1]-b[1])**2 + (a[2]-b[2])**2)**0.5
+
+
+def program_steps(text):
+    """Steps of a LS program: [('time', seconds) or ('call', program, line), ...].
+    The time of the moves between two calls is estimated from the distances and speeds of the linear and
+    circular moves and the WAITs (joint moves are not counted)."""
+    moves = []
+    points = {}
+    section = ''
+    point = None
+    number = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('/'):
+            section = line.split()[0]
+        elif section == '/MN':
+            # "  5:L P[3] 200mm/sec CNT5 ;", the end point of circular moves is on the next line
+            if line[:1].isdigit():
+                number = int(line.split(':', 1)[0])
+                line = line.split(':', 1)[1]
+            elif line.startswith(':'):
+                line = line[1:]
+            tokens = line.replace(';', ' ').split()
+            if len(tokens) >= 2 and tokens[0] in ('J', 'L', 'C') and tokens[1].startswith('P['):
+                moves.append([tokens[0], _point_number(tokens[1]), None, tokens[2:]])
+            elif tokens and tokens[0].startswith('P[') and moves and moves[-1][0] == 'C' and moves[-1][2] is None:
+                moves[-1][2] = _point_number(tokens[0])
+                moves[-1][3] = tokens[1:]
+            elif len(tokens) >= 2 and tokens[0] == 'WAIT' and tokens[1].endswith('(sec)'):
+                moves.append(['WAIT', None, None, [tokens[1][:-5] + 'sec']])
+            elif len(tokens) >= 2 and tokens[0] == 'CALL':
+                moves.append(['CALL', tokens[1].split('(')[0].upper(), number, None])
+        elif section == '/POS':
+            if line.startswith('P['):
+                point = _point_number(line)
+            elif point is not None and point not in points and 'X' in line and 'mm' in line:
+                # first group: X = 100.000 mm, Y = ...
+                tokens = line.replace('=', ' = ').replace(',', ' ').split()
+                xyz = []
+                for name in ('X', 'Y', 'Z'):
+                    if name in tokens and tokens.index(name) + 2 < len(tokens):
+                        try:
+                            xyz.append(float(tokens[tokens.index(name) + 2]))
+                        except ValueError:
+                            pass
+                if len(xyz) == 3:
+                    points[point] = xyz
+    steps = []
+    seconds = 0.0
+    last = None
+    for kind, p1, p2, speed in moves:
+        if kind == 'CALL':
+            steps += [('time', seconds), ('call', p1, p2)]
+            seconds = 0.0
+            continue
+        mm_s, time_s = _move_speed(speed)
+        if kind == 'WAIT':
+            seconds += time_s or 0.0
+            continue
+        target = points.get(p2 if kind == 'C' else p1)
+        if kind != 'J' and last is not None and target is not None:
+            if kind == 'C' and points.get(p1) is not None:
+                path = _distance(last, points[p1]) + _distance(points[p1], target)
+            else:
+                path = _distance(last, target)
+            if time_s is not None:
+                seconds += time_s
+            elif mm_s:
+                seconds += path/mm_s
+        last = target
+    steps.append(('time', seconds))
+    return [step for step in steps if step[0] == 'call' or step[1] > 0]
+
+
+def run_time(text):
+    """Estimated run time of a LS program without its calls (s)"""
+    return sum(step[1] for step in program_steps(text) if step[0] == 'time')
+
+
+#----------------------------------------------------
+#--------        Controller        ------------------
+
+class ControllerError(Exception):
+    """Raised when the controller refuses a file operation"""
+    pass
+
+
+class _Aborted(Exception):
+    pass
+
+
+class Controller(object):
+    """Program memory, status files and program execution of the emulated controller"""
+    def __init__(self, storage=None, override=100, page_time=1.0, stall=True, run=None, run_delay=1.0, joints=None, verbose=False):
+        self.storage = storage          # bytes of programs, None: no limit
+        self.override = override        # speed override (%)
+        self.page_time = page_time      # run time of the programs without LS file (s)
+        self.stall = stall              # wait for missing programs (True) or abort
+        self.autorun = run              # main program started when it is uploaded
+        self.autorun_delay = run_delay  # time from the upload to the start (s)
+        self.joints = joints or [0.0, 0.0, 0.0, 0.0, -90.0, 0.0]
+        self.verbose = verbose
+        self.files = {}                 # upper case file name: bytes
+        self.changed = threading.Condition(threading.RLock())
+        self.main = None
+        self.status = 'ABORTED'
+        self.stack = []                 # [program, line] of the programs running, main first
+        self.missing = None             # program waited for
+        self.paused = False
+        self.aborted = False
+        self.thread = None
+        self.start_line = 1
+        self.t_start = None
+        self.t_end = None
+        self.starvations = []           # (program, seconds waited)
+        self.uploads = []               # (file name, bytes, seconds)
+        self.faults = []
+
+    def log(self, message):
+        if self.verbose:
+            print('[%.3f] %s' % (time.time(), message))
+            sys.stdout.flush()
+
+    #------ files ------
+    def used(self):
+        """Bytes of programs on the controller"""
+        with self.changed:
+            return sum(len(data) for data in self.files.values())
+
+    def names(self):
+        with self.changed:
+            return sorted(self.files.keys()) + list(STATUS_FILES)
+
+    def exists(self, program):
+        with self.changed:
+            return any(program.upper() + ext in self.files for ext in PROGRAM_EXT)
+
+    def read(self, filename):
+        filename = filename.upper()
+        if filename == 'CURPOS.DG':
+            return self.curpos().encode()
+        if filename == 'PRGSTATE.DG':
+            return self.prgstate().encode()
+        with self.changed:
+            if filename not in self.files:
+                raise ControllerError('File not found: %s' % filename)
+            return self.files[filename]
+
+    def store(self, filename, data, seconds=0.0):
+        filename = filename.upper()
+        if filename in STATUS_FILES:
+            raise ControllerError('Read only file: %s' % filename)
+        with self.changed:
+            if self.storage is not None and self.used() - len(self.files.get(filename, b'')) + len(data) > self.storage:
+                raise ControllerError('Not enough memory for %s (%i bytes used)' % (filename, self.used()))
+            if any(filename[:-3] == program for program, line in self.stack):
+                raise ControllerError('Program is running: %s' % filename)
+            self.files[filename] = data
+            self.uploads.append((filename, len(data), seconds))
+            self.changed.notify_all()
+        self.log('Stored %s (%i bytes, %.3f s)' % (filename, len(data), seconds))
+        if self.autorun is not None and filename[:-3] == self.autorun.upper() and self.thread is None:
+            self.thread = threading.Timer(self.autorun_delay, self.start, (self.autorun,))
+            self.thread.daemon = True
+            self.thread.start()
+
+    def delete(self, filename):
+        filename = filename.upper()
+        with self.changed:
+            if filename not in self.files:
+                raise ControllerError('File not found: %s' % filename)
+            if any(filename[:-3] == program for program, line in self.stack):
+                raise ControllerError('Program is running: %s' % filename)
+            del self.files[filename]
+        self.log('Deleted %s' % filename)
+
+    def program(self, program):
+        """Steps of a program on the controller (the LS file if there is one)"""
+        with self.changed:
+            data = self.files.get(program + '.LS')
+            if data is None:
+                return [('time', self.page_time)]
+        return program_steps(data.decode('ascii', 'replace'))
+
+    #------ status ------
+    def curpos(self):
+        return ''.join('Joint %i: %10.3f\n' % (i + 1, value) for i, value in enumerate(self.joints))
+
+    def prgstate(self):
+        with self.changed:
+            if self.main is None:
+                return ''
+            if not self.stack:
+                return ' 1  %-12s %s\n' % (self.main, self.status)
+            current = self.missing or self.stack[-1][0]
+            return ' 1  %-12s %-8s @ %4i -> %-12s %i\n' % (self.main, self.status, self.stack[0][1], current, self.stack[-1][1])
+
+    #------ execution ------
+    def start(self, main, line=1):
+        """Run a main program from a line (in a thread)"""
+        with self.changed:
+            if self.thread is not None and self.thread.is_alive() and self.thread is not threading.current_thread():
+                raise ControllerError('A program is running: %s' % self.main)
+            self.main = main.upper()
+            self.start_line = line
+            self.aborted = False
+            self.paused = False
+            self.t_start = time.time()
+            self.t_end = None
+            self.thread = threading.Thread(target=self._run_main, daemon=True)
+            self.thread.start()
+
+    def pause(self, paused=True):
+        with self.changed:
+            self.paused = paused
+            if self.stack:
+                self.status = 'PAUSED' if paused else 'RUNNING'
+            self.changed.notify_all()
+
+    def abort(self):
+        with self.changed:
+            self.aborted = True
+            self.changed.notify_all()
+
+    def wait(self, timeout=None):
+        """Wait until the main program ends. Returns False on timeout."""
+        if self.thread is None:
+            return True
+        self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def _check(self):
+        while self.paused and not self.aborted:
+            self.changed.wait()
+        if self.aborted:
+            raise _Aborted()
+
+    def _sleep(self, seconds):
+        remaining = seconds*100.0/max(self.override, 1e-3)
+        while remaining > 0:
+            t0 = time.time()
+            with self.changed:
+                self._check()
+                self.changed.wait(min(remaining, 0.05))
+                self._check()
+            remaining -= time.time() - t0
+
+    def _call(self, program, line=1):
+        with self.changed:
+            if not self.exists(program):
+                t0 = time.time()
+                self.missing = program
+                self.status = 'PAUSED'
+                self.log('Starved: %s is not on the controller' % program)
+                while not self.exists(program) and self.stall and not self.aborted:
+                    self.changed.wait(0.05)
+                self.missing = None
+                self._check()
+                if not self.exists(program):
+                    self.faults.append('Program not found: %s' % program)
+                    raise _Aborted()
+                self.starvations.append((program, time.time() - t0))
+                self.log('Resumed: %s after %.3f s' % (program, time.time() - t0))
+                self.status = 'PAUSED' if self.paused else 'RUNNING'
+            steps = self.program(program)
+            self.stack.append([program, 0])
+        if line > 1:
+            # start at the first call from the line
+            calls = [i for i, step in enumerate(steps) if step[0] == 'call' and step[2] >= line]
+            steps = steps[calls[0]:] if calls else []
+        for step in steps:
+            if step[0] == 'time':
+                self._sleep(step[1])
+            else:
+                with self.changed:
+                    self.stack[-1][1] = step[2]
+                self._call(step[1])
+        with self.changed:
+            self.stack.pop()
+            self.changed.notify_all()
+
+    def _run_main(self):
+        self.log('Running %s' % self.main)
+        with self.changed:
+            self.status = 'RUNNING'
+        try:
+            self._call(self.main, self.start_line)
+        except _Aborted:
+            self.log('Aborted %s' % self.main)
+        finally:
+            with self.changed:
+                self.stack = []
+                self.status = 'ABORTED'
+                self.t_end = time.time()
+                self.changed.notify_all()
+        self.log('Finished %s in %.3f s' % (self.main, self.t_end - self.t_start))
+
+
+#----------------------------------------------------
+#--------        FTP server        ------------------
+
+def _file_name(arg):
+    """File name of an FTP path (md:/job.ls, /md:/job.ls, job.ls)"""
+    return arg.replace('\\', '/').replace(':', '/').split('/')[-1]
+
+
+class FTPHandler(socketserver.StreamRequestHandler):
+    """FTP session of the emulated controller (passive mode only)"""
+    def handle(self):
+        self.cwd = '/md:/'
+        self.passive = None
+        self.reply(220, 'Fanuc controller emulator')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            line = line.decode('latin-1').rstrip('\r\n')
+            command, _, arg = line.partition(' ')
+            method = getattr(self, 'ftp_' + command.upper(), None)
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            if method is None:
+                self.reply(502, 'Command not implemented')
+                continue
+            try:
+                if method(arg) is False:
+                    break
+            except ControllerError as e:
+                self.reply(550, str(e))
+            except socket.error:
+                break
+        if self.passive is not None:
+            self.passive.close()
+
+    def reply(self, code, message):
+        self.wfile.write(('%i %s\r\n' % (code, message)).encode('latin-1'))
+        self.wfile.flush()
+
+    def data_connection(self):
+        if self.passive is None:
+            self.reply(425, 'Use PASV first')
+            return None
+        self.passive.settimeout(10)
+        try:
+            connection, address = self.passive.accept()
+        finally:
+            self.passive.close()
+            self.passive = None
+        return connection
+
+    def throttle(self, nbytes, t0):
+        if self.server.bandwidth:
+            delay = t0 + nbytes/self.server.bandwidth - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def send_data(self, data):
+        connection = self.data_connection()
+        if connection is None:
+            return
+        self.reply(150, 'Opening data connection')
+        t0 = time.time()
+        with connection:
+            for i in range(0, len(data), self.server.block_size):
+                connection.sendall(data[i:i + self.server.block_size])
+                self.throttle(i + self.server.block_size, t0)
+        self.reply(226, 'Transfer complete')
+
+    def ftp_USER(self, arg):
+        self.reply(331, 'Password required')
+
+    def ftp_PASS(self, arg):
+        self.reply(230, 'Logged in')
+
+    def ftp_SYST(self, arg):
+        self.reply(215, 'UNIX Type: L8')
+
+    def ftp_TYPE(self, arg):
+        self.reply(200, 'Type set to %s' % arg)
+
+    def ftp_NOOP(self, arg):
+        self.reply(200, 'OK')
+
+    def ftp_PWD(self, arg):
+        self.reply(257, '"%s"' % self.cwd)
+
+    def ftp_CWD(self, arg):
+        self.cwd = arg
+        self.reply(250, 'Directory changed to %s' % arg)
+
+    def ftp_PASV(self, arg):
+        if self.passive is not None:
+            self.passive.close()
+        self.passive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.passive.bind((self.request.getsockname()[0], 0))
+        self.passive.listen(1)
+        host, port = self.passive.getsockname()
+        self.reply(227, 'Entering Passive Mode (%s,%i,%i)' % (host.replace('.', ','), port >> 8, port & 0xFF))
+
+    def ftp_RETR(self, arg):
+        self.send_data(self.server.controller.read(_file_name(arg)))
+
+    def ftp_SIZE(self, arg):
+        self.reply(213, str(len(self.server.controller.read(_file_name(arg)))))
+
+    def ftp_NLST(self, arg):
+        self.send_data(''.join(name.lower() + '\r\n' for name in self.server.controller.names()).encode())
+
+    def ftp_MLSD(self, arg):
+        controller = self.server.controller
+        lines = ['type=file;size=%i; %s\r\n' % (len(controller.read(name)), name.lower()) for name in controller.names()]
+        self.send_data(''.join(lines).encode())
+
+    def ftp_STOR(self, arg):
+        connection = self.data_connection()
+        if connection is None:
+            return
+        self.reply(150, 'Ready to receive')
+        chunks = []
+        size = 0
+        t0 = time.time()
+        with connection:
+            while True:
+                chunk = connection.recv(self.server.block_size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+                self.throttle(size, t0)
+        try:
+            self.server.controller.store(_file_name(arg), b''.join(chunks), time.time() - t0)
+        except ControllerError as e:
+            self.reply(452, str(e))
+            return
+        self.reply(226, 'Transfer complete')
+
+    def ftp_DELE(self, arg):
+        self.server.controller.delete(_file_name(arg))
+        self.reply(250, 'File deleted')
+
+    def ftp_QUIT(self, arg):
+        self.reply(221, 'Goodbye')
+        return False
+
+
+class FTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, controller, latency=0.0, bandwidth=None, block_size=8192):
+        socketserver.ThreadingTCPServer.__init__(self, address, FTPHandler)
+        self.controller = controller
+        self.latency = latency          # s per command
+        self.bandwidth = bandwidth      # bytes/s per transfer, None: no limit
+        self.block_size = block_size
+
+
+class FanucEmulator(object):
+    """FTP server and controller of the emulator, served in a thread.
+    port=0 takes a free port (see self.port)."""
+    def __init__(self, host=HOST, port=PORT, latency=0.0, bandwidth=None, **kwargs):
+        self.controller = Controller(**kwargs)
+        self.server = FTPServer((host, port), self.controller, latency, bandwidth)
+        self.host, self.port = self.server.server_address
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.controller.abort()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='Emulate a Fanuc controller (FTP server, program state and execution)')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT, help='FTP port (21 to test RoboDK directly)')
+    parser.add_argument('--run', help='main program to run when it is uploaded (for example M_JOB)')
+    parser.add_argument('--run-delay', type=float, default=1.0, help='time from the upload of the main program to its start (s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='delay of every FTP command (s)')
+    parser.add_argument('--bandwidth', type=float, help='speed of every transfer (kB/s)')
+    parser.add_argument('--storage', type=float, help='program memory (kB)')
+    parser.add_argument('--override', type=float, default=100, help='speed override (%%)')
+    parser.add_argument('--page-time', type=float, default=1.0, help='run time of programs without LS file (s)')
+    parser.add_argument('--abort-missing', action='store_true', help='abort when a called program is missing (default: wait)')
+    args = parser.parse_args(argv)
+    emulator = FanucEmulator(args.host, args.port, args.latency, args.bandwidth*1000 if args.bandwidth else None,
+                             storage=args.storage*1000 if args.storage else None, override=args.override, page_time=args.page_time,
+                             stall=not args.abort_missing, run=args.run, run_delay=args.run_delay, verbose=True)
+    print('Fanuc controller emulator on %s:%i' % (emulator.host, emulator.port))
+    sys.stdout.flush()
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    controller = emulator.controller
+    print('Starvations: %i (%.3f s)' % (len(controller.starvations), sum(seconds for program, seconds in controller.starvations)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
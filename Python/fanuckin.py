@@ -0,0 +1,304 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Forward and inverse kinematics of Fanuc 6 axis arms over NumPy arrays.
+#
+# add_target_cartesian needs the joints of every target (turn numbers of J1/J4/J6) and
+# conf_RLF (F/N, U/D, T/B flags). This module computes both without RoboDK so paths can
+# be generated headless (see pathingest.py).
+#
+# The arms are ortho-parallel with a spherical wrist. Their DH chain is described by 7
+# lengths (mm), as in "An Analytical Solution of the Inverse Kinematics Problem of
+# Industrial Serial Manipulators with an Ortho-parallel Basis and a Spherical Wrist"
+# (Brandstotter et al., 2014):
+#     a1: J1 axis to J2 axis (along X)     c1: base to J2 axis (along Z)
+#     a2: J3 axis to forearm (along Z)     c2: J2 axis to J3 axis (upper arm)
+#     b:  lateral offset                   c3: J3 axis to wrist center (forearm)
+#                                          c4: wrist center to flange
+# Fanuc conventions handled here:
+#     - J3 is measured from the horizontal (J2/J3 coupling)
+#     - J3, J4, J5 and J6 turn the opposite way of the model angles
+#     - the world frame of the controller is at the height of J2 (BASE_AT_J2)
+#     - the flange X axis points forward when the tool points down (W=180, P=0, R=0)
+# Check the lengths and limits of a model against the datasheet (or the RoboDK robot)
+# before using it for production programs.
+#
+# Usage:
+#     kin = FanucKinematics('Fanuc M-20iA', tool=tool_pose)
+#     joints, valid = kin.ik(poses, seed=[0, 0, 0, 0, -90, 0])   # (N,4,4) -> (N,6) deg
+#     conf = conf_RLF(joints)                                     # (N,3) [rear, lower, flip]
+# --------------------------------------------
+
+import math
+import numpy as np
+
+# name: (a1, a2, b, c1, c2, c3, c4) in mm, joint limits (deg)
+ROBOT_MODELS = {
+    'Fanuc M-20iA':           ((150.0, -250.0, 0.0, 525.0, 790.0, 835.0, 100.0),
+                               [(-170, 170), (-100, 160), (-185, 273), (-200, 200), (-180, 180), (-450, 450)]),
+    'Fanuc ARC Mate 120iC':   ((150.0, -250.0, 0.0, 525.0, 790.0, 835.0, 100.0),
+                               [(-170, 170), (-100, 160), (-185, 273), (-200, 200), (-180, 180), (-450, 450)]),
+    'Fanuc M-10iA':           ((150.0, -200.0, 0.0, 450.0, 600.0, 640.0, 100.0),
+                               [(-170, 170), (-90, 160), (-180, 267), (-190, 190), (-140, 140), (-270, 270)]),
+    'Fanuc ARC Mate 100iC':   ((150.0, -200.0, 0.0, 450.0, 600.0, 640.0, 100.0),
+                               [(-170, 170), (-90, 160), (-180, 267), (-190, 190), (-140, 140), (-270, 270)]),
+    'Fanuc M-710iC/50':       ((150.0, -190.0, 0.0, 565.0, 870.0, 1016.0, 175.0),
+                               [(-180, 180), (-90, 135), (-160, 280), (-360, 360), (-125, 125), (-360, 360)]),
+    'Fanuc LR Mate 200iD':    ((50.0, -35.0, 0.0, 330.0, 330.0, 335.0, 80.0),
+                               [(-170, 170), (-100, 145), (-140, 213), (-190, 190), (-125, 125), (-360, 360)]),
+}
+
+BASE_AT_J2 = True   # Fanuc world frame is at the height of J2
+MAX_STEP = 30.0     # deg, largest joint move between consecutive targets before the solution is searched again
+
+_WRAPPED = (0, 3, 5)    # joints that can take the same position +/-360 deg
+
+
+def _rotz(angle):
+    c = np.cos(angle)
+    s = np.sin(angle)
+    R = np.zeros(angle.shape + (3, 3))
+    R[..., 0, 0] = c
+    R[..., 0, 1] = -s
+    R[..., 1, 0] = s
+    R[..., 1, 1] = c
+    R[..., 2, 2] = 1.0
+    return R
+
+
+def _roty(angle):
+    c = np.cos(angle)
+    s = np.sin(angle)
+    R = np.zeros(angle.shape + (3, 3))
+    R[..., 0, 0] = c
+    R[..., 0, 2] = s
+    R[..., 2, 0] = -s
+    R[..., 2, 2] = c
+    R[..., 1, 1] = 1.0
+    return R
+
+
+def _as_array(pose):
+    """Mat, list of lists or array -> (4,4) array"""
+    if pose is None:
+        return np.eye(4)
+    if hasattr(pose, 'rows'):
+        return np.array(pose.rows, dtype=float)
+    return np.asarray(pose, dtype=float)
+
+
+class FanucKinematics(object):
+    """Batch forward and inverse kinematics of a Fanuc arm.
+    base and tool are 4x4 poses (Mat or array): base is the robot base with respect to the
+    reference used for the poses (for example the user frame) and tool is the TCP."""
+    def __init__(self, model='Fanuc M-20iA', base=None, tool=None, params=None, limits=None):
+        if params is None or limits is None:
+            if model not in ROBOT_MODELS:
+                raise ValueError('Unknown robot model: %s. Provide params and limits.' % model)
+            model_params, model_limits = ROBOT_MODELS[model]
+            params = model_params if params is None else params
+            limits = model_limits if limits is None else limits
+        self.a1, self.a2, self.b, self.c1, self.c2, self.c3, self.c4 = [float(x) for x in params]
+        self.limits = np.radians(np.asarray(limits, dtype=float))
+        self.base = _as_array(base)
+        self.tool = _as_array(tool)
+        if BASE_AT_J2:
+            # model frame (floor) with respect to the world frame of the controller
+            self.base = self.base.dot(np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, -self.c1], [0, 0, 0, 1]], dtype=float))
+        self.base_inv = np.linalg.inv(self.base)
+        self.tool_inv = np.linalg.inv(self.tool)
+        # flange frame with respect to the model end effector frame
+        self.flange = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+    # ------------------ joint conventions ----------------------
+    @staticmethod
+    def model_2_fanuc(q):
+        """Model angles (rad) to Fanuc joints (rad)"""
+        j = np.empty_like(q)
+        j[..., 0] = q[..., 0]
+        j[..., 1] = q[..., 1]
+        j[..., 2] = math.pi/2 - q[..., 2] - q[..., 1]
+        j[..., 3] = -q[..., 3]
+        j[..., 4] = -q[..., 4]
+        j[..., 5] = -q[..., 5]
+        return j
+
+    @staticmethod
+    def fanuc_2_model(j):
+        """Fanuc joints (rad) to model angles (rad)"""
+        q = np.empty_like(j)
+        q[..., 0] = j[..., 0]
+        q[..., 1] = j[..., 1]
+        q[..., 2] = math.pi/2 - j[..., 2] - j[..., 1]
+        q[..., 3] = -j[..., 3]
+        q[..., 4] = -j[..., 4]
+        q[..., 5] = -j[..., 5]
+        return q
+
+    # ------------------ forward kinematics ----------------------
+    def fk(self, joints):
+        """Returns the (N,4,4) TCP poses of (N,6) joints in deg"""
+        joints = np.atleast_2d(np.asarray(joints, dtype=float))[:, 0:6]
+        q = self.fanuc_2_model(np.radians(joints))
+        psi3 = math.atan2(self.a2, self.c3)
+        k = math.hypot(self.a2, self.c3)
+        q23 = q[:, 1] + q[:, 2]
+        cx1 = self.c2*np.sin(q[:, 1]) + k*np.sin(q23 + psi3) + self.a1
+        cz1 = self.c2*np.cos(q[:, 1]) + k*np.cos(q23 + psi3)
+        c1 = np.cos(q[:, 0])
+        s1 = np.sin(q[:, 0])
+        R = np.matmul(np.matmul(_rotz(q[:, 0]), _roty(q23)), np.matmul(np.matmul(_rotz(q[:, 3]), _roty(q[:, 4])), _rotz(q[:, 5])))
+        H = np.zeros((joints.shape[0], 4, 4))
+        H[:, 0:3, 0:3] = R
+        H[:, 0, 3] = cx1*c1 - self.b*s1
+        H[:, 1, 3] = cx1*s1 + self.b*c1
+        H[:, 2, 3] = cz1 + self.c1
+        H[:, 0:3, 3] += self.c4*R[:, :, 2]
+        H[:, 3, 3] = 1.0
+        return np.matmul(np.matmul(self.base, H), np.matmul(self.flange, self.tool))
+
+    # ------------------ inverse kinematics ----------------------
+    def ik_all(self, poses):
+        """Returns the 8 solutions (N,8,6) in deg of (N,4,4) TCP poses and a (N,8) mask of the valid ones
+        (reachable and within the joint limits, J1/J4/J6 taken in [-180,180])"""
+        poses = np.asarray(poses, dtype=float).reshape(-1, 4, 4)
+        H = np.matmul(np.matmul(self.base_inv, poses), np.matmul(self.tool_inv, self.flange))
+        R = H[:, 0:3, 0:3]
+        C = H[:, 0:3, 3] - self.c4*R[:, :, 2]
+        cx = C[:, 0]
+        cy = C[:, 1]
+        cz = C[:, 2] - self.c1
+        a1, a2, b, c2, c3 = self.a1, self.a2, self.b, self.c2, self.c3
+        k2 = a2*a2 + c3*c3
+        k = math.sqrt(k2)
+        psi3 = math.atan2(a2, c3)
+
+        with np.errstate(invalid='ignore'):
+            nx1 = np.sqrt(cx*cx + cy*cy - b*b) - a1
+            s1_2 = nx1*nx1 + cz*cz
+            s2_2 = (nx1 + 2*a1)**2 + cz*cz
+            s1 = np.sqrt(s1_2)
+            s2 = np.sqrt(s2_2)
+            theta1_i = np.arctan2(cy, cx) - np.arctan2(b, nx1 + a1)
+            theta1_ii = np.arctan2(cy, cx) + np.arctan2(b, nx1 + a1) - math.pi
+            arg2_i = (s1_2 + c2*c2 - k2)/(2*s1*c2)
+            arg2_ii = (s2_2 + c2*c2 - k2)/(2*s2*c2)
+            arg3_i = (s1_2 - c2*c2 - k2)/(2*c2*k)
+            arg3_ii = (s2_2 - c2*c2 - k2)/(2*c2*k)
+            reach_i = (np.abs(arg2_i) <= 1.0) & (np.abs(arg3_i) <= 1.0)
+            reach_ii = (np.abs(arg2_ii) <= 1.0) & (np.abs(arg3_ii) <= 1.0)
+            acos2_i = np.arccos(np.clip(arg2_i, -1, 1))
+            acos2_ii = np.arccos(np.clip(arg2_ii, -1, 1))
+            acos3_i = np.arccos(np.clip(arg3_i, -1, 1))
+            acos3_ii = np.arccos(np.clip(arg3_ii, -1, 1))
+            atan_i = np.arctan2(nx1, cz)
+            atan_ii = np.arctan2(nx1 + 2*a1, cz)
+
+        n = poses.shape[0]
+        q = np.zeros((n, 8, 6))
+        valid = np.zeros((n, 8), dtype=bool)
+        arms = [(theta1_i, -acos2_i + atan_i, acos3_i - psi3, reach_i),
+                (theta1_i, acos2_i + atan_i, -acos3_i - psi3, reach_i),
+                (theta1_ii, -acos2_ii - atan_ii, acos3_ii - psi3, reach_ii),
+                (theta1_ii, acos2_ii - atan_ii, -acos3_ii - psi3, reach_ii)]
+        for i, (t1, t2, t3, reach) in enumerate(arms):
+            c1 = np.cos(t1)
+            s1 = np.sin(t1)
+            c23 = np.cos(t2 + t3)
+            s23 = np.sin(t2 + t3)
+            m = R[:, 0, 2]*s23*c1 + R[:, 1, 2]*s23*s1 + R[:, 2, 2]*c23
+            t5 = np.arctan2(np.sqrt(np.clip(1 - m*m, 0, None)), m)
+            t4 = np.arctan2(R[:, 1, 2]*c1 - R[:, 0, 2]*s1, R[:, 0, 2]*c23*c1 + R[:, 1, 2]*c23*s1 - R[:, 2, 2]*s23)
+            t6 = np.arctan2(R[:, 0, 1]*s23*c1 + R[:, 1, 1]*s23*s1 + R[:, 2, 1]*c23,
+                            -R[:, 0, 0]*s23*c1 - R[:, 1, 0]*s23*s1 - R[:, 2, 0]*c23)
+            for flip, (w4, w5, w6) in enumerate([(t4, t5, t6), (t4 + math.pi, -t5, t6 - math.pi)]):
+                col = 2*i + flip
+                q[:, col, 0] = t1
+                q[:, col, 1] = t2
+                q[:, col, 2] = t3
+                q[:, col, 3] = w4
+                q[:, col, 4] = w5
+                q[:, col, 5] = w6
+                valid[:, col] = reach
+        j = self.model_2_fanuc(q)
+        # J1, J4 and J6 in [-pi, pi], J2 and J3 in [-pi, pi] too (J3 range of Fanuc arms goes over 180 deg)
+        j = np.mod(j + math.pi, 2*math.pi) - math.pi
+        for axis in (1, 2):
+            low, high = self.limits[axis]
+            j[:, :, axis] = np.where(j[:, :, axis] < low, j[:, :, axis] + 2*math.pi, j[:, :, axis])
+            j[:, :, axis] = np.where(j[:, :, axis] > high, j[:, :, axis] - 2*math.pi, j[:, :, axis])
+        valid &= np.all((j >= self.limits[:, 0]) & (j <= self.limits[:, 1]), axis=2)
+        return np.degrees(j), valid
+
+    def closest(self, solutions, valid, previous):
+        """Returns the solution (6,) in deg closest to the previous joints, or None.
+        J1/J4/J6 are moved by +/-360 deg when it brings them closer within the limits."""
+        limits = np.degrees(self.limits)
+        best = None
+        best_dist = None
+        for i in range(solutions.shape[0]):
+            if not valid[i]:
+                continue
+            q = solutions[i].copy()
+            for axis in _WRAPPED:
+                values = q[axis] + 360.0*np.arange(-2, 3)
+                values = values[(values >= limits[axis, 0]) & (values <= limits[axis, 1])]
+                q[axis] = values[np.argmin(np.abs(values - previous[axis]))]
+            dist = np.max(np.abs(q - previous))
+            if best is None or dist < best_dist:
+                best = q
+                best_dist = dist
+        return best
+
+    def ik(self, poses, seed=None, max_step=MAX_STEP):
+        """Returns the joints (N,6) in deg of (N,4,4) TCP poses and a (N,) mask of the poses that were solved.
+        Each solution is the one closest to the previous joints (seed for the first pose).
+        The solution branch is followed over the whole array and only searched again where
+        it jumps more than max_step deg (wrist singularity, limits), so long smooth paths are
+        solved with array operations."""
+        solutions, valid = self.ik_all(poses)
+        n = solutions.shape[0]
+        joints = np.full((n, 6), np.nan)
+        solved = np.zeros(n, dtype=bool)
+        limits = np.degrees(self.limits)
+        previous = np.zeros(6) if seed is None else np.asarray(seed, dtype=float)[0:6]
+        i = 0
+        while i < n:
+            q = self.closest(solutions[i], valid[i], previous)
+            if q is None:
+                i += 1
+                continue
+            # follow the branch of this solution
+            branch = int(np.argmin(np.max(np.abs(np.mod(solutions[i] - q + 180.0, 360.0) - 180.0), axis=1) + 1e9*(~valid[i])))
+            segment = solutions[i:, branch].copy()
+            segment[0] = q
+            for axis in _WRAPPED:
+                segment[:, axis] = np.degrees(np.unwrap(np.radians(segment[:, axis])))
+            step = np.max(np.abs(np.diff(segment, axis=0)), axis=1)
+            ok = valid[i+1:, branch] & (step <= max_step) & np.all((segment[1:] >= limits[:, 0]) & (segment[1:] <= limits[:, 1]), axis=1)
+            bad = np.flatnonzero(~ok)
+            end = i + 1 + (bad[0] if bad.size else ok.size)
+            joints[i:end] = segment[0:end-i]
+            solved[i:end] = True
+            previous = joints[end-1]
+            i = end
+        return joints, solved
+
+
+def conf_RLF(joints, kinematics=None):
+    """Returns the RoboDK configuration flags (N,3) [rear, lower, flip] of (N,6) Fanuc joints in deg.
+    add_target_cartesian writes them as B/T, D/U and F/N."""
+    joints = np.atleast_2d(np.asarray(joints, dtype=float))
+    if kinematics is None:
+        kinematics = FanucKinematics()
+    q = kinematics.fanuc_2_model(np.radians(joints[:, 0:6]))
+    psi3 = math.atan2(kinematics.a2, kinematics.c3)
+    k = math.hypot(kinematics.a2, kinematics.c3)
+    # wrist center in the arm plane (X: away from J1, along the J1 direction)
+    wx = kinematics.c2*np.sin(q[:, 1]) + k*np.sin(q[:, 1] + q[:, 2] + psi3) + kinematics.a1
+    rear = wx < 0
+    # elbow below the line from J2 to the wrist center
+    lower = np.sin(q[:, 2] + psi3)*np.where(wx - kinematics.a1 < 0, -1.0, 1.0) < 0
+    # F means J5 >= 0, N means J5 < 0
+    flip = joints[:, 4] >= 0
+    return np.stack((rear, lower, flip), axis=1).astype(float)
@@ -0,0 +1,108 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Joint space continuity analyzer.
+#
+# Checks the joints of consecutive targets of a program page and reports:
+#     - delta:     a joint moves more than MAX_DELTA deg (mm for linear axes) in one segment
+#     - turn:      the turn number of J1/J4/J6 written in CONFIG changes (angle_2_turn)
+#     - wrist:     J5 gets closer than WRIST_SINGULARITY deg to 0 (wrist singularity)
+#     - turntable: the turntable angle written in the program (% 360 above 360 deg, or the
+#                  unwound angles given as written) jumps while the real axis moves continuously
+# All checks are array operations over the whole page.
+#
+# Usage:
+#     issues = analyze(joints, axes_type=['R','R','R','R','R','R','T','J'], labels=labels)
+#     for index, label, kind, message in issues: ...
+#
+# The post runs the analyzer for every page when CHECK_JOINTS is True and adds the
+# issues to the LOG.
+# --------------------------------------------
+
+import numpy as np
+
+MAX_DELTA = 45.0            # deg (or mm) per segment
+WRIST_SINGULARITY = 5.0     # deg, |J5| below this is reported
+TURN_AXES = (0, 3, 5)       # J1, J4, J6
+
+
+def angle_2_turn(angle):
+    """Turn number of a joint as written in CONFIG (vectorized version of the post's angle_2_turn)"""
+    angle = np.asarray(angle, dtype=float)
+    return np.where(angle >= 0.0, np.floor((angle + 180.0)/360.0), -np.floor((-angle + 180.0)/360.0)).astype(int)
+
+
+def turntable_angle(angle):
+    """Turntable angle as written in the program"""
+    angle = np.asarray(angle, dtype=float)
+    return np.where(angle > 360, np.mod(angle, 360), angle)
+
+
+def _runs(mask):
+    """Indexes where a run of True values starts"""
+    return np.flatnonzero(mask & ~np.concatenate(([False], mask[:-1])))
+
+
+def analyze(joints, axes_type=None, labels=None, max_delta=MAX_DELTA, wrist_singularity=WRIST_SINGULARITY, written=None):
+    """Returns the continuity issues of a (N, nAxes) joints array as a list of (index, label, kind, message)
+    sorted by target index. labels is an optional list with the pass label of every target.
+    written is an optional (N, nTurntableAxes) array with the turntable angles written in the program
+    (for example by turntable.unwind), by default the angles are written % 360 above 360 deg."""
+    joints = np.asarray(joints, dtype=float)
+    if joints.ndim != 2 or joints.shape[0] == 0:
+        return []
+    n, naxes = joints.shape
+    if axes_type is None:
+        axes_type = ['R']*naxes
+    axes_type = list(axes_type)[0:naxes]
+    robot_axes = [i for i, t in enumerate(axes_type) if t in ('R', 'L')]
+    turntable_axes = [i for i, t in enumerate(axes_type) if t == 'J']
+    issues = []
+
+    def label(i):
+        return labels[i] if labels is not None and i < len(labels) else ''
+
+    if n > 1:
+        delta = np.diff(joints, axis=0)
+
+        # large moves per segment
+        big = np.abs(delta) > max_delta
+        big[:, turntable_axes] = False
+        for seg, axis in zip(*np.nonzero(big)):
+            issues.append((seg + 1, label(seg + 1), 'delta', 'J%i moves %.1f (%.3f -> %.3f)' % (axis + 1, delta[seg, axis], joints[seg, axis], joints[seg + 1, axis])))
+
+        # turn number changes
+        for axis in TURN_AXES:
+            if axis >= naxes:
+                continue
+            turns = angle_2_turn(joints[:, axis])
+            for seg in np.flatnonzero(np.diff(turns)):
+                issues.append((seg + 1, label(seg + 1), 'turn', 'J%i turn %i -> %i (%.3f -> %.3f)' % (axis + 1, turns[seg], turns[seg + 1], joints[seg, axis], joints[seg + 1, axis])))
+
+        # turntable wrap in the program while the axis moves continuously
+        for column, axis in enumerate(turntable_axes):
+            angles = turntable_angle(joints[:, axis]) if written is None else np.asarray(written, dtype=float)[:, column]
+            for seg in np.flatnonzero(np.abs(np.diff(angles) - delta[:, axis]) > 1e-6):
+                issues.append((seg + 1, label(seg + 1), 'turntable', 'J%i written %.3f -> %.3f for %.3f -> %.3f' % (axis + 1, angles[seg], angles[seg + 1], joints[seg, axis], joints[seg + 1, axis])))
+
+    # wrist singularity (first target of every run)
+    if naxes > 4 and 4 in robot_axes:
+        near = np.abs(joints[:, 4]) < wrist_singularity
+        starts = _runs(near)
+        if starts.size:
+            ends = _runs(~near)
+            for start in starts:
+                after = ends[ends > start]
+                count = (after[0] if after.size else n) - start
+                issues.append((start, label(start), 'wrist', 'J5 = %.3f, %i targets within %.1f deg of the wrist singularity' % (joints[start, 4], count, wrist_singularity)))
+
+    issues.sort(key=lambda issue: issue[0])
+    return issues
+
+
+def summary(issues):
+    """Count of issues per kind"""
+    counts = {}
+    for issue in issues:
+        counts[issue[2]] = counts.get(issue[2], 0) + 1
+    return counts
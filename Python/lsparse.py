@@ -0,0 +1,362 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Streaming parser and structural validator of Fanuc LS files.
+#
+# Reads the LS dialect written by the posts (and the TP templates of tpp/ls/) in blocks
+# of bytes, without keeping the program in memory:
+#     /PROG name
+#     /ATTR      NAME = value; (LINE_COUNT, DEFAULT_GROUP...)
+#     /MN        numbered instructions ('   1:L P[1] ...' or ' : ...'), LBL[] and JMP LBL[]
+#     /POS       P[n]{ GPi: ... }; blocks
+#     /END
+# Only compact indexes are built (NumPy arrays): the byte offset of every instruction,
+# the P[] definitions with their GP groups and file line, the P[] references, the
+# labels and the jumps. The lines, P[] and GP tokens of a block are found with array
+# operations over the bytes, so the parser runs close to the reading speed. The
+# validator checks:
+#     - dangling: a P[] referenced in /MN is not defined in /POS
+#     - unused:   a P[] defined in /POS is not referenced
+#     - position: a P[] is defined twice
+#     - label:    a LBL[] is defined twice
+#     - jump:     a JMP to a LBL[] that is not defined
+#     - count:    LINE_COUNT of /ATTR differs from the number of instructions
+#     - group:    the GP groups of a P[] differ from the groups of DEFAULT_GROUP
+#     - section:  missing or misplaced /PROG, /MN, /POS or /END
+#
+# Usage:
+#     python lsparse.py Prog.LS [Prog2.LS ...]
+# --------------------------------------------
+
+import re
+import sys
+import numpy as np
+
+SECTIONS = (b'/PROG', b'/ATTR', b'/APPL', b'/MN', b'/POS', b'/END')
+ORDER = ('/PROG', '/ATTR', '/MN', '/POS', '/END')
+
+# lines of /MN (every line of a block is preceded by a newline)
+_RE_CONTINUATION = re.compile(rb'\n(?! *\d* *:)')      # second line of a circular move
+_RE_COMMENT = re.compile(rb'\n *\d* *: *!')
+_RE_LABEL = re.compile(rb'\n *\d* *: *LBL\[')
+_RE_LBL = re.compile(rb'LBL\[(\d+)')
+
+BLOCK_SIZE = 1 << 24    # bytes read at a time
+
+_INDEXES = ('mn_offsets', 'mn_lines', 'refs', 'ref_lines', 'labels', 'label_lines', 'jumps', 'jump_lines', 'positions', 'position_lines', 'position_groups')
+
+
+class LSError(Exception):
+    """Raised when a file is not a LS program"""
+    pass
+
+
+class LSFile(object):
+    """Indexes of a LS program built by parse()"""
+    def __init__(self):
+        self.name = None
+        self.attrs = {}             # /ATTR values as strings
+        self.sections = []          # (section, file line) in the order of the file
+        self.nlines = 0             # lines of the file
+        self.mn_offsets = None      # byte offset of every instruction of /MN
+        self.mn_lines = None        # file line of every instruction
+        self.refs = None            # P[] referenced in /MN
+        self.ref_lines = None
+        self.labels = None          # LBL[] defined in /MN
+        self.label_lines = None
+        self.jumps = None           # LBL[] jumped to (numeric labels only)
+        self.jump_lines = None
+        self.positions = None       # P[] defined in /POS
+        self.position_lines = None
+        self.position_groups = None # bit mask of the GP groups of every P[]
+        self._chunks = dict((name, []) for name in _INDEXES)
+
+    def add(self, name, values):
+        self._chunks[name].append(np.asarray(values, dtype=np.int64))
+
+    def finish(self):
+        for name in _INDEXES:
+            chunks = self._chunks[name]
+            setattr(self, name, np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int64))
+        self._chunks = None
+
+    @property
+    def line_count(self):
+        """Number of instructions of /MN"""
+        return len(self.mn_offsets)
+
+    def default_groups(self):
+        """Bit mask of the groups of DEFAULT_GROUP, None if it is not defined"""
+        value = self.attrs.get('DEFAULT_GROUP')
+        if value is None:
+            return None
+        mask = 0
+        for i, group in enumerate(value.split(',')):
+            if group.strip() == '1':
+                mask |= 1 << i
+        return mask
+
+
+def _groups_str(mask):
+    return ','.join('GP%i' % (i + 1) for i in range(32) if mask & (1 << i)) or 'none'
+
+
+def _numbers(data, starts, width=10):
+    """Integers written at the start positions of a uint8 array. Returns (values, number of digits)"""
+    values = np.zeros(starts.shape[0], dtype=np.int64)
+    count = np.zeros(starts.shape[0], dtype=np.int64)
+    active = np.ones(starts.shape[0], dtype=bool)
+    last = data.shape[0] - 1
+    for k in range(width):
+        digit = data[np.minimum(starts + k, last)].astype(np.int64) - 48
+        active &= (digit >= 0) & (digit <= 9)
+        if not active.any():
+            break
+        values = np.where(active, values*10 + digit, values)
+        count += active
+    return values, count
+
+
+def _is_word(data):
+    return ((data >= 48) & (data <= 57)) | ((data >= 65) & (data <= 90)) | ((data >= 97) & (data <= 122)) | (data == 95)
+
+
+def _positions(regex, segment):
+    return np.fromiter((match.start() for match in regex.finditer(segment)), dtype=np.int64)
+
+
+def _parse_mn(ls, segment, offset, number):
+    """Index the instructions of /MN of a segment of a block (lines preceded by a newline).
+    Returns the number of lines of the segment."""
+    data = np.frombuffer(segment, dtype=np.uint8)
+    newlines = np.flatnonzero(data == 10)
+    instruction = np.ones(newlines.shape[0], dtype=bool)
+    if b'C P[' in segment or b'A P[' in segment:
+        instruction[np.searchsorted(newlines, _positions(_RE_CONTINUATION, segment))] = False
+    ls.add('mn_offsets', offset + newlines[instruction] + 1)
+    ls.add('mn_lines', number + 1 + np.flatnonzero(instruction))
+    comments = np.searchsorted(newlines, _positions(_RE_COMMENT, segment))
+
+    # P[n] not preceded by a letter (PR[], SPR[]...) and out of the comments
+    refs = np.flatnonzero((data[1:-2] == 80) & (data[2:-1] == 91)) + 1
+    refs = refs[~_is_word(data[refs - 1])]
+    ids, count = _numbers(data, refs + 2)
+    line = np.searchsorted(newlines, refs, 'right') - 1
+    keep = (count > 0) & ~np.isin(line, comments)
+    ls.add('refs', ids[keep])
+    ls.add('ref_lines', number + 1 + line[keep])
+
+    # labels: LBL[n] at the start of an instruction, jumps: any other LBL[n]
+    if b'LBL[' in segment:
+        definitions = set(_positions(_RE_LABEL, segment).tolist())
+        comments = set(comments.tolist())
+        labels = []
+        jumps = []
+        for match in _RE_LBL.finditer(segment):
+            start = segment.rfind(b'\n', 0, match.start())
+            index = int(np.searchsorted(newlines, start))
+            if index in comments:
+                continue
+            if start in definitions and segment.index(b'LBL[', start) == match.start():
+                labels.append((int(match.group(1)), number + 1 + index))
+            else:
+                jumps.append((int(match.group(1)), number + 1 + index))
+        ls.add('labels', [label for label, line in labels])
+        ls.add('label_lines', [line for label, line in labels])
+        ls.add('jumps', [label for label, line in jumps])
+        ls.add('jump_lines', [line for label, line in jumps])
+    return newlines.shape[0]
+
+
+def _parse_pos(ls, segment, number):
+    """Index the positions of /POS of a segment of a block: P[n] definitions and their GP groups.
+    Returns the number of lines of the segment."""
+    data = np.frombuffer(segment, dtype=np.uint8)
+    newlines = np.flatnonzero(data == 10)
+    follow = np.minimum(newlines[:, None] + np.array([1, 2]), data.shape[0] - 1)
+    index = np.flatnonzero((data[follow[:, 0]] == 80) & (data[follow[:, 1]] == 91))
+    starts = newlines[index]
+    ids, count = _numbers(data, starts + 3)
+    index, starts, ids = index[count > 0], starts[count > 0], ids[count > 0]
+
+    gp = np.flatnonzero((data[:-2] == 71) & (data[1:-1] == 80))
+    groups, count = _numbers(data, gp + 2)
+    gp, groups = gp[count > 0], groups[count > 0]
+    owner = np.searchsorted(starts, gp, 'right') - 1
+    masks = np.zeros(starts.shape[0], dtype=np.int64)
+    np.bitwise_or.at(masks, owner[owner >= 0], np.left_shift(1, groups[owner >= 0] - 1))
+    if (owner < 0).any():
+        # end of the last position of the previous block
+        previous = [chunk for chunk in ls._chunks['position_groups'] if chunk.shape[0]]
+        if previous:
+            previous[-1][-1] |= np.bitwise_or.reduce(np.left_shift(1, groups[owner < 0] - 1))
+    ls.add('positions', ids)
+    ls.add('position_lines', number + 1 + index)
+    ls.add('position_groups', masks)
+    return newlines.shape[0]
+
+
+def parse(source, block_size=BLOCK_SIZE):
+    """Parse a LS file (path or binary stream) and returns the LSFile indexes"""
+    if isinstance(source, str):
+        with open(source, 'rb') as stream:
+            return parse(stream, block_size)
+    ls = LSFile()
+    section = None
+    offset = -1         # file offset of the first byte of the block
+    number = 0          # file lines before the block
+    carry = b'\n'       # every line of a block is preceded by a newline
+    while True:
+        data = source.read(block_size)
+        block = carry + data
+        if data:
+            cut = block.rfind(b'\n')
+            if cut <= 0:
+                carry = block
+                continue
+            block, carry = block[:cut], block[cut:]
+        elif len(block) <= 1:
+            break
+        else:
+            carry = b''
+        # split the block at the section lines
+        start = 0
+        while start < len(block):
+            end = block.find(b'\n/', start)
+            while end >= 0:
+                name = block[end+1:end+16].split(None, 1)[0].rstrip(b';')
+                if name in SECTIONS:
+                    break
+                end = block.find(b'\n/', end + 1)
+            if end < 0:
+                end = len(block)
+            if end > start:
+                if section == b'/MN':
+                    number += _parse_mn(ls, block[start:end], offset + start, number)
+                elif section == b'/POS':
+                    number += _parse_pos(ls, block[start:end], number)
+                else:
+                    if section == b'/ATTR':
+                        for line in block[start+1:end].split(b'\n'):
+                            if b'=' in line:
+                                key, value = line.split(b'=', 1)
+                                ls.attrs[key.strip().decode(errors='replace')] = value.strip().rstrip(b';,').strip().decode(errors='replace')
+                    number += block.count(b'\n', start, end)
+            if end == len(block):
+                break
+            # section line
+            line_end = block.find(b'\n', end + 1)
+            if line_end < 0:
+                line_end = len(block)
+            line = block[end+1:line_end]
+            section = line.split(None, 1)[0].rstrip(b';')
+            number += 1
+            ls.sections.append((section.decode(), number))
+            if section == b'/PROG':
+                ls.name = line[5:].strip().decode(errors='replace')
+            start = line_end
+        offset += len(block)
+        if not data:
+            break
+    if not ls.sections:
+        raise LSError('No LS sections found (/PROG, /MN, /POS...)')
+    ls.nlines = number
+    ls.finish()
+    return ls
+
+
+def validate(ls):
+    """Returns the structural issues of a parsed LS file as a list of (file line, kind, message) sorted by line"""
+    issues = []
+
+    # sections
+    names = [name for name, line in ls.sections]
+    if not names or names[0] != '/PROG':
+        issues.append((1, 'section', '/PROG is not the first line'))
+    for name in ('/MN', '/END'):
+        if name not in names:
+            issues.append((ls.nlines, 'section', '%s is missing' % name))
+    order = [name for name in names if name in ORDER]
+    if order != sorted(order, key=ORDER.index) or len(set(order)) != len(order):
+        issues.append((ls.sections[0][1] if ls.sections else 1, 'section', 'sections out of order: %s' % ' '.join(names)))
+
+    # positions (first occurrence of every P id)
+    unique, first = np.unique(ls.positions, return_index=True)
+    twice = np.ones(ls.positions.shape[0], dtype=bool)
+    twice[first] = False
+    for index in np.flatnonzero(twice):
+        issues.append((int(ls.position_lines[index]), 'position', 'P[%i] is defined twice' % ls.positions[index]))
+    refs, first_ref = np.unique(ls.refs, return_index=True)
+    for index in first_ref[~np.isin(refs, unique)]:
+        issues.append((int(ls.ref_lines[index]), 'dangling', 'P[%i] is not defined in /POS' % ls.refs[index]))
+    for index in first[~np.isin(unique, refs)]:
+        issues.append((int(ls.position_lines[index]), 'unused', 'P[%i] is not used' % ls.positions[index]))
+
+    # labels
+    labels = {}
+    for label, line in zip(ls.labels.tolist(), ls.label_lines.tolist()):
+        if label in labels:
+            issues.append((line, 'label', 'LBL[%i] is also defined at line %i' % (label, labels[label])))
+        else:
+            labels[label] = line
+    for label, line in zip(ls.jumps.tolist(), ls.jump_lines.tolist()):
+        if label not in labels:
+            issues.append((line, 'jump', 'LBL[%i] is not defined' % label))
+
+    # LINE_COUNT
+    count = ls.attrs.get('LINE_COUNT')
+    if count is not None:
+        try:
+            count = int(count)
+        except ValueError:
+            issues.append((1, 'count', 'LINE_COUNT is not a number: %s' % count))
+        else:
+            if count != ls.line_count:
+                issues.append((1, 'count', 'LINE_COUNT = %i for %i instructions' % (count, ls.line_count)))
+
+    # GP groups of the positions (every combination of groups is reported once)
+    mask = ls.default_groups()
+    if mask is not None:
+        groups, first = np.unique(ls.position_groups, return_index=True)
+        for group, index in zip(groups.tolist(), first.tolist()):
+            if group != mask:
+                issues.append((int(ls.position_lines[index]), 'group', 'P[%i] uses %s, DEFAULT_GROUP %s' % (ls.positions[index], _groups_str(group), _groups_str(mask))))
+
+    issues.sort(key=lambda issue: issue[0])
+    return issues
+
+
+def summary(issues):
+    """Count of issues per kind"""
+    counts = {}
+    for issue in issues:
+        counts[issue[1]] = counts.get(issue[1], 0) + 1
+    return counts
+
+
+def main(argv):
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Parse and validate Fanuc LS files')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--max', type=int, default=50, help='maximum issues printed per file')
+    args = parser.parse_args(argv)
+    result = 0
+    for path in args.files:
+        t0 = time.perf_counter()
+        ls = parse(path)
+        issues = validate(ls)
+        elapsed = time.perf_counter() - t0
+        print('%s: %s, %i lines, %i instructions, %i positions, %.2f s' % (path, ls.name, ls.nlines, ls.line_count, len(ls.positions), elapsed))
+        for line, kind, message in issues[:args.max]:
+            print('    line %i: %s: %s' % (line, kind, message))
+        if len(issues) > args.max:
+            print('    ... %i more' % (len(issues) - args.max))
+        if issues:
+            print('    ' + ', '.join('%s: %i' % item for item in sorted(summary(issues).items())))
+            result = 1
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
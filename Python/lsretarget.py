@@ -0,0 +1,295 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Retarget LS programs from one cell post to another without regenerating them.
+#
+# The cell posts (Fanuc_G6T_cell1_hs, Fanuc_G6T_cell2_HS1, ...) write the same
+# program with different numbers: position registers of the offsets, registers of the
+# speed and pass labels, frame/tool numbers, timers, the height sensor output, the
+# program calls and the GP groups of the track and turntable. profile() reads them from
+# the post class and retarget() rewrites the pages in one streaming pass:
+#     PR[n]  R[n]  TIMER[n]  DO[n]  UFRAME_NUM=n  UTOOL_NUM=n  UF : n, UT : n
+#     CALL name  GPn:  DEFAULT_GROUP
+# Only the numbers of the source profile are changed, the rest of the file is copied.
+#
+# The result is the program the target post would write when both posts write the same
+# lines (same methods, speeds, lines per page, coordinated motion, joint configuration,
+# axes (AXES_TYPE) and group layout). check() lists what differs; retarget() refuses such
+# pairs unless force is set (the program is then only renumbered for the target cell).
+# The cell posts of this folder all differ: cell2_HS1 has a track axis (E1 in GP1) that
+# cell2_HS2 does not have, so its pages are not valid HS2 programs even renumbered.
+# A frame or tool number set with an explicit id (setFrame(pose, frame_id), written with
+# a "! UFn:..." comment) is not ACTIVE_UF: retarget() refuses the file if the number
+# would be changed, with force the number is kept.
+#
+# Usage (the posts are imported from the Posts folder):
+#     python Python/lsretarget.py <source post> <target post> Prog.LS Prog2.LS --folder <output folder>
+# --------------------------------------------
+
+import os
+import re
+import sys
+import importlib
+
+PATH_POSTS = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Posts'))
+
+# numbers remapped per kind of token: post attributes
+REGISTERS = (
+    ('PR', ('OFFSET_PR', 'OFFSET_START', 'OFFSET_STOP', 'OFFSET_APPROACH', 'OFFSET_DEPART', 'SPARE_PR', 'UTOOL_PR', 'UFRAME_PR')),
+    ('R', ('SPEED_REGISTER', 'PASS_LBL_REGISTER', 'J_LBL_REGISTER')),
+    ('TIMER', ('LASER_TIMER', 'POWDER_TIMER')),
+    ('DO', ('HEIGHT_SENSOR',)),
+    ('UF', ('ACTIVE_UF',)),
+    ('UT', ('ACTIVE_UT',)),
+    ('GP', ('GRP_TRACK', 'GRP_TURNTABLE')),
+    ('CALL', ('PROG_START_CELL', 'PROG_STOP_CELL', 'PROG_START_EXTRUD', 'PROG_STOP_EXTRUD', 'PROG_START_TOOL', 'PROG_STOP_TOOL')),
+)
+
+# attributes that change the lines of the program (not only numbers)
+FIXED = ('MAX_LINES_X_PROG', 'SPEED', 'JOINT_SPEED', 'TRAVEL_SPEED', 'APPRCH_SPEED', 'CNT_VALUE', 'USE_COORD_MOTION',
+         'JOINT_CONFIG', 'AXES_TYPE', 'HAS_TRACK', 'HAS_TURNTABLE', 'PASS_LBL_COUNT', 'END_LBL', 'INCLUDE_SUB_PROGRAMS')
+
+# forms of the tokens of every kind: literal bytes (%s is the number or name) or regular
+# expressions (starting with a literal so that the search is fast)
+_LITERALS = {
+    'TIMER': (b'TIMER[%s]',),
+    'DO': (b'DO[%s]', b'DO[%s:'),
+    'UF': (b'UFRAME_NUM=%s ', b'UF : %s,'),
+    'UT': (b'UTOOL_NUM=%s ', b'UT : %s,'),
+    'GP': (b'GP%s:',),
+}
+_PATTERNS = {
+    'PR': (rb'PR\[(?<![A-Za-z]PR\[)%s(?=[]:,])', b'PR[%s'),
+    'R': (rb'R\[(?<![A-Za-z]R\[)%s(?=[]:,])', b'R[%s'),
+    'CALL': (rb'CALL %s(?!\w)', b'CALL %s'),
+}
+_RE_DEFAULT_GROUP = re.compile(rb'(DEFAULT_GROUP\s*= )([^;\n]*)')
+_RE_EXPLICIT = re.compile(rb'! U([FT])(\d+):')    # comment of setFrame/setTool with an explicit id
+
+BLOCK_SIZE = 1 << 22
+
+
+class RetargetError(Exception):
+    """Raised when a program can't be retargeted between two posts"""
+    pass
+
+
+def _post_class(post):
+    if isinstance(post, str):
+        if PATH_POSTS not in sys.path:
+            sys.path.insert(0, PATH_POSTS)
+        return importlib.import_module(post).RobotPost
+    return post
+
+
+def profile(post):
+    """Numbers and names of a cell post (class or module name) used by retarget: {attribute: value}"""
+    post_class = _post_class(post)
+    result = {}
+    for kind, names in REGISTERS:
+        for name in names:
+            if hasattr(post_class, name):
+                result[name] = getattr(post_class, name)
+    return result
+
+
+def _code_key(code):
+    """Comparable content of a code object (without file names and line numbers)"""
+    consts = tuple(_code_key(const) if hasattr(const, 'co_code') else const for const in code.co_consts)
+    return (code.co_code, consts, code.co_names)
+
+
+def check(source, target):
+    """Differences between two posts that change the lines of the program (not only the numbers).
+    Returns a list of messages, empty if the target post writes the same lines."""
+    source, target = _post_class(source), _post_class(target)
+    issues = []
+    for name in FIXED:
+        if getattr(source, name, None) != getattr(target, name, None):
+            issues.append('%s: %r -> %r' % (name, getattr(source, name, None), getattr(target, name, None)))
+    if (getattr(source, 'GRP_TRACK', 0) == 0) != (getattr(target, 'GRP_TRACK', 0) == 0):
+        issues.append('GRP_TRACK: %r -> %r (track in GP1 or in its own group)' % (getattr(source, 'GRP_TRACK', 0), getattr(target, 'GRP_TRACK', 0)))
+    methods = set(name for name in dir(source) if callable(getattr(source, name)) and hasattr(getattr(source, name), '__code__'))
+    methods |= set(name for name in dir(target) if callable(getattr(target, name)) and hasattr(getattr(target, name), '__code__'))
+    for name in sorted(methods):
+        a, b = getattr(source, name, None), getattr(target, name, None)
+        if a is None or b is None or _code_key(a.__code__) != _code_key(b.__code__):
+            issues.append('method %s is different' % name)
+    return issues
+
+
+def mapping(source, target):
+    """Numbers to change per kind of token: {kind: {source value: target value}}.
+    Raises RetargetError if a source number has two different targets."""
+    source, target = profile(source), profile(target)
+    result = {}
+    for kind, names in REGISTERS:
+        table = {}
+        for name in names:
+            if name not in source or name not in target:
+                continue
+            old, new = source[name], target[name]
+            if kind == 'GP' and (old == 0 or new == 0):
+                continue
+            if old in table and table[old] != new:
+                raise RetargetError('%s %s is %s and %s in the target post' % (kind, old, table[old], new))
+            table[old] = new
+        table = dict((old, new) for old, new in table.items() if old != new)
+        if table:
+            result[kind] = table
+    return result
+
+
+class Retargeter(object):
+    """Rewrites the tokens of LS files with the numbers of a mapping.
+    Every form of token is replaced with bytes.replace or a regular expression with a literal prefix;
+    when a number is also the target of another one the tokens go through a placeholder first."""
+    def __init__(self, maps):
+        self.maps = maps
+        self.rules = []     # (regex or None, old, new) in order
+        placeholders = []
+        for kind, table in maps.items():
+            forms = [(None, form) for form in _LITERALS.get(kind, ())]
+            if kind in _PATTERNS:
+                forms.append(_PATTERNS[kind])
+            for pattern, literal in forms:
+                pairs = []
+                for old, new in table.items():
+                    old, new = str(old).encode(), str(new).encode()
+                    regex = None if pattern is None else re.compile(pattern % re.escape(old))
+                    pairs.append((regex, literal % old, literal % new))
+                chained = set(new for regex, old, new in pairs) & set(old for regex, old, new in pairs)
+                for regex, old, new in pairs:
+                    if chained:
+                        # a -> b and b -> c: a -> placeholder -> b
+                        placeholder = b'\x00%i\x00' % len(placeholders)
+                        placeholders.append((None, placeholder, new))
+                        new = placeholder
+                    self.rules.append((regex, old, new))
+        self.rules += placeholders
+
+    def _default_group(self, match):
+        """DEFAULT_GROUP with the '1' of every mapped group moved to the target group"""
+        old = match.group(2).split(b',')
+        new = [b'*']*len(old)
+        table = self.maps['GP']
+        for i, flag in enumerate(old):
+            if flag.strip() == b'1':
+                j = table.get(i + 1, i + 1) - 1
+                if j >= len(new):
+                    raise RetargetError('Group %i does not fit in DEFAULT_GROUP' % (j + 1))
+                new[j] = b'1'
+            elif flag.strip() != b'*':
+                new[i] = flag
+        return match.group(1) + b','.join(new)
+
+    def convert(self, data):
+        """Rewrites a block of whole lines"""
+        for regex, old, new in self.rules:
+            if regex is None:
+                data = data.replace(old, new)
+            else:
+                data = regex.sub(new, data)
+        if 'GP' in self.maps and b'DEFAULT_GROUP' in data:
+            data = _RE_DEFAULT_GROUP.sub(self._default_group, data)
+        return data
+
+    def stream(self, source, destination, block_size=BLOCK_SIZE):
+        """Rewrites a binary stream into another one. Returns the number of bytes written."""
+        carry = b''
+        size = 0
+        while True:
+            data = source.read(block_size)
+            if not data:
+                break
+            data = carry + data
+            cut = data.rfind(b'\n') + 1
+            if cut == 0:
+                carry = data
+                continue
+            carry = data[cut:]
+            out = self.convert(data[:cut])
+            destination.write(out)
+            size += len(out)
+        if carry:
+            out = self.convert(carry)
+            destination.write(out)
+            size += len(out)
+        return size
+
+
+def explicit_ids(path, block_size=BLOCK_SIZE):
+    """Frame and tool numbers set with an explicit id in an LS file: {'UF': set, 'UT': set}"""
+    result = {'UF': set(), 'UT': set()}
+    carry = b''
+    with open(path, 'rb') as fid:
+        while True:
+            data = fid.read(block_size)
+            if not data:
+                break
+            data = carry + data
+            for kind, number in _RE_EXPLICIT.findall(data):
+                result['U' + kind.decode()].add(int(number))
+            carry = data[-16:]
+    return result
+
+
+def retarget(files, source, target, folder, force=False):
+    """Rewrites LS files from the source post (class or module name) to the target post, in folder.
+    Returns the list of files written."""
+    issues = check(source, target)
+    if issues and not force:
+        raise RetargetError('The target post writes different lines:\n    ' + '\n    '.join(issues))
+    maps = mapping(source, target)
+    retargeter = Retargeter(maps)
+    written = []
+    for path in files:
+        destination = os.path.join(folder, os.path.basename(path))
+        if os.path.abspath(destination) == os.path.abspath(path):
+            raise RetargetError('The output file is the input file: %s' % path)
+        file_retargeter = retargeter
+        if 'UF' in maps or 'UT' in maps:
+            # numbers set with an explicit id don't come from ACTIVE_UF/ACTIVE_UT
+            explicit = explicit_ids(path)
+            kept = dict((kind, explicit[kind] & set(maps.get(kind, ()))) for kind in ('UF', 'UT'))
+            if kept['UF'] or kept['UT']:
+                names = ', '.join('%s%i' % (kind, number) for kind in ('UF', 'UT') for number in sorted(kept[kind]))
+                if not force:
+                    raise RetargetError('%s sets %s with an explicit id: the number is not the one of the post' % (path, names))
+                file_maps = dict((kind, dict((old, new) for old, new in table.items() if old not in kept.get(kind, ())))
+                                 for kind, table in maps.items())
+                file_retargeter = Retargeter(dict((kind, table) for kind, table in file_maps.items() if table))
+        with open(path, 'rb') as fin, open(destination, 'wb') as fout:
+            file_retargeter.stream(fin, fout)
+        written.append(destination)
+    return written
+
+
+def main(argv):
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Retarget LS programs from one cell post to another')
+    parser.add_argument('source', help='post of the programs (for example Fanuc_G6T_cell1_hs)')
+    parser.add_argument('target', help='post of the new cell')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--folder', required=True, help='output folder')
+    parser.add_argument('--force', action='store_true', help='retarget even if the posts write different lines')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.folder):
+        os.makedirs(args.folder)
+    for issue in check(args.source, args.target):
+        print('Warning: ' + issue)
+    for kind, table in sorted(mapping(args.source, args.target).items()):
+        print('%s: %s' % (kind, ', '.join('%s -> %s' % item for item in sorted(table.items()))))
+    t0 = time.perf_counter()
+    try:
+        written = retarget(args.files, args.source, args.target, args.folder, args.force)
+    except RetargetError as e:
+        print(e)
+        return 1
+    print('%i files, %.2f s' % (len(written), time.perf_counter() - t0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
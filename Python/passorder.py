@@ -0,0 +1,499 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Pass ordering optimizer: reduce the link (travel) moves between passes.
+#
+# Works on the calls recorded with postrecord.py. The calls are run once on the post
+# (dry run, nothing is saved) to find where every pass starts (moveApproach) and ends
+# (moveLink), whatever triggers them: RunCode('moveApproach'), the magic speeds of
+# setSpeed or direct calls. Each pass is a node with an entry pose (its approach move)
+# and an exit pose (its depart move). The order of the nodes is solved with nearest
+# neighbour (grid spatial index) followed by 2-opt and Or-opt, and the calls are written
+# to a new log in that order.
+#
+#     - Event order assumed (TP template, RunCode scripts, pathingest): moveApproach, the
+#       approach move, laserStartSeq (or toolOn/moveLaserOn), the pass, laserStopSeq (or
+#       toolOff/moveDepart and the depart move), moveLink, link moves. The pass starts at
+#       moveApproach and its entry is the approach move after it. When moveApproach and
+#       laserStartSeq are triggered by the same call (magic speeds of setSpeed) the approach
+#       target is the move before that call, which then stays with the pass.
+#     - The first move after a pass (depart) stays with the pass. The other link moves
+#       (retracts, clearance waypoints) stay between two passes as long as the passes stay
+#       next to each other in the same direction. Where the order changes there is no
+#       recorded link: the passes are only reordered with direct_links=True (--direct-links)
+#       and the robot then goes straight from the exit of a pass to the entry of the next
+#       one. Check the new links for collisions before running the program.
+#     - The order is solved on the direct distances between passes. The travel reported is
+#       measured on the recorded link moves (before) and on the recorded or direct links of
+#       the new order (after). If the order does not change the records are returned unchanged.
+#     - Passes are only reordered inside groups of consecutive passes: any other call
+#       between two passes (ProgStart/ProgFinish, setFrame, setTool, RunCode, waits, ...)
+#       keeps its place.
+#     - With reverse=True a pass can also be run backwards: the targets of its moves
+#       are written in reverse order on the same calls (passes with MoveC are never reversed).
+#     - The pass labels (PASS_LBL_COUNT) are numbered by the post in the new order when
+#       the log is replayed, so startPassLoop keeps working.
+#
+# Usage:
+#     python passorder.py job.rdkpost job_ordered.rdkpost [--reverse] --direct-links
+#     python postrecord.py replay job_ordered.rdkpost
+# --------------------------------------------
+
+import sys
+import math
+import importlib
+
+import postrecord
+from postrecord import REC_CALL, REC_NEW, REC_SETATTR, REC_DELATTR
+
+MOTIONS = ('MoveL', 'MoveJ', 'MoveC')
+# calls that can be moved with the pass they come before
+LINK_CALLS = ('MoveL', 'MoveJ', 'setSpeed', 'setSpeedJoints', 'setZoneData', 'setAcceleration', 'setAccelerationJoints', 'RunMessage')
+OR_OPT_SEGMENTS = (1, 2, 3)
+NEIGHBOURS = 10
+
+
+#----------------------------------------------------
+#--------        Pass detection        --------------
+
+def find_passes(records, post_class=None):
+    """Dry run the records and return the (start, end, fused) record indexes of every pass:
+    start is the record that triggers moveApproach, end the record that triggers the moveLink after it
+    and fused is True if the start record also triggers laserStartSeq (the approach move is before it)"""
+    post = None
+    passes = []
+    state = {'index': 0, 'start': None, 'fused': False}
+
+    def hook(post, name, mark):
+        original = getattr(post, name)
+        def patched(*args, **kwargs):
+            mark()
+            return original(*args, **kwargs)
+        setattr(post, name, patched)
+
+    def mark_start():
+        if state['start'] is None:
+            state['start'] = state['index']
+            state['fused'] = False
+
+    def mark_laser():
+        if state['start'] == state['index']:
+            state['fused'] = True
+
+    def mark_end():
+        if state['start'] is not None:
+            passes.append((state['start'], state['index'], state['fused']))
+            state['start'] = None
+
+    for index, (kind, name, args, kwargs) in enumerate(records):
+        state['index'] = index
+        if kind == REC_NEW:
+            if post_class is None:
+                post_class = importlib.import_module(name).RobotPost
+            post = post_class(*args, **kwargs)
+            if hasattr(post, 'moveApproach'):
+                hook(post, 'moveApproach', mark_start)
+                hook(post, 'moveLink', mark_end)
+                if hasattr(post, 'laserStartSeq'):
+                    hook(post, 'laserStartSeq', mark_laser)
+        elif kind == REC_CALL:
+            if name in ('ProgSave', 'ProgSendRobot'):
+                continue
+            getattr(post, name)(*args, **kwargs)
+        elif kind == REC_SETATTR:
+            setattr(post, name, args[0])
+        elif kind == REC_DELATTR:
+            delattr(post, name)
+    return passes
+
+
+def _position(record):
+    """Position of a motion record (None for joint moves without pose)"""
+    kind, name, args, kwargs = record
+    if kind != REC_CALL or name not in MOTIONS:
+        return None
+    pose = args[2] if name == 'MoveC' else (args[0] if args else kwargs.get('pose'))
+    if pose is None:
+        return None
+    return tuple(pose.Pos())
+
+
+def _is_motion(record):
+    return record[0] == REC_CALL and record[1] in MOTIONS
+
+
+def _is_link(record):
+    return record[0] != REC_CALL or record[1] in LINK_CALLS
+
+
+def build_nodes(records, passes):
+    """Returns the groups of nodes that can be reordered. A node is a dict with the record
+    indexes of the pass (body: approach move, pass, depart move), the calls before it (gap),
+    the calls moved with it when its link changes (moved), the entry and exit positions and the
+    length of the recorded link from the exit of the previous pass (path, None for the first pass of a group)."""
+    # the first move after a pass is its depart move if another move follows before the next pass
+    departs = []
+    for k, (start, end, fused) in enumerate(passes):
+        stop = passes[k + 1][0] if k + 1 < len(passes) else len(records)
+        depart = None
+        for i in range(end + 1, stop):
+            if not _is_link(records[i]):
+                break
+            if _is_motion(records[i]):
+                depart = i
+                break
+        if depart is not None and k + 1 < len(passes) and not any(_is_motion(records[i]) for i in range(depart + 1, stop)):
+            depart = None
+        departs.append(depart)
+
+    groups = []
+    group = []
+    previous_end = None
+    for (start, end, fused), depart in zip(passes, departs):
+        gap = range(previous_end + 1 if previous_end is not None else 0, start)
+        barrier = previous_end is None or not all(_is_link(records[i]) for i in gap)
+        if barrier and group:
+            groups.append(group)
+            group = []
+        # the approach move (entry of the pass) follows moveApproach, or is the last move before
+        # the call that triggers both moveApproach and laserStartSeq
+        anchor = None
+        if fused:
+            for i in reversed(gap):
+                if _is_motion(records[i]):
+                    anchor = i
+                    break
+        first = anchor if anchor is not None else start
+        last = depart if depart is not None else end
+        node = {'start': start, 'end': end, 'barrier': barrier}
+        if barrier:
+            # the calls before the first pass of a group stay where they are
+            node['gap'] = []
+            node['moved'] = []
+        else:
+            node['gap'] = [i for i in gap if i < first]
+            node['moved'] = [i for i in node['gap'] if not _is_motion(records[i])]
+        node['body'] = list(range(first, last + 1))
+        positions = [p for p in (_position(records[i]) for i in node['body']) if p is not None]
+        node['entry'] = positions[0] if positions else None
+        node['exit'] = positions[-1] if positions else None
+        node['path'] = None
+        if not barrier and group and group[-1]['exit'] is not None and node['entry'] is not None:
+            # recorded link: exit of the previous pass, link moves, entry of this pass
+            path = [group[-1]['exit']] + [p for p in (_position(records[i]) for i in node['gap']) if p is not None] + [node['entry']]
+            node['path'] = sum(_distance(path[k], path[k+1]) for k in range(len(path) - 1))
+        node['reversible'] = all(not (records[i][0] == REC_CALL and records[i][1] == 'MoveC') for i in node['body'])
+        group.append(node)
+        previous_end = last
+    if group:
+        groups.append(group)
+    return groups
+
+
+#----------------------------------------------------
+#--------         Optimization         --------------
+
+def _distance(a, b):
+    return math.sqrt((a[0]-b[0])**2 + (a[1]-b[1])**2 + (a[2]-b[2])**2)
+
+
+class GridIndex(object):
+    """Uniform grid over 3D points for nearest neighbour queries"""
+    def __init__(self, points, cell=None):
+        self.points = points
+        if cell is None:
+            extent = max(max(p[k] for p in points) - min(p[k] for p in points) for k in range(3))
+            cell = max(extent/max(len(points)**(1.0/3.0), 1.0), 1e-3)
+        self.cell = cell
+        self.cells = {}
+        for i, p in enumerate(points):
+            self.cells.setdefault(self.key(p), []).append(i)
+        keys = list(self.cells.keys())
+        self.lo = [min(key[k] for key in keys) for k in range(3)]
+        self.hi = [max(key[k] for key in keys) for k in range(3)]
+
+    def key(self, p):
+        return (int(math.floor(p[0]/self.cell)), int(math.floor(p[1]/self.cell)), int(math.floor(p[2]/self.cell)))
+
+    def nearest(self, p, k=1, accept=None):
+        """Returns up to k (distance, index) pairs closest to p, searching shells of cells around p"""
+        c = self.key(p)
+        rings = max(max(abs(c[d] - self.lo[d]), abs(self.hi[d] - c[d])) for d in range(3))
+        found = []
+        for ring in range(rings + 1):
+            for dx in range(-ring, ring + 1):
+                for dy in range(-ring, ring + 1):
+                    step = 1 if max(abs(dx), abs(dy)) == ring else 2*ring
+                    for dz in range(-ring, ring + 1, max(step, 1)):
+                        for i in self.cells.get((c[0]+dx, c[1]+dy, c[2]+dz), ()):
+                            if accept is None or accept(i):
+                                found.append((_distance(p, self.points[i]), i))
+            found.sort()
+            # points outside the searched shells are further than ring*cell
+            if len(found) >= k and found[k-1][0] <= ring*self.cell:
+                break
+        return found[:k]
+
+
+def _ends(node, reverse):
+    return (node['exit'], node['entry']) if reverse else (node['entry'], node['exit'])
+
+
+def _kept(nodes, a, b):
+    """Returns the recorded link length if the tour items a and b are the original consecutive passes"""
+    if a is None or a[1] or b[1] or b[0] != a[0] + 1:
+        return None
+    return nodes[b[0]].get('path')
+
+
+def tour_length(nodes, tour, start=None, recorded=False):
+    """Travel length of a tour [(node index, reversed), ...] starting at start (or at the first entry).
+    With recorded=True the passes that stay consecutive use their recorded link, the others a direct link."""
+    length = 0.0
+    position = start
+    previous = None
+    for i, rev in tour:
+        entry, exit = _ends(nodes[i], rev)
+        path = _kept(nodes, previous, (i, rev)) if recorded else None
+        if path is not None:
+            length += path
+        elif position is not None:
+            length += _distance(position, entry)
+        position = exit
+        previous = (i, rev)
+    return length
+
+
+def nearest_neighbour(nodes, start, allow_reverse):
+    """Initial tour: always go to the closest entry"""
+    points = []
+    owners = []
+    for i, node in enumerate(nodes):
+        points.append(node['entry'])
+        owners.append((i, False))
+        if allow_reverse and node['reversible']:
+            points.append(node['exit'])
+            owners.append((i, True))
+    index = GridIndex(points)
+    visited = [False]*len(nodes)
+    tour = []
+    position = start if start is not None else nodes[0]['entry']
+    for step in range(len(nodes)):
+        found = index.nearest(position, 1, lambda k: not visited[owners[k][0]])
+        i, rev = owners[found[0][1]]
+        visited[i] = True
+        tour.append((i, rev))
+        position = _ends(nodes[i], rev)[1]
+    return tour
+
+
+class _Links(object):
+    """Link lengths between the items (node index, reversed) of a tour. None is the start (before) or the end (after)."""
+    def __init__(self, nodes, start):
+        self.nodes = nodes
+        self.start = start
+
+    def __call__(self, a, b):
+        if b is None:
+            return 0.0
+        position = self.start if a is None else _ends(self.nodes[a[0]], a[1])[1]
+        if position is None:
+            return 0.0
+        return _distance(position, _ends(self.nodes[b[0]], b[1])[0])
+
+
+def two_opt(nodes, tour, start, neighbours):
+    """Reverse segments of the tour (the passes of the segment are run backwards)"""
+    link = _Links(nodes, start)
+    improved = True
+    while improved:
+        improved = False
+        position = {item[0]: k for k, item in enumerate(tour)}
+        for a in range(1, len(tour)):
+            prev = tour[a-1]
+            for j in neighbours[prev[0]]:
+                b = position[j]
+                if b < a or not all(nodes[tour[k][0]]['reversible'] for k in range(a, b + 1)):
+                    continue
+                nxt = tour[b+1] if b + 1 < len(tour) else None
+                first = (tour[b][0], not tour[b][1])
+                last = (tour[a][0], not tour[a][1])
+                delta = link(prev, first) + link(last, nxt) - link(prev, tour[a]) - link(tour[b], nxt)
+                if delta < -1e-9:
+                    tour[a:b+1] = [(i, not rev) for i, rev in reversed(tour[a:b+1])]
+                    improved = True
+                    break
+            if improved:
+                break
+    return tour
+
+
+def or_opt(nodes, tour, start, neighbours):
+    """Move segments of 1 to 3 passes next to a neighbour pass (the passes keep their direction)"""
+    link = _Links(nodes, start)
+    improved = True
+    while improved:
+        improved = False
+        for size in OR_OPT_SEGMENTS:
+            position = {item[0]: k for k, item in enumerate(tour)}
+            a = 0
+            while a + size <= len(tour):
+                segment = tour[a:a+size]
+                prev = tour[a-1] if a > 0 else None
+                nxt = tour[a+size] if a + size < len(tour) else None
+                gain = link(prev, segment[0]) + link(segment[-1], nxt) - link(prev, nxt)
+                best = None
+                # insert the segment before (k) or after (k + 1) a neighbour pass: k is a position of the tour
+                for j in neighbours[segment[0][0]] + neighbours[segment[-1][0]]:
+                    if a <= position[j] < a + size:
+                        continue
+                    for k in (position[j], position[j] + 1):
+                        if k == a or k == a + size:
+                            # the place of the segment
+                            continue
+                        before = tour[k-1] if k > 0 else None
+                        after = tour[k] if k < len(tour) else None
+                        delta = link(before, segment[0]) + link(segment[-1], after) - link(before, after) - gain
+                        if delta < -1e-9 and (best is None or delta < best[0]):
+                            best = (delta, k)
+                if best is not None:
+                    k = best[1]
+                    lo, hi = min(a, k), max(a + size, k)
+                    if k < a:
+                        tour[k:a+size] = segment + tour[k:a]
+                    else:
+                        tour[a:k] = tour[a+size:k] + segment
+                    for m in range(lo, hi):
+                        position[tour[m][0]] = m
+                    improved = True
+                a += 1
+    return tour
+
+
+def solve(nodes, start=None, allow_reverse=False):
+    """Returns the pass order [(node index, reversed), ...] that reduces the travel between passes"""
+    if len(nodes) < 2 or any(node['entry'] is None for node in nodes):
+        return [(i, False) for i in range(len(nodes))]
+    tour = nearest_neighbour(nodes, start, allow_reverse)
+    # neighbour lists: passes with an end close to an end of every pass
+    points = []
+    owners = []
+    for i, node in enumerate(nodes):
+        points.extend([node['entry'], node['exit']])
+        owners.extend([i, i])
+    index = GridIndex(points)
+    neighbours = []
+    for i, node in enumerate(nodes):
+        near = []
+        for point in (node['entry'], node['exit']):
+            for d, k in index.nearest(point, min(2*NEIGHBOURS, len(points)), lambda k: owners[k] != i):
+                if owners[k] not in near:
+                    near.append(owners[k])
+        neighbours.append(near)
+    if allow_reverse:
+        two_opt(nodes, tour, start, neighbours)
+    or_opt(nodes, tour, start, neighbours)
+    # keep the original order if it was better
+    original = [(i, False) for i in range(len(nodes))]
+    if tour_length(nodes, original, start) <= tour_length(nodes, tour, start):
+        return original
+    return tour
+
+
+#----------------------------------------------------
+#--------           Output             --------------
+
+def _reversed_body(records, body):
+    """Records of a pass with the targets of its moves in reverse order"""
+    moves = [i for i in body if records[i][0] == REC_CALL and records[i][1] in ('MoveL', 'MoveJ')]
+    targets = [records[i][2] for i in reversed(moves)]
+    out = []
+    for i in body:
+        if i in moves:
+            kind, name, args, kwargs = records[i]
+            out.append((kind, name, targets[moves.index(i)], kwargs))
+        else:
+            out.append(records[i])
+    return out
+
+
+def reorder(records, post_class=None, allow_reverse=False, direct_links=False):
+    """Returns (new records, travel before, travel after). The passes are only reordered with
+    direct_links=True: the passes that are no longer consecutive are joined by a direct link."""
+    passes = find_passes(records, post_class)
+    groups = build_nodes(records, passes)
+    order = {}      # first record of a group -> records of the group in the new order
+    skip = set()
+    before = 0.0
+    after = 0.0
+    for nodes in groups:
+        first = nodes[0]['body'][0]
+        start = None
+        for i in reversed(range(0, first)):
+            start = _position(records[i])
+            if start is not None:
+                break
+        original = [(i, False) for i in range(len(nodes))]
+        tour = solve(nodes, start, allow_reverse) if direct_links else original
+        before += tour_length(nodes, original, start, True)
+        after += tour_length(nodes, tour, start, True)
+        if tour == original:
+            continue
+        out = []
+        previous = None
+        for i, rev in tour:
+            node = nodes[i]
+            if _kept(nodes, previous, (i, rev)) is not None:
+                # same link as recorded (retract and clearance moves)
+                out.extend(records[j] for j in node['gap'])
+            else:
+                out.extend(records[j] for j in node['moved'])
+            out.extend(_reversed_body(records, node['body']) if rev else [records[j] for j in node['body']])
+            previous = (i, rev)
+        for node in nodes:
+            skip.update(node['gap'])
+            skip.update(node['body'])
+        order[first] = out
+
+    if not order:
+        return records, before, after
+    result = []
+    for index, record in enumerate(records):
+        if index in order:
+            result.extend(order[index])
+        if index not in skip:
+            result.append(record)
+    return result, before, after
+
+
+def optimize_log(log_in, log_out, post_class=None, allow_reverse=False, direct_links=False):
+    """Reorder the passes of a recorded log and write the result. Returns (travel before, travel after) in mm."""
+    with open(log_in, 'rb') as fid:
+        records = list(postrecord.read_log(fid.read()))
+    result, before, after = reorder(records, post_class, allow_reverse, direct_links)
+    with open(log_out, 'wb') as stream:
+        writer = postrecord.LogWriter(stream)
+        for kind, name, args, kwargs in result:
+            writer.record(kind, name, args, kwargs)
+    return before, after
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='Reorder the passes of a recorded job to reduce the link moves')
+    parser.add_argument('log_in', help='job recorded with postrecord.py')
+    parser.add_argument('log_out', help='reordered job')
+    parser.add_argument('--post', help='post module used for the dry run (defaults to the recorded post)')
+    parser.add_argument('--reverse', action='store_true', help='allow running passes backwards')
+    parser.add_argument('--direct-links', action='store_true', help='reorder the passes: a direct link (no retract or clearance moves) joins the passes that are no longer consecutive')
+    args = parser.parse_args(argv)
+    post_class = importlib.import_module(args.post).RobotPost if args.post else None
+    before, after = optimize_log(args.log_in, args.log_out, post_class, args.reverse, args.direct_links)
+    print('Link travel: %.1f mm -> %.1f mm' % (before, after))
+    if not args.direct_links:
+        print('Passes kept in order: use --direct-links to reorder them (the new links go straight from pass to pass)')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,150 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Resume a program at a pass after a fault, without uploading the whole job again.
+#
+# With robot.WRITE_PASS_INDEX = True the post saves <progname>_passes.json next to the
+# programs: the page, line range, P[] range and estimated time of every pass label, the
+# pages of every program and the calls of the main/dispatcher programs. resume() writes
+# a small main program R<pass>_<program> that sets the pass register (R[J_LBL_REGISTER:j])
+# and calls the page of the pass followed by the rest of the program (the dispatchers of
+# split programs are called as they are). The pages jump to the label of the pass with
+# the startPassLoop instructions at the top of every page (G6T posts).
+#
+# needed() lists the programs that must be on the controller: the resume program, the
+# pages from the pass to the end of the program and the dispatchers called.
+#
+# Usage:
+#     python passresume.py C:/Programs/Job_passes.json 37
+# --------------------------------------------
+
+import os
+import re
+import sys
+import json
+
+
+class ResumeError(Exception):
+    """Raised when a program can't be resumed at a pass"""
+    pass
+
+
+def load(path):
+    """Reads a pass index"""
+    with open(path) as fid:
+        return json.load(fid)
+
+
+def find_pass(index, npass, program=None):
+    """Pass entry of pass number npass (of program, if provided)"""
+    for entry in index['passes']:
+        if entry['pass'] == npass and (program is None or entry['program'] == program):
+            if entry['line'] is None:
+                raise ResumeError('Pass %i was not written' % npass)
+            return entry
+    raise ResumeError('Pass %i is not in the index' % npass)
+
+
+def find_program(index, name):
+    for program in index['programs']:
+        if program['name'] == name:
+            return program
+    raise ResumeError('Program %s is not in the index' % name)
+
+
+def _contains(calls, name, page):
+    return name == page or any(_contains(calls, child, page) for child in calls.get(name, ()))
+
+
+def resume_calls(index, program, page):
+    """Programs to call to run a program from one of its pages: the page, the next pages of its
+    dispatcher and the next calls of every dispatcher above it"""
+    calls = index.get('calls', {})
+    name = program['main']
+    if name not in calls:
+        return program['pages'][program['pages'].index(page):]
+    result = []
+    while name != page:
+        children = calls[name]
+        for i, child in enumerate(children):
+            if _contains(calls, child, page):
+                result = children[i+1:] + result
+                name = child
+                break
+    return [page] + result
+
+
+def needed(index, calls):
+    """Programs called (pages and dispatchers), in order"""
+    result = []
+    for name in calls:
+        result.append(name)
+        result += needed(index, index.get('calls', {}).get(name, ()))
+    return result
+
+
+def remaining_time(index, entry):
+    """Estimated time of the passes of the program from entry (s)"""
+    return sum(other['time'] for other in index['passes'] if other['program'] == entry['program'] and other['pass'] >= entry['pass'])
+
+
+def resume_program(index, npass, folder, program=None):
+    """Lines of the resume program of pass npass: (name, lines). The header is taken from the page of the pass in folder."""
+    if index.get('register') is None:
+        raise ResumeError('The post has no pass register (J_LBL_REGISTER)')
+    entry = find_pass(index, npass, program)
+    program = find_program(index, entry['program'])
+    calls = resume_calls(index, program, entry['page'])
+    name = ('R%i_%s' % (npass, program['name']))[:20]
+    header = []
+    with open(os.path.join(folder, entry['page'] + '.LS')) as fid:
+        for line in fid:
+            line = line.rstrip('\n')
+            if line.startswith('/MN'):
+                break
+            header.append(line)
+    if len(header) == 0 or not header[0].startswith('/PROG'):
+        raise ResumeError('%s.LS is not an LS program' % entry['page'])
+    body = ['R[%i:j]=%i ;' % (index['register'], npass)] + ['CALL %s ;' % call for call in calls]
+    header[0] = '/PROG  %s' % name
+    header = [re.sub(r'(LINE_COUNT\s*=\s*)\d+', lambda match: match.group(1) + str(len(body)), line) for line in header]
+    lines = header + ['/MN'] + ['%4i:  %s' % (i + 1, line) for i, line in enumerate(body)] + ['/POS', '/END']
+    return name, lines, calls
+
+
+def resume(index_path, npass, folder=None, program=None):
+    """Write the resume program of pass npass next to the pages (or in folder).
+    Returns (file written, programs needed on the controller, estimated time in s)."""
+    index = load(index_path)
+    pages_folder = os.path.dirname(os.path.abspath(index_path))
+    name, lines, calls = resume_program(index, npass, pages_folder, program)
+    folder = folder or pages_folder
+    filesave = os.path.join(folder, name + '.LS')
+    with open(filesave, 'w') as fid:
+        for line in lines:
+            fid.write(line)
+            fid.write('\n')
+    return filesave, [name] + needed(index, calls), remaining_time(index, find_pass(index, npass, program))
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='Write a main program that resumes a job at a pass')
+    parser.add_argument('index', help='pass index (<progname>_passes.json)')
+    parser.add_argument('npass', type=int, help='pass number (R[j])')
+    parser.add_argument('--program', help='program of the pass (if the index has several programs)')
+    parser.add_argument('--folder', help='output folder (default: folder of the index)')
+    args = parser.parse_args(argv)
+    try:
+        filesave, programs, time_s = resume(args.index, args.npass, args.folder, args.program)
+    except ResumeError as e:
+        print(e)
+        return 1
+    print('SAVED: %s' % filesave)
+    print('Programs needed on the controller (%i): %s' % (len(programs), ' '.join(programs)))
+    print('Estimated time: %.0f s' % time_s)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
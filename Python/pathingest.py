@@ -0,0 +1,416 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Headless path ingestion: slicer G-code and point files straight into a post.
+#
+# The cell posts infer the laser events from magic feed speeds in setSpeed (cell2_AM:
+# 30-40 mm/s starts a pass, 130-140 mm/s stops it) and every point has to go through
+# the RoboDK API first. This module reads the path in chunks and calls the G6T events
+# (moveApproach/laserStartSeq/laserStopSeq/moveLink) of RobotPost directly:
+#     - G-code (Slic3r, Cura, ...): G0/G1 with X Y Z F E. A G1 move that extrudes (E
+#       increases) is a deposition segment, any other move is a link (travel) move.
+#       G20/G21, G90/G91, M82/M83 and G92 are supported. Arcs (G2/G3) are not.
+#     - CSV/TXT files with one point per row:  x, y, z [, nx, ny, nz [, speed [, on]]]
+#       (mm, surface normal, mm/s, 1 if the laser is on at the point). Rows that can't
+#       be read as numbers (headers) are skipped.
+#     - NPY files with the same columns (N x 3..8 array). The file is memory mapped.
+# The tool Z axis is the opposite of the surface normal (or TOOL_ZAXIS if the file has
+# no normals).
+#
+# Usage:
+#     python pathingest.py part.gcode Fanuc_G6T_cell2_AM [--folder C:/Programs] [--name Part]
+# --------------------------------------------
+
+import os
+import sys
+import math
+import importlib
+import numpy as np
+
+from robodk import Mat, eye
+
+CHUNK_SIZE = 20000        # points per chunk
+TOOL_ZAXIS = (0, 0, -1)   # tool orientation used when the path has no normals
+MIN_STEP = 1e-6           # mm, consecutive points closer than this are skipped
+
+
+#----------------------------------------------------
+#--------           Readers           ---------------
+# Every reader yields chunks (xyz, zaxis, speed, on):
+#   xyz   (N,3) points in mm
+#   zaxis (N,3) tool Z axis or None
+#   speed (N,)  feed in mm/s (nan if unknown)
+#   on    (N,)  True if the segment that ends at the point deposits material
+
+def read_gcode(filepath, chunk_size=CHUNK_SIZE):
+    """Read G0/G1 moves of a G-code file in chunks"""
+    pos = [0.0, 0.0, 0.0]
+    extruder = 0.0
+    feed = float('nan')
+    absolute = True
+    absolute_e = True
+    scale = 1.0
+    rows = []
+    with open(filepath, 'r') as fid:
+        for line in fid:
+            code = line.split(';', 1)[0].strip().upper()
+            if not code:
+                continue
+            words = code.split()
+            cmd = words[0]
+            if cmd in ('G0', 'G1', 'G00', 'G01'):
+                values = {}
+                for word in words[1:]:
+                    try:
+                        values[word[0]] = float(word[1:])
+                    except ValueError:
+                        pass
+                if 'F' in values:
+                    feed = values['F']*scale/60.0
+                target = list(pos)
+                for i, axis in enumerate('XYZ'):
+                    if axis in values:
+                        target[i] = values[axis]*scale if absolute else pos[i] + values[axis]*scale
+                extruding = False
+                if 'E' in values:
+                    delta_e = values['E'] - extruder if absolute_e else values['E']
+                    extruder = values['E'] if absolute_e else extruder + values['E']
+                    extruding = delta_e > 0 and cmd in ('G1', 'G01')
+                if abs(target[0]-pos[0]) + abs(target[1]-pos[1]) + abs(target[2]-pos[2]) < MIN_STEP:
+                    # retraction, feed change or zero length move
+                    continue
+                pos = target
+                rows.append((pos[0], pos[1], pos[2], feed, extruding))
+                if len(rows) >= chunk_size:
+                    yield _rows_2_chunk(rows)
+                    rows = []
+            elif cmd == 'G20':
+                scale = 25.4
+            elif cmd == 'G21':
+                scale = 1.0
+            elif cmd == 'G90':
+                absolute = True
+            elif cmd == 'G91':
+                absolute = False
+            elif cmd == 'M82':
+                absolute_e = True
+            elif cmd == 'M83':
+                absolute_e = False
+            elif cmd == 'G92':
+                for word in words[1:]:
+                    if word[0] == 'E':
+                        extruder = float(word[1:])
+                    elif word[0] in 'XYZ':
+                        pos['XYZ'.index(word[0])] = float(word[1:])*scale
+            elif cmd in ('G2', 'G3', 'G02', 'G03'):
+                raise ValueError('Arc moves are not supported (%s). Export the G-code with linear moves only.' % line.strip())
+    if rows:
+        yield _rows_2_chunk(rows)
+
+
+def _rows_2_chunk(rows):
+    data = np.array(rows, dtype=float)
+    return data[:, 0:3], None, data[:, 3], data[:, 4] > 0
+
+
+def _points_2_chunks(data, chunk_size, previous_on=False):
+    """Split an N x 3..8 array of points in chunks. The on flag of the points is converted to deposition segments."""
+    ncols = data.shape[1]
+    if ncols < 3:
+        raise ValueError('Expected at least 3 columns (x, y, z), found %i' % ncols)
+    for i in range(0, data.shape[0], chunk_size):
+        chunk = np.asarray(data[i:i+chunk_size], dtype=float)
+        xyz = chunk[:, 0:3]
+        zaxis = -chunk[:, 3:6] if ncols >= 6 else None
+        speed = chunk[:, 6] if ncols >= 7 else np.full(chunk.shape[0], np.nan)
+        point_on = chunk[:, 7] > 0 if ncols >= 8 else np.ones(chunk.shape[0], dtype=bool)
+        # a segment deposits when the laser is on at both ends
+        on = point_on & np.concatenate(([previous_on], point_on[:-1]))
+        previous_on = bool(point_on[-1])
+        yield xyz, zaxis, speed, on
+
+
+def read_csv(filepath, chunk_size=CHUNK_SIZE):
+    """Read a CSV/TXT point file in chunks"""
+    with open(filepath, 'r') as fid:
+        delimiter = None
+        previous_on = False
+        lines = []
+        for line in fid:
+            line = line.strip()
+            if not line or line[0] not in '-+.0123456789':
+                continue
+            if delimiter is None:
+                delimiter = ',' if ',' in line else (';' if ';' in line else ' ')
+            lines.append(line if delimiter != ' ' else ' '.join(line.split()))
+            if len(lines) >= chunk_size:
+                data = np.loadtxt(lines, delimiter=delimiter, ndmin=2)
+                for chunk in _points_2_chunks(data, chunk_size, previous_on):
+                    yield chunk
+                previous_on = data.shape[1] < 8 or data[-1, 7] > 0
+                lines = []
+        if lines:
+            data = np.loadtxt(lines, delimiter=delimiter, ndmin=2)
+            for chunk in _points_2_chunks(data, chunk_size, previous_on):
+                yield chunk
+
+
+def read_npy(filepath, chunk_size=CHUNK_SIZE):
+    """Read a NPY point file in chunks (the file is memory mapped)"""
+    data = np.load(filepath, mmap_mode='r')
+    if data.ndim != 2:
+        raise ValueError('Expected a N x 3..8 array, found shape %s' % str(data.shape))
+    return _points_2_chunks(data, chunk_size)
+
+
+def read_path(filepath, chunk_size=CHUNK_SIZE):
+    """Read a path file in chunks. The format is taken from the extension."""
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == '.npy':
+        return read_npy(filepath, chunk_size)
+    elif ext in ('.csv', '.txt', '.xyz'):
+        return read_csv(filepath, chunk_size)
+    return read_gcode(filepath, chunk_size)
+
+
+#----------------------------------------------------
+#--------            Poses            ---------------
+
+def zaxis_2_rotations(zaxis, count=None):
+    """Returns the (N,3,3) rotations with the given Z axis (same convention as robodk.point_Zaxis_2_pose)"""
+    if zaxis is None:
+        zaxis = np.tile(np.asarray(TOOL_ZAXIS, dtype=float), (count, 1))
+    z = zaxis/np.linalg.norm(zaxis, axis=1)[:, None]
+    hint = np.tile(np.array([0.0, 0.0, 1.0]), (z.shape[0], 1))
+    # use the second hint when the Z axis is within 2 deg of the first one (or of its opposite)
+    parallel = np.abs(z[:, 2]) > math.cos(2*math.pi/180)
+    hint[parallel] = np.array([0.0, 1.0, 1.0])
+    x = np.cross(hint, z)
+    x = x/np.linalg.norm(x, axis=1)[:, None]
+    y = np.cross(z, x)
+    return np.stack((x, y, z), axis=2)
+
+
+def poses(xyz, zaxis=None, rotations=None):
+    """Generator of poses (Mat) for a chunk of points"""
+    if rotations is None:
+        rotations = zaxis_2_rotations(zaxis, xyz.shape[0])
+    for i in range(xyz.shape[0]):
+        r = rotations[i]
+        yield Mat([[r[0,0], r[0,1], r[0,2], xyz[i,0]],
+                   [r[1,0], r[1,1], r[1,2], xyz[i,1]],
+                   [r[2,0], r[2,1], r[2,2], xyz[i,2]],
+                   [0.0, 0.0, 0.0, 1.0]])
+
+
+#----------------------------------------------------
+#--------          Ingestion          ---------------
+
+class PathIngest(object):
+    """Feeds chunks of a path to a post processor.
+    joints can be a list (the same joints are written for every target, for example the seed
+    of the external axes) or a function f(xyz, zaxis) returning the (N, nAxes) joints of a chunk.
+    If kinematics is provided (fanuckin.FanucKinematics with the user frame as base), the arm
+    joints and conf_RLF of every target are solved from the poses, starting from the joints
+    list (seed), and the external axes keep the values of the seed."""
+    def __init__(self, robot, joints=None, conf_RLF=None, kinematics=None):
+        self.robot = robot
+        self.joints = joints if joints is not None else [0.0]*len(robot.AXES_TYPE)
+        self.conf_RLF = conf_RLF
+        self.kinematics = kinematics
+        self.events = hasattr(robot, 'laserStartSeq')
+        self.depositing = False
+        self.speed = None
+        self.last = None
+        self.pending = None     # link move written with the next point: (pose, joints, conf_RLF)
+        self.npoints = 0
+        self.npasses = 0
+        self.nunreachable = 0
+
+    def solve(self, xyz, rotations):
+        """Returns the joints and configurations of a chunk with the kinematics model"""
+        import fanuckin
+        H = np.zeros((xyz.shape[0], 4, 4))
+        H[:, 0:3, 0:3] = rotations
+        H[:, 0:3, 3] = xyz
+        H[:, 3, 3] = 1.0
+        seed = list(self.joints)
+        arm, solved = self.kinematics.ik(H, seed[0:6])
+        if not solved.all():
+            # keep the previous joints for the targets out of reach or out of the limits
+            for i in np.flatnonzero(~solved):
+                arm[i] = arm[i-1] if i > 0 else seed[0:6]
+                self.robot.addlog('Target %i: no solution within the joint limits (%.3f, %.3f, %.3f)' % (self.npoints + i + 1, xyz[i,0], xyz[i,1], xyz[i,2]))
+            self.nunreachable += int((~solved).sum())
+        conf = fanuckin.conf_RLF(arm, self.kinematics).tolist()
+        joints = np.tile(np.asarray(seed, dtype=float), (xyz.shape[0], 1))
+        joints[:, 0:6] = arm
+        self.joints = joints[-1].tolist()
+        return joints.tolist(), conf
+
+    def feed(self, xyz, zaxis, speed, on, joints=None):
+        """Add a chunk of points to the program. joints (N, nAxes) overrides the joints of the chunk."""
+        robot = self.robot
+        rotations = zaxis_2_rotations(zaxis, xyz.shape[0])
+        conf_list = None
+        if joints is not None:
+            joints_list = np.asarray(joints).tolist()
+        elif self.kinematics is not None:
+            joints_list, conf_list = self.solve(xyz, rotations)
+        elif callable(self.joints):
+            joints_list = np.asarray(self.joints(xyz, zaxis)).tolist()
+        else:
+            joints_list = None
+        for i, pose in enumerate(poses(xyz, zaxis, rotations)):
+            point = xyz[i]
+            if self.last is not None and abs(point[0]-self.last[0]) + abs(point[1]-self.last[1]) + abs(point[2]-self.last[2]) < MIN_STEP:
+                continue
+            joints = joints_list[i] if joints_list is not None else self.joints
+            conf_RLF = conf_list[i] if conf_list is not None else self.conf_RLF
+            if on[i] and self.last is not None:
+                if not self.depositing:
+                    # the previous point is the start of the pass
+                    self.start()
+                if speed[i] == speed[i] and speed[i] != self.speed:
+                    # nan != nan: speed unknown, keep the current one
+                    self.speed = speed[i]
+                    self.set_speed(self.speed)
+                robot.MoveL(pose, joints, conf_RLF)
+            else:
+                if self.depositing:
+                    self.stop()
+                # link move: it is the approach move if the next point starts a pass
+                self.flush()
+                self.pending = (pose, joints, conf_RLF)
+            self.last = (point[0], point[1], point[2])
+            self.npoints += 1
+
+    def start(self):
+        """Start a pass at the link move waiting for the next point (event order of the TP
+        template: moveApproach, move to the start of the pass, laserStartSeq)"""
+        robot = self.robot
+        if self.events:
+            robot.moveApproach()
+        if self.pending is not None:
+            robot.MoveL(*self.pending)
+            self.pending = None
+        else:
+            # the start was already written (flush between chunks): approach it again
+            robot.REPEAT_POSE = True
+            robot.MoveL(robot.LAST_POSE, robot.LAST_JOINTS)
+            robot.REPEAT_POSE = False
+        if self.events:
+            robot.laserStartSeq()
+        self.depositing = True
+        self.npasses += 1
+
+    def set_speed(self, speed):
+        """Deposition speed. The G6T posts move at the speed register while the laser is on
+        (toolOn): the speed is written in the register."""
+        robot = self.robot
+        if hasattr(robot, 'REG_SPEED'):
+            # 'R[157]mm/sec' -> R[157]
+            robot.RunCode('%s = %.1f' % (robot.REG_SPEED.split(']')[0] + ']', speed))
+        else:
+            robot.setSpeed(speed, False)
+
+    def flush(self):
+        """Write the link move waiting for the next point"""
+        if self.pending is not None:
+            self.robot.MoveL(*self.pending)
+            self.pending = None
+
+    def stop(self):
+        """Close the current pass"""
+        if self.depositing:
+            if self.events:
+                self.robot.laserStopSeq()
+            self.depositing = False
+            self.speed = None
+
+
+def ingest(filepath, robot, progname=None, folder=None, joints=None, conf_RLF=None, pass_loop=True, powder=True, chunk_size=CHUNK_SIZE, kinematics=None):
+    """Generate a program from a path file with an existing post object.
+    If folder is provided the program is saved. Returns the PathIngest object (number of points and passes)."""
+    if progname is None:
+        progname = os.path.splitext(os.path.basename(filepath))[0]
+    return ingest_chunks(read_path(filepath, chunk_size), robot, progname, folder, joints, conf_RLF, pass_loop, powder, kinematics)
+
+
+def ingest_chunks(chunks, robot, progname, folder=None, joints=None, conf_RLF=None, pass_loop=True, powder=True, kinematics=None):
+    """Generate a program from chunks (xyz, zaxis, speed, on [, joints]) with an existing post object"""
+    feeder = PathIngest(robot, joints, conf_RLF, kinematics)
+    robot.ProgStart(progname)
+    if feeder.events and powder:
+        robot.startExtrud()
+    if feeder.events and pass_loop:
+        robot.startPassLoop()
+    else:
+        robot.setFrame(eye(4))
+        robot.setTool(eye(4))
+    if feeder.events:
+        robot.moveLink()
+    for chunk in chunks:
+        feeder.feed(*chunk)
+    feeder.stop()
+    feeder.flush()
+    if feeder.events and powder:
+        robot.stopExtrud()
+    if feeder.events and pass_loop:
+        robot.stopPassLoop()
+    robot.ProgFinish(progname)
+    if folder is not None:
+        robot.ProgSave(folder, progname)
+    return feeder
+
+
+def main(argv):
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Generate a Fanuc program from G-code, CSV or NPY paths')
+    parser.add_argument('path', help='G-code, CSV/TXT or NPY file')
+    parser.add_argument('post', help='post processor module (for example Fanuc_G6T_cell2_AM)')
+    parser.add_argument('--folder', default='.', help='folder to save the program')
+    parser.add_argument('--name', help='program name (default: file name)')
+    parser.add_argument('--robot', default='Fanuc robot', help='robot name given to the post')
+    parser.add_argument('--axes', help='axes type of the robot (default: RRRRRR plus T/J for the track and turntable of the post)')
+    parser.add_argument('--lines', type=int, help='maximum lines per program page')
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE, help='points per chunk')
+    parser.add_argument('--model', help='solve the joints with the kinematics of this robot model (see fanuckin.ROBOT_MODELS)')
+    parser.add_argument('--frame', default='0,0,0,0,0,0', help='user frame X,Y,Z,W,P,R used with --model')
+    parser.add_argument('--tool', default='0,0,0,0,0,0', help='tool X,Y,Z,W,P,R used with --model')
+    parser.add_argument('--seed', help='joints of the robot before the first target (all the axes, comma separated)')
+    args = parser.parse_args(argv)
+
+    post_class = importlib.import_module(args.post).RobotPost
+    axes = args.axes
+    if axes is None:
+        axes = 'RRRRRR' + ('T' if post_class.HAS_TRACK else '') + ('J' if post_class.HAS_TURNTABLE else '')
+    kwargs = {'axes_type': list(axes.upper())}
+    if args.lines is not None:
+        kwargs['lines_x_prog'] = args.lines
+    robot = post_class(args.post, args.robot, len(axes), **kwargs)
+    folder = os.path.abspath(args.folder)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    seed = None if args.seed is None else [float(x) for x in args.seed.split(',')]
+    kinematics = None
+    if args.model is not None:
+        from robodk import Fanuc_2_Pose, invH
+        import fanuckin
+        frame = Fanuc_2_Pose([float(x) for x in args.frame.split(',')])
+        tool = Fanuc_2_Pose([float(x) for x in args.tool.split(',')])
+        kinematics = fanuckin.FanucKinematics(args.model, base=invH(frame), tool=tool)
+        if seed is None:
+            seed = [0.0, 0.0, 0.0, 0.0, -90.0, 0.0] + [0.0]*(len(axes) - 6)
+    t0 = time.perf_counter()
+    feeder = ingest(args.path, robot, args.name, folder, joints=seed, chunk_size=args.chunk, kinematics=kinematics)
+    elapsed = time.perf_counter() - t0
+    print('Points: %i, passes: %i, %.2f s (%.0f points/min)' % (feeder.npoints, feeder.npasses, elapsed, 60*feeder.npoints/max(elapsed, 1e-9)))
+    if feeder.nunreachable:
+        print('Warning: %i targets have no solution within the joint limits (see the log)' % feeder.nunreachable)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,348 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Record and replay the calls RoboDK makes to a post processor.
+#
+# RoboDK drives a post with a script of calls such as:
+#     r.MoveL(p([...]),[...],[0.0,0.0,1.0])
+# PostRecorder wraps any RobotPost and stores every call (ProgStart, MoveL/MoveJ/MoveC,
+# setSpeed, RunCode, setFrame, attribute changes, ...) in a compact binary log.
+# Poses and joint lists are stored as packed doubles (lists of ints as packed int64). replay() drives any post class
+# from that log without RoboDK, so a job can be regenerated after a post change and
+# used as a reproducible benchmark.
+#
+# Usage:
+#     python postrecord.py record generated_script.py job.rdkpost
+#     python postrecord.py replay job.rdkpost [--post Fanuc_G6T_cell1_hs] [--folder C:/Programs]
+#
+# Log format (little endian):
+#     header:  b'RDKPOST' + version (uint8)
+#     record:  kind (uint8) + name id (uint16) + values
+#              kind NAME defines the next name id (the name is stored once)
+#     value:   type tag (uint8) + payload
+# --------------------------------------------
+
+import os
+import sys
+import types
+import struct
+import importlib
+
+from robodk import Mat
+
+MAGIC = b'RDKPOST'
+VERSION = 2
+VERSIONS = (1, 2)   # versions read (1: no TAG_INTS)
+
+# record kinds
+REC_NAME = 0        # define a name (method or attribute): uint16 len + utf-8
+REC_NEW = 1         # create the post: module name id, then args/kwargs
+REC_CALL = 2        # call a method: name id, then args/kwargs
+REC_SETATTR = 3     # set an attribute: name id, then value
+REC_DELATTR = 4     # delete an attribute: name id
+
+# value tags
+TAG_NONE = 0
+TAG_TRUE = 1
+TAG_FALSE = 2
+TAG_INT = 3
+TAG_FLOAT = 4
+TAG_STR = 5
+TAG_FLOATS = 6      # list of numbers: uint32 n + n doubles
+TAG_LIST = 7        # generic list: uint32 n + values
+TAG_TUPLE = 8       # generic tuple: uint32 n + values
+TAG_POSE = 9        # Mat 4x4 pose: 12 doubles (the last row is 0,0,0,1)
+TAG_MAT = 10        # any other Mat: uint16 rows + uint16 cols + doubles
+TAG_INTS = 11       # list of ints: uint32 n + n int64
+
+_U8 = struct.Struct('<B')
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+_REC = struct.Struct('<BH')
+_POSE = struct.Struct('<12d')
+_ARGS = struct.Struct('<BB')
+
+
+#----------------------------------------------------
+#--------          Writing            ---------------
+
+class LogWriter(object):
+    """Writes post calls to a binary log"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.names = {}
+        self.stream.write(MAGIC + _U8.pack(VERSION))
+
+    def name_id(self, name):
+        idx = self.names.get(name)
+        if idx is None:
+            idx = len(self.names)
+            self.names[name] = idx
+            data = name.encode('utf-8')
+            self.stream.write(_REC.pack(REC_NAME, len(data)) + data)
+        return idx
+
+    def value(self, value, out):
+        if value is None:
+            out.append(_U8.pack(TAG_NONE))
+        elif value is True:
+            out.append(_U8.pack(TAG_TRUE))
+        elif value is False:
+            out.append(_U8.pack(TAG_FALSE))
+        elif isinstance(value, int):
+            out.append(_U8.pack(TAG_INT) + _I64.pack(value))
+        elif isinstance(value, float):
+            out.append(_U8.pack(TAG_FLOAT) + _F64.pack(value))
+        elif isinstance(value, str):
+            data = value.encode('utf-8')
+            out.append(_U8.pack(TAG_STR) + _U32.pack(len(data)) + data)
+        elif isinstance(value, Mat):
+            rows = value.rows
+            if len(rows) == 4 and len(rows[0]) == 4 and rows[3] == [0, 0, 0, 1]:
+                out.append(_U8.pack(TAG_POSE) + _POSE.pack(*(rows[0] + rows[1] + rows[2])))
+            else:
+                n, m = len(rows), len(rows[0]) if len(rows) > 0 else 0
+                flat = [float(x) for row in rows for x in row]
+                out.append(_U8.pack(TAG_MAT) + _U16.pack(n) + _U16.pack(m) + struct.pack('<%id' % len(flat), *flat))
+        elif isinstance(value, (list, tuple)):
+            if isinstance(value, list) and value and all(type(x) is float for x in value):
+                out.append(_U8.pack(TAG_FLOATS) + _U32.pack(len(value)) + struct.pack('<%id' % len(value), *value))
+            elif isinstance(value, list) and value and all(type(x) is int for x in value):
+                out.append(_U8.pack(TAG_INTS) + _U32.pack(len(value)) + struct.pack('<%iq' % len(value), *value))
+            else:
+                out.append(_U8.pack(TAG_LIST if isinstance(value, list) else TAG_TUPLE) + _U32.pack(len(value)))
+                for x in value:
+                    self.value(x, out)
+        else:
+            raise TypeError('Unable to record value of type %s: %r' % (type(value).__name__, value))
+
+    def record(self, kind, name, args=(), kwargs=None):
+        idx = self.name_id(name)
+        out = [_REC.pack(kind, idx)]
+        if kind in (REC_NEW, REC_CALL):
+            kwargs = kwargs or {}
+            out.append(_ARGS.pack(len(args), len(kwargs)))
+            for arg in args:
+                self.value(arg, out)
+            for key, arg in kwargs.items():
+                out.append(_U16.pack(self.name_id(key)))
+                self.value(arg, out)
+        elif kind == REC_SETATTR:
+            self.value(args[0], out)
+        self.stream.write(b''.join(out))
+
+
+class PostRecorder(object):
+    """Wraps a post and records every call made to it from outside.
+    Calls made by the post to itself (for example MoveL inside laserStartSeq) are not recorded,
+    replaying the outer call reproduces them."""
+    def __init__(self, post, stream):
+        object.__setattr__(self, '_post', post)
+        object.__setattr__(self, '_writer', stream if isinstance(stream, LogWriter) else LogWriter(stream))
+
+    def __getattr__(self, name):
+        value = getattr(self._post, name)
+        if not callable(value) or name.startswith('__'):
+            return value
+        writer = self._writer
+        def recorded(*args, **kwargs):
+            writer.record(REC_CALL, name, args, kwargs)
+            return value(*args, **kwargs)
+        return recorded
+
+    def __setattr__(self, name, value):
+        self._writer.record(REC_SETATTR, name, (value,))
+        setattr(self._post, name, value)
+
+    def __delattr__(self, name):
+        self._writer.record(REC_DELATTR, name)
+        delattr(self._post, name)
+
+
+def record_post(post_class, stream, *args, **kwargs):
+    """Create a post of the given class and return it wrapped in a PostRecorder.
+    The module of the post class is stored in the log so it can be replayed without naming the post."""
+    writer = stream if isinstance(stream, LogWriter) else LogWriter(stream)
+    writer.record(REC_NEW, post_class.__module__, args, kwargs)
+    return PostRecorder(post_class(*args, **kwargs), writer)
+
+
+def record_script(script_path, log_path):
+    """Run a program script generated by RoboDK and record the calls made to the post in log_path"""
+    import builtins
+    script_path = os.path.abspath(script_path)
+    with open(script_path, 'r') as fid:
+        script = fid.read()
+
+    with open(log_path, 'wb') as stream:
+        writer = LogWriter(stream)
+
+        def recording_module(module):
+            # copy of the post module with a RobotPost that records (from <post> import * of the RoboDK
+            # header takes the public names of the module)
+            post_class = module.RobotPost
+            recording = types.ModuleType(module.__name__)
+            recording.__dict__.update(module.__dict__)
+            recording.RobotPost = lambda *args, **kwargs: record_post(post_class, writer, *args, **kwargs)
+            return recording
+
+        def import_hook(name, globals=None, locals=None, fromlist=(), level=0):
+            module = builtins.__import__(name, globals, locals, fromlist, level)
+            if fromlist and ('RobotPost' in fromlist or '*' in fromlist) and hasattr(module, 'RobotPost'):
+                return recording_module(module)
+            return module
+
+        namespace_builtins = dict(vars(builtins))
+        namespace_builtins['__import__'] = import_hook
+        namespace = {'__name__': '__main__', '__file__': script_path, '__builtins__': namespace_builtins}
+        exec(compile(script, script_path, 'exec'), namespace)
+
+
+#----------------------------------------------------
+#--------          Reading            ---------------
+
+def read_log(data):
+    """Iterate over the records of a log (bytes). Yields (kind, name, args, kwargs)"""
+    if not data.startswith(MAGIC):
+        raise ValueError('Not a post processor log')
+    version = data[len(MAGIC)]
+    if version not in VERSIONS:
+        raise ValueError('Unsupported post processor log version: %i' % version)
+
+    view = memoryview(data)
+    names = []
+    u8, u16, u32, i64, f64, pose = _U8.unpack_from, _U16.unpack_from, _U32.unpack_from, _I64.unpack_from, _F64.unpack_from, _POSE.unpack_from
+
+    def value(pos):
+        tag = data[pos]
+        pos += 1
+        if tag == TAG_FLOATS:
+            n = u32(data, pos)[0]
+            pos += 4
+            return list(struct.unpack_from('<%id' % n, data, pos)), pos + 8*n
+        elif tag == TAG_INTS:
+            n = u32(data, pos)[0]
+            pos += 4
+            return list(struct.unpack_from('<%iq' % n, data, pos)), pos + 8*n
+        elif tag == TAG_POSE:
+            v = pose(data, pos)
+            return Mat([list(v[0:4]), list(v[4:8]), list(v[8:12]), [0, 0, 0, 1]]), pos + 96
+        elif tag == TAG_FLOAT:
+            return f64(data, pos)[0], pos + 8
+        elif tag == TAG_NONE:
+            return None, pos
+        elif tag == TAG_TRUE:
+            return True, pos
+        elif tag == TAG_FALSE:
+            return False, pos
+        elif tag == TAG_INT:
+            return i64(data, pos)[0], pos + 8
+        elif tag == TAG_STR:
+            n = u32(data, pos)[0]
+            pos += 4
+            return bytes(view[pos:pos+n]).decode('utf-8'), pos + n
+        elif tag in (TAG_LIST, TAG_TUPLE):
+            n = u32(data, pos)[0]
+            pos += 4
+            items = []
+            for i in range(n):
+                item, pos = value(pos)
+                items.append(item)
+            return (items if tag == TAG_LIST else tuple(items)), pos
+        elif tag == TAG_MAT:
+            n, m = u16(data, pos)[0], u16(data, pos + 2)[0]
+            pos += 4
+            flat = struct.unpack_from('<%id' % (n*m), data, pos)
+            return Mat([list(flat[i*m:(i+1)*m]) for i in range(n)]), pos + 8*n*m
+        raise ValueError('Corrupted post processor log: unknown value tag %i at %i' % (tag, pos - 1))
+
+    pos = len(MAGIC) + 1
+    size = len(data)
+    while pos < size:
+        kind, idx = _REC.unpack_from(data, pos)
+        pos += _REC.size
+        if kind == REC_NAME:
+            names.append(bytes(view[pos:pos+idx]).decode('utf-8'))
+            pos += idx
+            continue
+        name = names[idx]
+        args = ()
+        kwargs = {}
+        if kind in (REC_NEW, REC_CALL):
+            nargs, nkwargs = _ARGS.unpack_from(data, pos)
+            pos += 2
+            args = []
+            for i in range(nargs):
+                arg, pos = value(pos)
+                args.append(arg)
+            for i in range(nkwargs):
+                key = names[u16(data, pos)[0]]
+                kwargs[key], pos = value(pos + 2)
+        elif kind == REC_SETATTR:
+            arg, pos = value(pos)
+            args = (arg,)
+        yield kind, name, args, kwargs
+
+
+def replay(log, post_class=None, folder=None, send=False):
+    """Replay a log on a post and return the post.
+
+    :param log: path to the log file or log contents (bytes)
+    :param post_class: post class to replay on (defaults to the class used for recording)
+    :param folder: save the program in this folder instead of the recorded one
+    :param send: replay ProgSendRobot (send the program to the robot)
+    """
+    if not isinstance(log, (bytes, bytearray)):
+        with open(log, 'rb') as fid:
+            log = fid.read()
+
+    post = None
+    for kind, name, args, kwargs in read_log(log):
+        if kind == REC_CALL:
+            if name == 'ProgSave' and folder is not None:
+                args = [folder] + list(args[1:])
+                if len(args) > 2:
+                    args[2] = False # do not ask the user
+                kwargs.pop('ask_user', None)
+            elif name == 'ProgSendRobot' and not send:
+                continue
+            getattr(post, name)(*args, **kwargs)
+        elif kind == REC_SETATTR:
+            setattr(post, name, args[0])
+        elif kind == REC_DELATTR:
+            delattr(post, name)
+        elif kind == REC_NEW:
+            if post_class is None:
+                post_class = importlib.import_module(name).RobotPost
+            elif isinstance(post_class, str):
+                post_class = importlib.import_module(post_class).RobotPost
+            post = post_class(*args, **kwargs)
+    return post
+
+
+def main(argv):
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Record and replay post processor calls')
+    parser.add_argument('cmd', choices=['record', 'replay'])
+    parser.add_argument('files', nargs='+', help='record: script.py job.rdkpost, replay: job.rdkpost')
+    parser.add_argument('--post', help='post module to replay on (defaults to the recorded post)')
+    parser.add_argument('--folder', help='folder to save the program (defaults to the recorded folder)')
+    parser.add_argument('--send', action='store_true', help='replay ProgSendRobot')
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    if args.cmd == 'record':
+        if len(args.files) != 2:
+            parser.error('record requires the program script and the log file')
+        record_script(args.files[0], args.files[1])
+    else:
+        replay(args.files[0], args.post, args.folder, args.send)
+    print('%s done in %.3f s' % (args.cmd, time.perf_counter() - t0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,275 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Streaming loader for the program scripts RoboDK generates for a post processor.
+#
+# RoboDK hands the post a Python script with one statement per instruction:
+#     r = RobotPost(r"""Fanuc_R30iA""",r"""Fanuc ARC Mate 120iC""",6,axes_type=['R','R','R','R','R','R'])
+#     r.ProgStart(r"""Prog1""")
+#     r.MoveL(p([1390.0,0.0,1010.0,180.0,0.0,180.0]),[0.0,0.0,0.0,0.0,90.0,0.0],[0.0,0.0,1.0])
+# Compiling and executing a script of 500k instructions is slow and holds the whole
+# code object in memory. This module reads the script line by line, decodes the
+# numeric literals directly and calls the post methods. Only the small helper
+# functions of the script (def p(v): ...) are executed as Python code.
+#
+# Usage:
+#     python postscript.py generated_script.py
+# --------------------------------------------
+
+import os
+import re
+import sys
+import ast
+import importlib
+
+# statements of the script dialect
+_RE_CALL = re.compile(r'^([A-Za-z_]\w*)\.([A-Za-z_]\w*)\((.*)\)\s*;?\s*$')
+_RE_NEW = re.compile(r'^([A-Za-z_]\w*)\s*=\s*RobotPost\((.*)\)\s*$')
+_RE_IMPORT_POST = re.compile(r'^from\s+([\w\.]+)\s+import\s+RobotPost(\s+as\s+RobotPost)?\s*$')
+_RE_PATH = re.compile(r'^sys\.path\.(append|insert)\((?:0,\s*)?os\.path\.abspath\((r?)("""|\'|")(.*)\3\)\)\s*(?:#.*)?$')
+_RE_KWARG = re.compile(r'\s*([A-Za-z_]\w*)\s*=(?!=)')
+_SKIP = ('import ', 'from ', '#')
+
+
+class ScriptError(Exception):
+    """Raised when a script line is not part of the dialect generated by RoboDK"""
+    pass
+
+
+class ScriptLoader(object):
+    """Reads a RoboDK program script and drives the post processor with it"""
+    def __init__(self, strict=True, post_class=None):
+        self.strict = strict
+        self.post_class = post_class
+        self.namespace = {}
+        self.posts = {}     # variable name -> post object
+        self.methods = {}   # (variable name, method name) -> bound method
+        self.nlines = 0
+        exec('from robodk import *', self.namespace)
+
+    # ------------------ values ----------------------
+    def parse_args(self, text):
+        """Parse the arguments of a call. Returns (args, kwargs)"""
+        args = []
+        kwargs = {}
+        pos = 0
+        size = len(text)
+        while pos < size:
+            c = text[pos]
+            if c in ' ,\t':
+                pos += 1
+                continue
+            key = None
+            match = _RE_KWARG.match(text, pos)
+            if match:
+                key = match.group(1)
+                pos = match.end()
+                while text[pos] == ' ':
+                    pos += 1
+            value, pos = self.parse_value(text, pos)
+            if key is None:
+                args.append(value)
+            else:
+                kwargs[key] = value
+        return args, kwargs
+
+    def parse_value(self, text, pos):
+        """Parse one value starting at pos. Returns (value, position after the value)"""
+        c = text[pos]
+        if c == '[':
+            end = text.index(']', pos)
+            inner = text[pos+1:end]
+            if '[' in inner or '"' in inner or "'" in inner:
+                return self.parse_literal(text, pos)
+            inner = inner.strip()
+            return ([float(x) for x in inner.split(',')] if inner else []), end + 1
+        elif text.startswith('p([', pos) or text.startswith('p((', pos):
+            end = text.index('])' if text[pos+2] == '[' else '))', pos)
+            values = [float(x) for x in text[pos+3:end].split(',')]
+            return self.namespace['p'](values), end + 2
+        elif c == 'r' and text.startswith('r"""', pos):
+            end = text.index('"""', pos + 4)
+            return text[pos+4:end], end + 3
+        elif text.startswith('"""', pos):
+            end = text.index('"""', pos + 3)
+            return ast.literal_eval(text[pos:end+3]), end + 3
+        elif c == 'N' and text.startswith('None', pos):
+            return None, pos + 4
+        elif c == 'T' and text.startswith('True', pos):
+            return True, pos + 4
+        elif c == 'F' and text.startswith('False', pos):
+            return False, pos + 5
+        elif c in '-+.0123456789':
+            end = pos + 1
+            size = len(text)
+            while end < size and text[end] not in ',)':
+                end += 1
+            token = text[pos:end].strip()
+            if '.' in token or 'e' in token or 'E' in token:
+                return float(token), end
+            return int(token), end
+        return self.parse_literal(text, pos)
+
+    def parse_literal(self, text, pos):
+        """Slow path: find the end of the expression and evaluate it"""
+        depth = 0
+        quote = None
+        end = pos
+        size = len(text)
+        while end < size:
+            c = text[end]
+            if quote:
+                if text.startswith(quote, end):
+                    end += len(quote) - 1
+                    quote = None
+            elif text.startswith('"""', end) or text.startswith("'''", end):
+                quote = text[end:end+3]
+                end += 2
+            elif c in '"\'':
+                quote = c
+            elif c in '([{':
+                depth += 1
+            elif c in ')]}':
+                if depth == 0:
+                    break
+                depth -= 1
+            elif c == ',' and depth == 0:
+                break
+            end += 1
+        expression = text[pos:end]
+        try:
+            return ast.literal_eval(expression), end
+        except (ValueError, SyntaxError):
+            if self.strict:
+                raise ScriptError('Unsupported expression: %s' % expression)
+            return eval(expression, self.namespace), end
+
+    # ------------------ statements ----------------------
+    def run_line(self, line):
+        """Run one statement of the script"""
+        self.nlines += 1
+        match = _RE_CALL.match(line)
+        if match:
+            name, method, text = match.groups()
+            post = self.posts.get(name)
+            if post is not None:
+                key = (name, method)
+                function = self.methods.get(key)
+                if function is None:
+                    function = getattr(post, method)
+                    self.methods[key] = function
+                args, kwargs = self.parse_args(text)
+                function(*args, **kwargs)
+                return
+        if line.startswith('print('):
+            args, kwargs = self.parse_args(line[6:line.rindex(')')])
+            print(*args)
+            return
+        if line.startswith('sys.stdout.flush()'):
+            sys.stdout.flush()
+            return
+        match = _RE_NEW.match(line)
+        if match:
+            name, text = match.groups()
+            # from <post> import RobotPost, or from <post> import * (header of RoboDK)
+            post_class = self.post_class or self.namespace.get('RobotPost')
+            if post_class is None:
+                raise ScriptError('RobotPost was created before it was imported')
+            args, kwargs = self.parse_args(text)
+            self.posts[name] = post_class(*args, **kwargs)
+            self.methods = {}
+            return
+        match = _RE_IMPORT_POST.match(line)
+        if match:
+            if self.post_class is None:
+                self.post_class = importlib.import_module(match.group(1)).RobotPost
+            self.namespace['RobotPost'] = self.post_class
+            return
+        match = _RE_PATH.match(line)
+        if match:
+            folder = os.path.abspath(match.group(4))
+            if folder not in sys.path:
+                sys.path.append(folder)
+            return
+        if line.startswith(_SKIP):
+            exec(line, self.namespace)
+            return
+        if self.strict:
+            raise ScriptError('Line %i is not supported: %s' % (self.nlines, line))
+        exec(line, self.namespace)
+
+    def run(self, lines):
+        """Run the statements of a script from an iterable of lines (for example an open file)"""
+        block = None
+        pending = None
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if pending is not None:
+                # statement continues (multiline string)
+                pending = pending + '\n' + line
+                if pending.count('"""') % 2 == 1:
+                    continue
+                line = pending
+                pending = None
+            elif line.count('"""') % 2 == 1:
+                pending = line
+                continue
+
+            if block is not None:
+                # body of a helper function
+                if line.startswith((' ', '\t')) or not line.strip():
+                    block.append(line)
+                    self.nlines += 1
+                    continue
+                exec('\n'.join(block), self.namespace)
+                block = None
+
+            stripped = line.strip()
+            if not stripped or stripped.startswith('#'):
+                self.nlines += 1
+                continue
+            if line.startswith('def '):
+                block = [line]
+                self.nlines += 1
+                continue
+            self.run_line(stripped)
+
+        if block is not None:
+            exec('\n'.join(block), self.namespace)
+        return self.posts
+
+
+def is_dialect(lines):
+    """Returns True if every statement of a script can be run by ScriptLoader
+    (scripts with loops, conditions or other multiline statements must be executed as Python code)"""
+    in_string = False
+    for line in lines:
+        if line.count('"""') % 2 == 1:
+            in_string = not in_string
+            if not in_string:
+                continue
+        if in_string:
+            continue
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#') or line.startswith((' ', '\t', 'def ')):
+            continue
+        if line.startswith(('print(', 'sys.stdout.flush()') + _SKIP):
+            continue
+        if _RE_CALL.match(stripped) or _RE_NEW.match(stripped) or _RE_PATH.match(stripped):
+            continue
+        return False
+    return True
+
+
+def load(script_path, strict=True, post_class=None):
+    """Run a program script generated by RoboDK without compiling it. Returns the post objects by variable name."""
+    loader = ScriptLoader(strict, post_class)
+    with open(script_path, 'r') as fid:
+        return loader.run(fid)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('Usage: python postscript.py generated_script.py')
+        sys.exit(1)
+    load(sys.argv[1], strict=False)
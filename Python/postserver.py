@@ -0,0 +1,398 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Resident post processor server.
+#
+# RoboDK starts a new Python process for every program generation. That process
+# imports robodk and the post processor chain (Fanuc_R30iA -> Fanuc_G6T -> cell post)
+# before a single instruction is processed. For small programs the start up time is
+# larger than the generation time.
+#
+# This module keeps one Python process alive with the post modules already imported.
+# A thin client forwards the program script generated by RoboDK to the server and
+# prints back the output of the post (SAVED: lines, POPUP: messages and the LOG) so
+# RoboDK sees exactly the same output as when it runs the script itself. Scripts that
+# only contain one post call per line are run with the streaming loader of postscript.py.
+#
+# Usage:
+#     python postserver.py serve [--port 20600] [--posts C:/RoboDK/Posts]
+#     python postserver.py run generated_script.py
+#     python postserver.py replay job.rdkpost [--post Fanuc_G6T_cell1_hs] [--folder C:/Programs]
+#     python postserver.py stop
+#
+# If no server is running, "run" and "replay" execute the job in the client process.
+# "replay" regenerates a job recorded with postrecord.py.
+# The server shows no dialogs (it may run headless or on another machine): ProgSave does not
+# ask for the file name nor open the result, the messages of mbox are sent back with the LOG
+# and the files saved, and the client shows them and opens the editor (show_result).
+# The server runs any script it receives: it only listens on the loopback interface
+# unless a token is given (--token or POSTSERVER_TOKEN, the clients must send the same).
+# --------------------------------------------
+
+import os
+import sys
+import io
+import hmac
+import json
+import time
+import glob
+import socket
+import types
+import ipaddress
+import importlib
+import traceback
+import contextlib
+import socketserver
+
+import postscript
+
+HOST = '127.0.0.1'
+PORT = 20600    # RoboDK API: 20500 to 20502
+PATH_POSTS = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Posts'))
+
+
+#----------------------------------------------------
+#--------        Job execution        ---------------
+
+def run_script(script, path='<robodk>', cwd=None):
+    """Run a program script generated by RoboDK and return (output, log, error).
+    output is everything the post printed, log is the LOG of the post objects created by the script and
+    error is the traceback (or None if the script ran without errors)."""
+    namespace = {'__name__': '__main__', '__file__': path}
+    cwd_backup = os.getcwd()
+    buffer = io.StringIO()
+    error = None
+    try:
+        if cwd is not None and os.path.isdir(cwd):
+            os.chdir(cwd)
+        with contextlib.redirect_stdout(buffer):
+            lines = script.splitlines()
+            if postscript.is_dialect(lines):
+                # fast path: scripts with one post call per line are not compiled
+                loader = postscript.ScriptLoader(strict=False)
+                try:
+                    loader.run(lines)
+                finally:
+                    namespace.update(loader.posts)
+            else:
+                code = compile(script, path, 'exec')
+                exec(code, namespace)
+    except SystemExit:
+        pass
+    except:
+        error = traceback.format_exc()
+    finally:
+        os.chdir(cwd_backup)
+
+    log = ''
+    for value in namespace.values():
+        if type(value).__name__ == 'RobotPost' and isinstance(getattr(value, 'LOG', None), str):
+            log = log + value.LOG
+    return buffer.getvalue(), log, error
+
+
+def replay_log(log_path, post=None, folder=None):
+    """Replay a log recorded with postrecord.py and return (output, log, error)"""
+    import postrecord
+    buffer = io.StringIO()
+    error = None
+    robot = None
+    try:
+        with contextlib.redirect_stdout(buffer):
+            robot = postrecord.replay(log_path, post, folder)
+    except:
+        error = traceback.format_exc()
+    log = robot.LOG if robot is not None else ''
+    return buffer.getvalue(), log, error
+
+
+@contextlib.contextmanager
+def headless():
+    """Run a job without dialogs: mbox messages are kept instead of shown, the save dialogs return the
+    default path and ProgSave runs with ask_user=False and show_result=False.
+    Yields a dict with the mbox messages and the show_result requested by the job."""
+    import robodk
+    state = {'messages': [], 'show_result': False}
+
+    def mbox(msg, *args, **kwargs):
+        state['messages'].append(msg)
+        return True
+
+    def getSaveFile(path_preference='', strfile='file.txt', strtitle=''):
+        return types.SimpleNamespace(name=os.path.join(path_preference, strfile))
+
+    def getSaveFolder(path_programs='/', popup_msg=''):
+        return path_programs
+
+    def progsave_headless(original):
+        def ProgSave(self, folder, progname, ask_user=False, show_result=False, *args, **kwargs):
+            if show_result:
+                state['show_result'] = show_result
+            return original(self, folder, progname, False, False, *args, **kwargs)
+        return ProgSave
+
+    replace = {robodk.mbox: mbox, robodk.getSaveFile: getSaveFile, robodk.getSaveFolder: getSaveFolder}
+    patched = []    # (owner, name, original)
+    for module in list(sys.modules.values()):
+        namespace = getattr(module, '__dict__', {})
+        for name in ('mbox', 'getSaveFile', 'getSaveFolder'):
+            value = namespace.get(name)
+            if callable(value) and value in replace:
+                patched.append((module, name, value))
+                setattr(module, name, replace[value])
+        post_class = namespace.get('RobotPost')
+        for cls in (post_class.__mro__ if isinstance(post_class, type) else ()):
+            if 'ProgSave' in cls.__dict__ and not any(owner is cls for owner, name, value in patched):
+                patched.append((cls, 'ProgSave', cls.__dict__['ProgSave']))
+                setattr(cls, 'ProgSave', progsave_headless(cls.__dict__['ProgSave']))
+    try:
+        yield state
+    finally:
+        for owner, name, value in reversed(patched):
+            setattr(owner, name, value)
+
+
+def saved_files(output):
+    """Returns the list of files reported with SAVED: lines"""
+    files = []
+    for line in output.splitlines():
+        if line.startswith('SAVED:'):
+            files.append(line[len('SAVED:'):].strip())
+    return files
+
+
+#----------------------------------------------------
+#--------           Server            ---------------
+
+class PostServer(socketserver.TCPServer):
+    """TCP server that runs one generation job at a time.
+    Jobs are not run in parallel: the posts print to stdout and keep state at module level."""
+    allow_reuse_address = True
+
+    def __init__(self, address, path_posts=PATH_POSTS, preload=None, token=None):
+        if token is None and not is_loopback(address[0]):
+            raise ValueError('The post server runs the scripts it receives: a token is required to listen on %s' % address[0])
+        self.token = token
+        self.path_posts = os.path.abspath(path_posts)
+        self.mtimes = {}
+        self.running = True
+        if self.path_posts not in sys.path:
+            sys.path.insert(0, self.path_posts)
+        self.preload(preload)
+        socketserver.TCPServer.__init__(self, address, PostRequestHandler)
+
+    def post_modules(self):
+        """Returns the modules that were imported from the posts folder"""
+        modules = {}
+        for name, module in list(sys.modules.items()):
+            filepath = getattr(module, '__file__', None)
+            if filepath and os.path.dirname(os.path.abspath(filepath)) == self.path_posts:
+                modules[name] = module
+        return modules
+
+    def preload(self, names=None):
+        """Import the post modules so the jobs don't have to"""
+        import robodk
+        if names is None:
+            names = [os.path.splitext(os.path.basename(f))[0] for f in glob.glob(os.path.join(self.path_posts, '*.py'))]
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except:
+                print('Unable to preload %s: %s' % (name, sys.exc_info()[1]))
+        for name, module in self.post_modules().items():
+            self.mtimes[name] = os.path.getmtime(module.__file__)
+
+    def refresh(self):
+        """Forget the post modules if any of them changed on disk since it was imported"""
+        changed = False
+        for name, module in self.post_modules().items():
+            if os.path.getmtime(module.__file__) != self.mtimes.get(name):
+                changed = True
+                break
+        if changed:
+            print('Post processor files changed: reloading')
+            for name in self.post_modules():
+                del sys.modules[name]
+            self.mtimes = {}
+            self.preload(None)
+
+    def serve(self):
+        print('Post server listening on %s:%i (posts: %s)' % (self.server_address[0], self.server_address[1], self.path_posts))
+        sys.stdout.flush()
+        while self.running:
+            self.handle_request()
+        self.server_close()
+
+
+class PostRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode('utf-8'))
+        cmd = request.get('cmd')
+        if self.server.token is not None and not hmac.compare_digest(str(request.get('token') or ''), self.server.token):
+            reply = {'ok': False, 'error': 'Invalid token'}
+        elif cmd == 'stop':
+            self.server.running = False
+            reply = {'ok': True}
+        elif cmd in ('run', 'replay'):
+            self.server.refresh()
+            t0 = time.perf_counter()
+            with headless() as dialogs:
+                if cmd == 'run':
+                    output, log, error = run_script(request['script'], request.get('path', '<robodk>'), request.get('cwd'))
+                else:
+                    output, log, error = replay_log(request['path'], request.get('post'), request.get('folder'))
+            elapsed = time.perf_counter() - t0
+            print('%s: %.3f s%s' % (request.get('path', '<robodk>'), elapsed, ' (failed)' if error else ''))
+            sys.stdout.flush()
+            reply = {'ok': error is None, 'output': output, 'log': log, 'error': error, 'saved': saved_files(output), 'time': elapsed,
+                     'messages': dialogs['messages'], 'show_result': dialogs['show_result']}
+        else:
+            reply = {'ok': False, 'error': 'Unknown command: %s' % cmd}
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+def is_loopback(host):
+    """Returns True if host is a loopback address (127.0.0.1, ::1, localhost)"""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+#----------------------------------------------------
+#--------           Client            ---------------
+
+class ServerNotRunning(ConnectionError):
+    """Raised when the connection to the server fails (nothing was sent)"""
+    pass
+
+
+def send_request(request, host=HOST, port=PORT, timeout=None, token=None):
+    """Send a request to the server and return the reply. Raises ServerNotRunning if the server is not running
+    and ConnectionError (or OSError) if the connection fails once the request was sent."""
+    if token is not None:
+        request = dict(request, token=token)
+    try:
+        sock = socket.create_connection((host, port), timeout=5)
+    except OSError as e:
+        raise ServerNotRunning('Post server is not running on %s:%i (%s)' % (host, port, e))
+    with sock:
+        sock.settimeout(timeout)
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        data = sock.makefile('rb').readline()
+    if not data:
+        raise ConnectionError('Post server closed the connection')
+    return json.loads(data.decode('utf-8'))
+
+
+def show_reply(reply):
+    """Show what the post would have shown if the job ran in this process: the mbox messages,
+    the files saved opened with show_result and the LOG"""
+    show_result = reply.get('show_result')
+    messages = reply.get('messages') or []
+    if show_result and reply.get('log'):
+        messages = messages + ['Program generation LOG:\n\n' + reply['log']]
+    if show_result:
+        import subprocess
+        for filesave in reply.get('saved') or []:
+            if not os.path.isfile(filesave):
+                # saved on another machine
+                continue
+            if type(show_result) is str:
+                subprocess.Popen([show_result, filesave])
+            elif type(show_result) is list:
+                subprocess.Popen(show_result + [filesave])
+            else:
+                os.startfile(filesave)
+    if messages:
+        from robodk import mbox
+        for message in messages:
+            mbox(message)
+
+
+def run(script_path, host=HOST, port=PORT, token=None):
+    """Run a RoboDK program script on the server (or locally if the server is not running).
+    Returns 0 on success"""
+    script_path = os.path.abspath(script_path)
+    with open(script_path, 'r') as fid:
+        script = fid.read()
+    request = {'cmd': 'run', 'script': script, 'path': script_path, 'cwd': os.getcwd()}
+    try:
+        reply = send_request(request, host, port, token=token)
+    except ServerNotRunning:
+        output, log, error = run_script(script, script_path, os.getcwd())
+        reply = {'output': output, 'error': error}
+    except (ConnectionError, OSError) as e:
+        # the server may have run the job: don't run it again
+        reply = {'error': 'Post server connection lost: %s\n' % e}
+    return print_reply(reply)
+
+
+def replay(log_path, post=None, folder=None, host=HOST, port=PORT, token=None):
+    """Replay a recorded job on the server (or locally if the server is not running).
+    Returns 0 on success"""
+    log_path = os.path.abspath(log_path)
+    if folder is not None:
+        folder = os.path.abspath(folder)
+    request = {'cmd': 'replay', 'path': log_path, 'post': post, 'folder': folder}
+    try:
+        reply = send_request(request, host, port, token=token)
+    except ServerNotRunning:
+        output, log, error = replay_log(log_path, post, folder)
+        reply = {'output': output, 'error': error}
+    except (ConnectionError, OSError) as e:
+        # the server may have run the job: don't run it again
+        reply = {'error': 'Post server connection lost: %s\n' % e}
+    return print_reply(reply)
+
+
+def print_reply(reply):
+    """Print the output of a job (SAVED: and POPUP: lines for RoboDK), show its dialogs and return 0 on success"""
+    sys.stdout.write(reply.get('output') or '')
+    sys.stdout.flush()
+    show_reply(reply)
+    error = reply.get('error')
+    if error:
+        sys.stderr.write(error if error.endswith('\n') else error + '\n')
+        return 1
+    return 0
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description='Resident RoboDK post processor server')
+    parser.add_argument('cmd', choices=['serve', 'run', 'replay', 'stop'])
+    parser.add_argument('script', nargs='?', help='program script generated by RoboDK (run) or recorded job (replay)')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--token', default=os.environ.get('POSTSERVER_TOKEN'), help='shared secret of the server and the clients (required to serve on an address other than loopback)')
+    parser.add_argument('--posts', default=PATH_POSTS, help='folder with the post processors')
+    parser.add_argument('--post', help='post module to replay on (replay)')
+    parser.add_argument('--folder', help='folder to save the program (replay)')
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'serve':
+        try:
+            server = PostServer((args.host, args.port), args.posts, token=args.token)
+        except ValueError as e:
+            parser.error(str(e))
+        server.serve()
+        return 0
+    elif args.cmd == 'stop':
+        try:
+            reply = send_request({'cmd': 'stop'}, args.host, args.port, token=args.token)
+            if not reply.get('ok'):
+                print(reply.get('error'))
+        except (ConnectionError, OSError):
+            print('Post server is not running')
+        return 0
+    if args.script is None:
+        parser.error('%s requires a file' % args.cmd)
+    if args.cmd == 'replay':
+        return replay(args.script, args.post, args.folder, args.host, args.port, args.token)
+    return run(args.script, args.host, args.port, args.token)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
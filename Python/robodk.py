@@ -33,7 +33,6 @@
 import math
 import operator
 import sys
-import unittest
 import time
 
 #----------------------------------------------------
@@ -1660,38 +1659,244 @@ def UploadFileFTP(file_path_name, server_ip, remote_path, username, password):
     sys.stdout.flush()
     return True
 
-def UploadFTP(program, robot_ip, remote_path, ftp_user, ftp_pass, pause_sec = 2):
-    """Upload a program or a list of programs to the robot through FTP provided the connection parameters"""
-    # Iterate through program list if it is a list of files
-    if isinstance(program, list):
-        if len(program) == 0:
-            print('POPUP: Nothing to transfer')
-            sys.stdout.flush()
-            pause(pause_sec)
-            return
-        
-        for prog in program:
-            UploadFTP(prog, robot_ip, remote_path, ftp_user, ftp_pass, 0)        
-        
-        print("POPUP: <font color=\"blue\">Done: %i files and folders successfully transferred</font>" % len(program))
+def UploadFTP(program, robot_ip, remote_path, ftp_user, ftp_pass, pause_sec = 0, sessions = 1, block_size = 8192):
+    """Upload a program or a list of programs to the robot through FTP provided the connection parameters.
+    The files are sent with one FTP session (or a pool of sessions if the robot allows it) and the transfer
+    of every file is printed. pause_sec keeps the last message on screen."""
+    import os
+    if not isinstance(program, list):
+        program = [program]
+    if len(program) == 0:
+        print('POPUP: Nothing to transfer')
         sys.stdout.flush()
         pause(pause_sec)
-        print("POPUP: Done")
+        return
+
+    files = [prog for prog in program if os.path.isfile(prog)]
+    for prog in program:
+        if not os.path.isfile(prog):
+            print('Sending program folder %s...' % prog)
+            UploadDirFTP(prog, robot_ip, remote_path, ftp_user, ftp_pass)
+
+    results = UploadFilesFTP(files, robot_ip, remote_path, ftp_user, ftp_pass, sessions, block_size)
+    errors = [result for result in results if result[1] is not None]
+    if errors:
+        # keep the error on screen (no final Done), as UploadFileFTP does
+        print("POPUP: <font color=\"red\">%i of %i files could not be transferred: %s</font>" % (len(errors), len(program), ', '.join(getBaseName(result[0]) for result in errors)))
         sys.stdout.flush()
+        pause(max(pause_sec, 4))
         return
-    
-    import os
-    if os.path.isfile(program):
-        print('Sending program file %s...' % program)
-        UploadFileFTP(program, robot_ip, remote_path, ftp_user, ftp_pass)
-    else:
-        print('Sending program folder %s...' % program)
-        UploadDirFTP(program, robot_ip, remote_path, ftp_user, ftp_pass)    
-    
+    print("POPUP: <font color=\"blue\">Done: %i files and folders successfully transferred</font>" % len(program))
+    sys.stdout.flush()
     pause(pause_sec)
     print("POPUP: Done")
     sys.stdout.flush()
 
+def UploadFilesFTP(files, server_ip, remote_path, username, password, sessions = 1, block_size = 8192, ftp = None):
+    """Upload a list of files to a robot through FTP with one session (or a pool of sessions, the largest files
+    first on the session with less bytes). ftp: open session (in remote_path) used by the first uploader.
+    Prints the transfer of every file. Returns the result of every file: [(file, error or None, bytes, seconds), ...]"""
+    import os
+    if len(files) == 0:
+        return []
+    print("POPUP: <p>Connecting to <strong>%s</strong> using user name <strong>%s</strong> and password ****</p><p>Sending %i files...</p>" % (server_ip, username, len(files)))
+    sys.stdout.flush()
+    t0 = time.time()
+    pool = [UploadQueueFTP(server_ip, remote_path, username, password, block_size, ftp if i == 0 else None) for i in range(max(1, min(sessions, len(files))))]
+    queued = [0]*len(pool)
+    for file_path_name in sorted(files, key=os.path.getsize, reverse=True):
+        i = queued.index(min(queued))
+        pool[i].put(file_path_name)
+        queued[i] += os.path.getsize(file_path_name)
+    results = []
+    for uploader in pool:
+        results += uploader.close()
+    elapsed = time.time() - t0
+    order = dict((file_path_name, i) for i, file_path_name in enumerate(files))
+    results.sort(key=lambda result: order[result[0]])
+    for file_path_name, error, size, seconds in results:
+        if error is None:
+            print('  Sent %s: %i bytes, %.3f s, %.1f kB/s' % (getBaseName(file_path_name), size, seconds, size/1024.0/max(seconds, 1e-6)))
+        else:
+            print('  Not sent %s: %s' % (getBaseName(file_path_name), error))
+    sent = [result for result in results if result[1] is None]
+    size = sum(result[2] for result in sent)
+    print('Sent %i files, %i bytes in %.2f s (%.1f kB/s, %i sessions)' % (len(sent), size, elapsed, size/1024.0/max(elapsed, 1e-6), len(pool)))
+    if len(sent) < len(results):
+        print('Not sent %i files' % (len(results) - len(sent)))
+    sys.stdout.flush()
+    return results
+
+
+def ListFTP(ftp):
+    """Names of the files in the current folder of an FTP session (MLSD, or NLST if the server does not support it)"""
+    import ftplib
+    try:
+        return [name for name, facts in ftp.mlsd() if facts.get('type', 'file') == 'file']
+    except (ftplib.error_perm, AttributeError):
+        pass
+    try:
+        names = ftp.nlst()
+    except ftplib.error_perm:
+        return [] # empty folder
+    return [name.replace(':', '/').split('/')[-1] for name in names]
+
+def SyncFTP(files, server_ip, remote_path, username, password, manifest = None, group = None, sessions = 1, block_size = 8192):
+    """Upload the files that are new or changed since the last transfer to a robot through FTP.
+    The remote folder is listed once and compared with the manifest of the files sent (size and MD5 per server and
+    path, saved in manifest: default .ftpsync.json in the folder of the first file). Files of the same group sent
+    before and not in files (pages of a longer version of the program) are deleted in the same session.
+    Returns (results of UploadFilesFTP, files up to date, files deleted)."""
+    import os
+    import json
+    import ftplib
+    import hashlib
+    if len(files) == 0:
+        return [], [], []
+    if manifest is None:
+        manifest = os.path.join(getFileDir(files[0]), '.ftpsync.json')
+    key = '%s:%s' % (server_ip, remote_path)
+    data = {}
+    if os.path.isfile(manifest):
+        with open(manifest) as fid:
+            data = json.load(fid)
+    sent = data.get(key, {})
+
+    print("POPUP: <p>Connecting to <strong>%s</strong> using user name <strong>%s</strong> and password ****</p><p>Comparing %i files...</p>" % (server_ip, username, len(files)))
+    sys.stdout.flush()
+    try:
+        ftp = ftplib.FTP(server_ip, username, password)
+        ftp.cwd(remote_path)
+        remote = dict((name.upper(), name) for name in ListFTP(ftp))
+    except ftplib.all_errors as e:
+        print("POPUP: <font color=\"red\">Connection to %s failed: <p>%s</p></font>" % (server_ip, e))
+        sys.stdout.flush()
+        return [(file_path_name, str(e), 0, 0.0) for file_path_name in files], [], []
+
+    def on_robot(name):
+        # LS files are converted to TP programs by the controller
+        name = name.upper()
+        return name in remote or (name.endswith('.LS') and name[:-3] + '.TP' in remote)
+
+    local = {}
+    changed = []
+    unchanged = []
+    for file_path_name in files:
+        name = getBaseName(file_path_name)
+        with open(file_path_name, 'rb') as fid:
+            local[name] = {'size': os.path.getsize(file_path_name), 'md5': hashlib.md5(fid.read()).hexdigest(), 'group': group}
+        previous = sent.get(name)
+        if previous is not None and previous['size'] == local[name]['size'] and previous['md5'] == local[name]['md5'] and on_robot(name):
+            unchanged.append(file_path_name)
+        else:
+            changed.append(file_path_name)
+
+    deleted = []
+    if group is not None:
+        for name in sorted(sent):
+            if name in local or sent[name].get('group') != group:
+                continue
+            names = [name.upper()]
+            if names[0].endswith('.LS'):
+                names.append(names[0][:-3] + '.TP')
+            for remote_name in names:
+                if remote_name in remote:
+                    RemoveFileFTP(ftp, remote[remote_name])
+            deleted.append(name)
+            del sent[name]
+    print('Sync %s: %i changed, %i up to date, %i deleted' % (key, len(changed), len(unchanged), len(deleted)))
+    sys.stdout.flush()
+
+    results = UploadFilesFTP(changed, server_ip, remote_path, username, password, sessions, block_size, ftp)
+    if len(changed) == 0:
+        ftp.quit()
+    for file_path_name, error, size, seconds in results:
+        name = getBaseName(file_path_name)
+        if error is None:
+            sent[name] = local[name]
+        elif name in sent:
+            del sent[name]
+    data[key] = sent
+    with open(manifest, 'w') as fid:
+        json.dump(data, fid, indent=1, sort_keys=True)
+    return results, unchanged, deleted
+
+class UploadQueueFTP(object):
+    """Upload files to a robot through FTP in a background thread, with one FTP session, while the next files are
+    still being generated. put() queues a file (the remote file is replaced), close() waits for the queue and
+    returns the result of every file: [(file, error or None, bytes, seconds), ...]. The session is opened again
+    after an error. ftp: open session (in remote_path) to use first."""
+    def __init__(self, server_ip, remote_path, username, password, block_size=8192, ftp=None):
+        import threading
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue # python 2
+        self.server_ip = server_ip
+        self.remote_path = remote_path
+        self.username = username
+        self.password = password
+        self.block_size = block_size
+        self.ftp = ftp
+        self.results = []
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, file_path_name):
+        """Queue a file to upload"""
+        self.queue.put(file_path_name)
+
+    def _connect(self):
+        import ftplib
+        self.ftp = ftplib.FTP(self.server_ip, self.username, self.password)
+        self.ftp.cwd(self.remote_path)
+
+    def _send(self, file_path_name):
+        import ftplib
+        filename = getBaseName(file_path_name)
+        if self.ftp is None:
+            self._connect()
+        try:
+            self.ftp.delete(filename)
+        except ftplib.error_perm:
+            pass # new file
+        with open(file_path_name, 'rb') as fh:
+            self.ftp.storbinary('STOR %s' % filename, fh, self.block_size)
+
+    def _run(self):
+        while True:
+            file_path_name = self.queue.get()
+            if file_path_name is None:
+                break
+            t0 = time.time()
+            error = None
+            try:
+                self._send(file_path_name)
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+                print("POPUP: <font color=\"red\">Could not send %s: %s</font>" % (getBaseName(file_path_name), error))
+                sys.stdout.flush()
+                self._close_session()
+            size = os.path.getsize(file_path_name) if os.path.isfile(file_path_name) else 0
+            self.results.append((file_path_name, error, size, time.time() - t0))
+        self._close_session()
+
+    def _close_session(self):
+        if self.ftp is not None:
+            try:
+                self.ftp.quit()
+            except Exception:
+                self.ftp.close()
+            self.ftp = None
+
+    def close(self):
+        """Wait for the files in the queue and close the session. Returns the results."""
+        self.queue.put(None)
+        self.thread.join()
+        return self.results
+
 
 #----------------------------------------------------
 #--------       MessageBox class      ---------------
@@ -1699,20 +1904,33 @@ def UploadFTP(program, robot_ip, remote_path, ftp_user, ftp_pass, pause_sec = 2)
 # http://stackoverflow.com/questions/10057672/correct-way-to-implement-a-custom-popup-tkinter-dialog-box
 
 #------------------
-if sys.version_info[0] < 3:
-    # Python 2.X only:
-    import Tkinter as tkinter
-    import tkFileDialog as filedialog
-else:
-    # Python 3.x only
-    import tkinter
-    from tkinter import filedialog
+# The GUI toolkit is imported on first use: importing tkinter is a large part of the
+# start up time of a post processor and it fails on headless systems.
+tkinter = None
+filedialog = None
+
+def _import_tkinter():
+    """Import tkinter and filedialog the first time a dialog is required"""
+    global tkinter, filedialog
+    if tkinter is None:
+        if sys.version_info[0] < 3:
+            # Python 2.X only:
+            import Tkinter as tk
+            import tkFileDialog as tkfiledialog
+        else:
+            # Python 3.x only
+            import tkinter as tk
+            from tkinter import filedialog as tkfiledialog
+        filedialog = tkfiledialog
+        tkinter = tk
+    return tkinter
 #------------------
 
 #------------------
 
 def getOpenFile(path_preference="C:/RoboDK/Library/"):
     """Pop up a file dialog window to select a file to open."""
+    _import_tkinter()
     root = tkinter.Tk()
     root.withdraw()
     file_path = filedialog.askopenfilename(initialdir=path_preference)
@@ -1728,6 +1946,7 @@ def getSaveFile(path_preference="C:/RoboDK/Library/", strfile = 'file.txt', strt
     #options['filetypes'] = [('all files', '.*'), ('text files', '.txt')]
     options['initialfile'] = strfile
     #options['parent'] = root
+    _import_tkinter()
     root = tkinter.Tk()
     root.withdraw()
     file_path = filedialog.asksaveasfile(**options)
@@ -1736,6 +1955,7 @@ def getSaveFile(path_preference="C:/RoboDK/Library/", strfile = 'file.txt', strt
     
 def getSaveFolder(path_programs='/',popup_msg='Select a directory to save your program'):
     """Ask the user to select a folder to save a program or other file"""   
+    _import_tkinter()
     tkinter.Tk().withdraw()
     dirname = filedialog.askdirectory(initialdir=path_programs, title=popup_msg)
     if len(dirname) < 1:
@@ -1747,6 +1967,7 @@ class MessageBox(object):
 
     def __init__(self, msg, b1, b2, frame, t, entry):
 
+        _import_tkinter()
         root = self.root = tkinter.Tk()
         root.title('Message')
         self.msg = str(msg)
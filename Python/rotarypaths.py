@@ -0,0 +1,202 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Parametric rotary paths: transverse templates (Bands, Spiral, Pads) built from the
+# template parameters of tpp/rdk_cell1_hs.tpp without drawing them in RoboDK.
+#
+# The part turns on the turntable (headstock) around the X axis of the rotating user
+# frame and the laser stays on top of it, riding the track:
+#     - bands:  rings of 'sweep' deg at a constant X, 'pitch' mm apart
+#     - spiral: one helix over 'length' mm with 'pitch' mm per turn
+#     - pads:   axial passes of 'length' mm, 'pitch' mm apart around the part (zigzag)
+# Every template is repeated for 'pockets' ('pocketSep' deg apart), 'bands' ('bandSep'
+# mm apart) and 'layers' (radius + 'layerHeight', X + 'ofst_LayerX' per layer).
+#
+# The targets are written in the rotating user frame: the point of the part at the
+# laser, the tool Z axis pointing to the part axis, the turntable angle that brings the
+# point under the laser and the track position that follows X. The turntable keeps
+# turning the same way from one pass to the next. Each pass is generated with NumPy and
+# streamed into the G6T events (moveApproach/laserStartSeq/laserStopSeq) with
+# pathingest.PathIngest. The approach, laser start/stop and depart offsets are the PRs of
+# the post, as in the TP template: the move to the first point of a pass is the approach
+# move (OFFSET_APPROACH) and 'speed' is written in the speed register of the post (R[157]).
+#
+# Usage:
+#     python rotarypaths.py bands Fanuc_G6T_cell1_hs diameter=200 pitch=3 passes=20 layers=50
+# --------------------------------------------
+
+import os
+import sys
+import math
+import importlib
+import numpy as np
+
+import pathingest
+
+TEMPLATES = ('bands', 'spiral', 'pads')
+
+# template parameters (names of the TP template), mm and deg
+DEFAULTS = {
+    'diameter': 100.0,      # part diameter
+    'length': 50.0,         # axial length (spiral, pads)
+    'pitch': 2.0,           # distance between passes (spiral: per turn)
+    'passes': 1,            # passes per band (bands, pads)
+    'layers': 1,
+    'layerHeight': 1.0,     # radius added per layer
+    'bands': 1,
+    'bandSep': 0.0,         # axial distance between bands
+    'pockets': 1,
+    'pocketSep': 0.0,       # angle between pockets
+    'sweep': 360.0,         # angle of every band pass
+    'ofst_xStart': 0.0,     # axial start
+    'ofst_zStart': 0.0,     # radial offset of the tool point
+    'ofst_xRot': 0.0,       # start angle
+    'ofst_LayerX': 0.0,     # axial shift per layer (layer bevelling)
+    'speed': 10.0,          # surface speed (mm/s)
+    'step': 1.0,            # distance between targets along the path
+    'trackOffset': 0.0,     # track position when the laser is at X = 0
+}
+
+
+def template_params(**params):
+    """Template parameters with the defaults. Unknown names raise an exception."""
+    for name in params:
+        if name not in DEFAULTS:
+            raise Exception('Unknown template parameter: %s' % name)
+    result = dict(DEFAULTS)
+    result.update(params)
+    for name in ('passes', 'layers', 'bands', 'pockets'):
+        result[name] = int(result[name])
+    return result
+
+
+#----------------------------------------------------
+#--------          Pass geometry       --------------
+# Every generator yields the passes as (x, theta, radius):
+#   x      (N,) axial position of the points (mm)
+#   theta  (N,) turntable angle of the points (deg)
+#   radius     radius of the layer (mm)
+
+def _count(length, step):
+    return max(int(math.ceil(abs(length)/step)), 1)
+
+
+def bands(p):
+    for l in range(p['layers']):
+        radius = 0.5*p['diameter'] + p['ofst_zStart'] + l*p['layerHeight']
+        n = _count(math.radians(p['sweep'])*radius, p['step'])
+        for m in range(p['bands']):
+            for k in range(p['pockets']):
+                start = p['ofst_xRot'] + k*p['pocketSep']
+                for j in range(p['passes']):
+                    x = p['ofst_xStart'] + l*p['ofst_LayerX'] + m*p['bandSep'] + j*p['pitch']
+                    yield np.full(n + 1, x), np.linspace(start, start + p['sweep'], n + 1), radius
+
+
+def spiral(p):
+    turns = p['length']/p['pitch']
+    for l in range(p['layers']):
+        radius = 0.5*p['diameter'] + p['ofst_zStart'] + l*p['layerHeight']
+        n = _count(math.hypot(2*math.pi*radius*turns, p['length']), p['step'])
+        t = np.linspace(0.0, 1.0, n + 1)
+        for m in range(p['bands']):
+            for k in range(p['pockets']):
+                start = p['ofst_xRot'] + k*p['pocketSep']
+                x = p['ofst_xStart'] + l*p['ofst_LayerX'] + m*p['bandSep']
+                yield x + t*p['length'], start + 360.0*turns*t, radius
+
+
+def pads(p):
+    for l in range(p['layers']):
+        radius = 0.5*p['diameter'] + p['ofst_zStart'] + l*p['layerHeight']
+        n = _count(p['length'], p['step'])
+        t = np.linspace(0.0, 1.0, n + 1)
+        angle = math.degrees(p['pitch']/radius)
+        for m in range(p['bands']):
+            for k in range(p['pockets']):
+                start = p['ofst_xRot'] + k*p['pocketSep']
+                x = p['ofst_xStart'] + l*p['ofst_LayerX'] + m*p['bandSep'] + t*p['length']
+                for j in range(p['passes']):
+                    # zigzag: every other pass runs backwards
+                    yield (x if j % 2 == 0 else x[::-1]), np.full(n + 1, start + j*angle), radius
+
+
+def passes(template, params):
+    """Generator of the passes (x, theta, radius) of a template"""
+    if template not in TEMPLATES:
+        raise Exception('Unknown template: %s (%s)' % (template, ', '.join(TEMPLATES)))
+    return globals()[template](params)
+
+
+#----------------------------------------------------
+#--------           Targets            --------------
+
+def chunks(template, params, robot, seed=None):
+    """Generator of pathingest chunks (xyz, zaxis, speed, on, joints), one per pass"""
+    naxes = len(robot.AXES_TYPE)
+    seed = np.asarray(seed if seed is not None else [0.0, 0.0, 0.0, 0.0, -90.0, 0.0] + [0.0]*(naxes - 6), dtype=float)
+    last = None
+    for x, theta, radius in passes(template, params):
+        # keep turning the same way: start the pass at the closest turn of the turntable
+        if last is not None:
+            theta = theta + 360.0*round((last - theta[0])/360.0)
+        last = theta[-1]
+        # point of the part under the laser (rotating frame: the part turns by theta around X)
+        a = np.radians(theta)
+        normal = np.stack((np.zeros_like(a), np.sin(a), np.cos(a)), axis=1)
+        xyz = normal*radius
+        xyz[:, 0] = x
+        on = np.ones(x.shape[0], dtype=bool)
+        on[0] = False
+        joints = np.tile(seed, (x.shape[0], 1))
+        for i in robot.AXES_TRACK[:1]:
+            joints[:, i] = x + params['trackOffset']
+        for i in robot.AXES_TURNTABLE[:1]:
+            joints[:, i] = theta
+        yield xyz, -normal, np.full(x.shape[0], float(params['speed'])), on, joints
+
+
+def generate(template, params, robot, progname, folder=None, seed=None, pass_loop=True, powder=True):
+    """Generate the program of a template with an existing post object.
+    If folder is provided the program is saved. Returns the PathIngest object (number of points and passes)."""
+    return pathingest.ingest_chunks(chunks(template, params, robot, seed), robot, progname, folder, pass_loop=pass_loop, powder=powder)
+
+
+def main(argv):
+    import argparse
+    import time
+    parser = argparse.ArgumentParser(description='Generate a Fanuc program from a transverse template (bands, spiral, pads)')
+    parser.add_argument('template', choices=TEMPLATES)
+    parser.add_argument('post', help='post processor module (for example Fanuc_G6T_cell1_hs)')
+    parser.add_argument('params', nargs='*', help='template parameters as name=value (%s)' % ', '.join(sorted(DEFAULTS)))
+    parser.add_argument('--folder', default='.', help='folder to save the program')
+    parser.add_argument('--name', help='program name (default: template name)')
+    parser.add_argument('--robot', default='Fanuc robot', help='robot name given to the post')
+    parser.add_argument('--lines', type=int, help='maximum lines per program page')
+    parser.add_argument('--seed', help='joints of the robot arm and external axes (comma separated)')
+    args = parser.parse_args(argv)
+
+    params = {}
+    for item in args.params:
+        name, value = item.split('=', 1)
+        params[name] = float(value)
+    params = template_params(**params)
+    post_class = importlib.import_module(args.post).RobotPost
+    axes = 'RRRRRR' + ('T' if post_class.HAS_TRACK else '') + ('J' if post_class.HAS_TURNTABLE else '')
+    kwargs = {'axes_type': list(axes)}
+    if args.lines is not None:
+        kwargs['lines_x_prog'] = args.lines
+    robot = post_class(args.post, args.robot, len(axes), **kwargs)
+    folder = os.path.abspath(args.folder)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    seed = None if args.seed is None else [float(x) for x in args.seed.split(',')]
+    t0 = time.perf_counter()
+    feeder = generate(args.template, params, robot, args.name or args.template, folder, seed)
+    elapsed = time.perf_counter() - t0
+    print('Points: %i, passes: %i, %.2f s' % (feeder.npoints, feeder.npasses, elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,98 @@
+# --------------------------------------------
+# --------------- DESCRIPTION ----------------
+#
+# Turntable unwinding: choose the written angle of the rotary axes.
+#
+# A turntable angle a can be written as a + 360*k. RoboDK gives the angles of the
+# simulation (they can grow over several turns), the post used to write a % 360 above
+# 360 deg, so the axis could unwind a full turn between two passes or turn the long way
+# on a link. unwind() chooses k for every target of a page so that the total rotary
+# travel is minimal and the angles stay inside the axis limits:
+#     - every step is the shortest equivalent move (|step| <= 180 deg), as a cumulative
+#       sum over the page, shifted by whole turns to start close to the previous page.
+#       A single step larger than 180 deg between two targets is written as the shortest
+#       equivalent step: the axis turns in the opposite direction (or without the whole
+#       turns of the simulation). CHECK_JOINTS reports these steps.
+#     - when the shortest steps do not fit inside the limits, the turns are solved with
+#       dynamic programming over the possible turns of every target
+#
+# Usage:
+#     written = unwind(angles, seed=last_written_angles, limits=(-720, 720))
+#
+# The post uses it for every page when TURNTABLE_UNWIND is True.
+# --------------------------------------------
+
+import numpy as np
+
+
+def _limits(limits, naxes):
+    """Per axis (min, max) from None, one (min, max) pair or a list of pairs"""
+    if limits is None:
+        return [(-np.inf, np.inf)]*naxes
+    if np.isscalar(limits[0]):
+        return [(float(limits[0]), float(limits[1]))]*naxes
+    return [(float(lo), float(hi)) for lo, hi in limits]
+
+
+def _wrap(step):
+    """Equivalent step in [-180, 180] deg"""
+    return step - 360.0*np.round(step/360.0)
+
+
+def _unwind_axis(angles, seed, lo, hi):
+    n = angles.shape[0]
+    path = angles[0] + np.concatenate(([0.0], np.cumsum(_wrap(np.diff(angles)))))
+    # first page: start where the angle was written without unwinding
+    ref = (angles[0] % 360.0 if angles[0] > 360.0 else angles[0]) if seed is None else seed
+    # turns that keep the whole path inside the limits
+    k_min = np.ceil((lo - path.min())/360.0) if np.isfinite(lo) else -np.inf
+    k_max = np.floor((hi - path.max())/360.0) if np.isfinite(hi) else np.inf
+    if k_min <= k_max:
+        k = np.clip(np.round((ref - path[0])/360.0), k_min, k_max)
+        return path + 360.0*k
+
+    # the shortest steps leave the limits: choose the turn of every target
+    base = np.mod(angles, 360.0)
+    turns = np.arange(np.floor(lo/360.0) - 1, np.ceil(hi/360.0) + 1)
+    values = base[:, None] + 360.0*turns[None, :]                  # (n, K) candidate angles
+    valid = (values >= lo - 1e-9) & (values <= hi + 1e-9)
+    if not valid.any(axis=1).all():
+        raise ValueError('Turntable limits [%.1f, %.1f] do not reach every target' % (lo, hi))
+    cost = np.abs(values[0] - ref) if seed is not None else np.abs(values[0] - ref)*1e-6
+    cost = np.where(valid[0], cost, np.inf)
+    back = np.zeros((n, turns.size), dtype=int)
+    for i in range(1, n):
+        total = cost[None, :] + np.abs(values[i][:, None] - values[i-1][None, :])
+        back[i] = np.argmin(total, axis=1)
+        cost = np.where(valid[i], total[np.arange(turns.size), back[i]], np.inf)
+    result = np.empty(n)
+    state = int(np.argmin(cost))
+    for i in range(n - 1, -1, -1):
+        result[i] = values[i, state]
+        state = back[i, state]
+    return result
+
+
+def unwind(angles, seed=None, limits=None):
+    """Returns the angles to write for a (N, nTurntableAxes) array of turntable angles (deg).
+
+    :param seed: angles written for the previous target (previous page), None for the first page
+    :param limits: None, (min, max) for all the axes or a list of (min, max) per axis
+    """
+    angles = np.asarray(angles, dtype=float)
+    if angles.ndim == 1:
+        angles = angles[:, None]
+    result = np.empty_like(angles)
+    if angles.shape[0] == 0:
+        return result
+    for axis, (lo, hi) in enumerate(_limits(limits, angles.shape[1])):
+        result[:, axis] = _unwind_axis(angles[:, axis], None if seed is None else float(seed[axis]), lo, hi)
+    return result
+
+
+def travel(angles):
+    """Total rotary travel of a (N, nTurntableAxes) array of angles (deg)"""
+    angles = np.asarray(angles, dtype=float)
+    if angles.shape[0] < 2:
+        return 0.0
+    return float(np.abs(np.diff(angles, axis=0)).sum())
@@ -0,0 +1,177 @@
+# Drip feed and upload benchmark against the Fanuc controller emulator (Python/fanucemu.py).
+# Runs the drip feeder of Posts/drip-feed/Fanuc_R30iA.py on a page set (a folder with the
+# main program M_*.LS and its pages, or pages generated with the drip-feed post) and reports
+# the starvation events of the robot and the upload throughput. --sessions also times
+# UploadFilesFTP with 1, 2... FTP sessions. --abort-at aborts the robot at a page and runs the
+# main program again from the call of that page (the feeder must keep its files and checkpoint).
+# python bench_dripfeed.py [folder] [--pages 20] [--page-time 0.5] [--latency 0.02] [--bandwidth 200] [--storage 1000] [--abort-at 3]
+import io
+import os
+import sys
+import glob
+import time
+import ftplib
+import shutil
+import tempfile
+import argparse
+import threading
+import contextlib
+import subprocess
+import importlib.util
+
+PATH_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+PATH_PYTHON = os.path.join(PATH_ROOT, 'Python')
+PATH_DRIPFEED_POST = os.path.join(PATH_ROOT, 'Posts', 'drip-feed', 'Fanuc_R30iA.py')
+sys.path.insert(0, PATH_PYTHON)
+
+import fanucemu
+
+
+def load_post():
+    """Drip-feed post module (its name is the same as the post of Posts/)"""
+    spec = importlib.util.spec_from_file_location('dripfeed_post', PATH_DRIPFEED_POST)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_pages(post, folder, npages, page_time, lines=50):
+    """Write a program split in npages pages of page_time s (linear moves of 100 mm)"""
+    from robodk import transl
+    robot = post.RobotPost('Fanuc_R30iA', 'Fanuc', 6, lines_x_prog=lines)
+    robot.PATH_MAKE_TP = None
+    robot.ProgStart('Bench')
+    robot.setSpeed(100.0*(lines - 1)/page_time)
+    for i in range(npages*lines - 5):
+        robot.MoveL(transl(500 + (i % 2)*100, 0, 300 + i*0.01), [0, 0, 0, 0, 0, 0])
+    robot.ProgFinish('Bench')
+    with contextlib.redirect_stdout(io.StringIO()):
+        robot.ProgSave(folder, 'Bench')
+
+
+def page_set(folder):
+    """Main program and pages of a folder: (main file, [page files]) in the order of the calls"""
+    mains = glob.glob(os.path.join(folder, 'M_*.LS'))
+    if len(mains) != 1:
+        raise Exception('Expected one main program M_*.LS in %s' % folder)
+    with open(mains[0]) as fid:
+        steps = fanucemu.program_steps(fid.read())
+    names = dict((name.upper(), name) for name in os.listdir(folder))
+    pages = [names.get(step[1] + '.LS', step[1] + '.LS') for step in steps if step[0] == 'call']
+    return os.path.basename(mains[0]), pages
+
+
+def run_dripfeed(post, folder, main, pages, emulator, budget, timeout):
+    """Run the drip feeder on the emulator. Returns (seconds, output of the feeder)."""
+    script = os.path.join(folder, 'bench_dripfeed_run.py')
+    with open(script, 'w') as fid:
+        fid.write(post.DRIPFEED_FILE % (emulator.host, 'md:/', 'anonymous', '', main, str(pages), budget))
+    command = [sys.executable, '-c', 'import ftplib, runpy; ftplib.FTP.port = %i; runpy.run_path("bench_dripfeed_run.py", run_name="__main__")' % emulator.port]
+    t0 = time.perf_counter()
+    result = subprocess.run(command, cwd=folder, input='\n', stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, timeout=timeout)
+    return time.perf_counter() - t0, result.stdout
+
+
+def abort_and_resume(controller, page, checkpoint, pause, report):
+    """Abort the robot when it runs page and run the main program again from the call of page after pause s.
+    report gets the files on the controller and if the checkpoint exists while the robot is stopped."""
+    page = page.upper()
+    while True:
+        with controller.changed:
+            stack = [list(frame) for frame in controller.stack]
+            if controller.t_end is not None and not stack and controller.main is not None and controller.t_start is not None:
+                report.append(None) # ended before the page
+                return
+        if any(program == page for program, line in stack[1:]):
+            break
+        time.sleep(0.01)
+    controller.abort()
+    controller.wait(5)
+    time.sleep(pause)
+    report.append(([name for name in controller.names() if name not in fanucemu.STATUS_FILES], os.path.isfile(checkpoint)))
+    controller.start(controller.main, stack[0][1])
+
+
+def run_upload(folder, files, emulator, sessions):
+    """Time UploadFilesFTP on the emulator"""
+    import robodk
+    ftplib.FTP.port = emulator.port
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = robodk.UploadFilesFTP([os.path.join(folder, name) for name in files], emulator.host, 'md:/', 'anonymous', '', sessions)
+    return time.perf_counter() - t0, sum(result[2] for result in results if result[1] is None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Drip feed benchmark on the Fanuc controller emulator')
+    parser.add_argument('folder', nargs='?', help='page set: main program M_*.LS and its pages (default: generated pages)')
+    parser.add_argument('--pages', type=int, default=20, help='pages generated')
+    parser.add_argument('--page-time', type=float, default=0.5, help='run time of the pages generated (s)')
+    parser.add_argument('--latency', type=float, default=0.02, help='delay of every FTP command (s)')
+    parser.add_argument('--bandwidth', type=float, help='speed of every transfer (kB/s)')
+    parser.add_argument('--storage', type=float, help='program memory of the controller (kB)')
+    parser.add_argument('--override', type=float, default=100, help='speed override (%%)')
+    parser.add_argument('--budget', type=int, help='storage budget of the drip feeder (bytes)')
+    parser.add_argument('--sessions', default='', help='also time UploadFilesFTP with these sessions (for example 1,2,4)')
+    parser.add_argument('--abort-at', type=int, help='abort the robot at this page (1: first page) and run the main program again from it')
+    parser.add_argument('--abort-pause', type=float, default=3.0, help='time the robot stays aborted (s)')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--verbose', action='store_true', help='print the output of the feeder')
+    args = parser.parse_args()
+
+    post = load_post()
+    budget = args.budget or post.RobotPost.DRIPFEED_STORAGE_BUDGET
+    folder = tempfile.mkdtemp()
+    try:
+        if args.folder:
+            for path in glob.glob(os.path.join(args.folder, '*.LS')) + glob.glob(os.path.join(args.folder, '*.TP')):
+                shutil.copy(path, folder)
+        else:
+            make_pages(post, folder, args.pages, args.page_time)
+        main, pages = page_set(folder)
+        size = sum(os.path.getsize(os.path.join(folder, name)) for name in [main] + pages)
+        estimate = 0.0
+        for name in pages:
+            with open(os.path.join(folder, name)) as fid:
+                estimate += fanucemu.run_time(fid.read())
+        print('Pages:              %i (%.0f kB, %.1f s estimated)' % (len(pages), size*0.001, estimate))
+
+        emulator = fanucemu.FanucEmulator('127.0.0.1', 0, args.latency, args.bandwidth*1000 if args.bandwidth else None,
+                                          storage=args.storage*1000 if args.storage else None, override=args.override, run=main[:-3])
+        with emulator:
+            controller = emulator.controller
+            report = []
+            if args.abort_at:
+                checkpoint = os.path.join(folder, main[:-3] + '_dripfeed.json')
+                watcher = threading.Thread(target=abort_and_resume, args=(controller, pages[args.abort_at - 1][:-3], checkpoint, args.abort_pause, report), daemon=True)
+                watcher.start()
+            elapsed, output = run_dripfeed(post, folder, main, pages, emulator, budget, args.timeout)
+            controller.wait(10)
+            run = (controller.t_end or time.time()) - controller.t_start if controller.t_start else 0.0
+            starved = sum(seconds for program, seconds in controller.starvations)
+            print('Drip feed:          %8.2f s  (robot running %.2f s)' % (elapsed, run))
+            print('Starvation events:  %8i    (%.2f s, %.1f%% of the run time)' % (len(controller.starvations), starved, 100.0*starved/max(run, 1e-6)))
+            for program, seconds in controller.starvations:
+                print('    %-12s %.3f s' % (program, seconds))
+            near = [line for line in output.splitlines() if line.startswith('    Near starvation:')]
+            print('Near starvation:    %8i    (logged by the feeder)' % len(near))
+            # "Sent 228 kB at 59 kB/s": time of the transfers seen by the feeder (FTP commands included)
+            sent = [line.split() for line in output.splitlines() if line.startswith('Sent ') and line.endswith('kB/s')]
+            if sent:
+                print('Upload throughput:  %8s kB/s (%i files, %s kB)' % (sent[-1][4], len(controller.uploads), sent[-1][1]))
+            print('Files left:         %s' % ' '.join(name for name in controller.names() if name not in fanucemu.STATUS_FILES))
+            if report and report[0] is None:
+                print('Abort:              the job ended before %s' % pages[args.abort_at - 1])
+            elif report:
+                files, checkpoint_kept = report[0]
+                print('Abort at %-10s %i files kept on the robot, checkpoint %s' % (pages[args.abort_at - 1] + ':', len(files), 'kept' if checkpoint_kept else 'removed'))
+            for fault in controller.faults:
+                print('Fault: ' + fault)
+            if 'Job Completed Successfully' not in output or args.verbose:
+                print(output)
+
+            for sessions in [int(value) for value in args.sessions.split(',') if value]:
+                seconds, nbytes = run_upload(folder, [main] + pages, emulator, sessions)
+                print('UploadFilesFTP:     %8.2f s  (%i sessions, %.1f kB/s)' % (seconds, sessions, nbytes*0.001/max(seconds, 1e-6)))
+    finally:
+        shutil.rmtree(folder)
@@ -0,0 +1,48 @@
+# Import time benchmark for the robodk toolbox and the post processors.
+# Compares importing robodk (GUI, FTP and subprocess modules are loaded on first use)
+# against importing robodk plus the modules it used to import eagerly.
+# Each measurement runs in a fresh interpreter: python bench_import.py [repeat]
+import os
+import sys
+import subprocess
+
+PATH_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+PATH_PYTHON = os.path.join(PATH_ROOT, 'Python')
+PATH_POSTS = os.path.join(PATH_ROOT, 'Posts')
+
+CASES = [
+    ('robodk (lazy)', 'import robodk'),
+    ('robodk + eager GUI', 'import robodk, unittest, tkinter; from tkinter import filedialog'),
+    ('cell post (lazy)', 'import Fanuc_G6T_cell1_hs'),
+    ('cell post + eager GUI', 'import unittest, tkinter; from tkinter import filedialog; import Fanuc_G6T_cell1_hs'),
+]
+
+TIMER = '''
+import sys, time
+sys.path[:0] = [%r, %r]
+t0 = time.perf_counter()
+%s
+print(time.perf_counter() - t0)
+'''
+
+
+def measure(statement, repeat=10):
+    """Returns the best import time (in seconds) of a statement over a number of fresh interpreters"""
+    best = None
+    for i in range(repeat):
+        code = TIMER % (PATH_PYTHON, PATH_POSTS, statement)
+        output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+        elapsed = float(output.strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    results = {}
+    for name, statement in CASES:
+        results[name] = measure(statement, repeat)
+        print('%-24s %8.2f ms' % (name, results[name]*1000))
+    print('')
+    print('Saved on robodk import:    %8.2f ms' % ((results['robodk + eager GUI'] - results['robodk (lazy)'])*1000))
+    print('Saved on cell post import: %8.2f ms' % ((results['cell post + eager GUI'] - results['cell post (lazy)'])*1000))
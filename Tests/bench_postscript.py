@@ -0,0 +1,65 @@
+# Throughput benchmark of the streaming script loader (Python/postscript.py)
+# against running the same RoboDK program script as Python code.
+# python bench_postscript.py [instructions] [post]
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import subprocess
+
+PATH_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+PATH_PYTHON = os.path.join(PATH_ROOT, 'Python')
+PATH_POSTS = os.path.join(PATH_ROOT, 'Posts')
+
+
+def make_script(filepath, folder, ninstructions, post='Fanuc_G6T_cell1_hs'):
+    """Write a program script in the dialect RoboDK generates (header of RoboDK, robodk.py found with PYTHONPATH)"""
+    random.seed(0)
+    with open(filepath, 'w') as fid:
+        fid.write('from robodk import *\n\n')
+        fid.write('import sys\nimport os\n')
+        fid.write('sys.path.append(os.path.abspath(r"""%s/""")) # temporarily add path to POSTS folder\n\n' % PATH_POSTS.replace('\\', '/'))
+        fid.write('from %s import *\n\n' % post)
+        fid.write('def p(v):\n    return xyzrpw_2_pose(v)\n\n')
+        fid.write("print('Total instructions: %i')\n" % ninstructions)
+        fid.write('r = RobotPost(r"""%s""",r"""Fanuc M-20iA""",8,axes_type=[\'R\',\'R\',\'R\',\'R\',\'R\',\'R\',\'T\',\'J\'])\n' % post)
+        fid.write('r.ProgStart(r"""Bench""")\n')
+        fid.write('r.setFrame(p([0,0,0,0,0,0]),5,r"""Frame""")\n')
+        fid.write('r.setTool(p([0,0,100,0,0,0]),5,r"""Tool""")\n')
+        for i in range(ninstructions):
+            if i % 50 == 0:
+                fid.write('r.setSpeed(%.3f)\n' % random.choice([16.0, 35.0, 60.0]))
+            pose = [random.uniform(-500, 500) for k in range(3)] + [180.0, 0.0, random.uniform(-180, 180)]
+            joints = [random.uniform(-90, 90) for k in range(6)] + [500.0, random.uniform(0, 720)]
+            fid.write('r.MoveL(p([%s]),[%s],[0.0,0.0,1.0])\n' % (','.join('%.6f' % x for x in pose), ','.join('%.6f' % x for x in joints)))
+            if i % 1000 == 0:
+                fid.write("print('Done instruction: %i')\nsys.stdout.flush()\n" % i)
+        fid.write('r.ProgFinish(r"""Bench""")\n')
+        fid.write('r.ProgSave(r"""%s""",r"""Bench""",False)\n' % folder.replace('\\', '/'))
+
+
+def run(command):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([PATH_PYTHON, PATH_POSTS])
+    t0 = time.perf_counter()
+    subprocess.check_call(command, stdout=subprocess.DEVNULL, env=env)
+    return time.perf_counter() - t0
+
+
+if __name__ == "__main__":
+    ninstructions = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    post = sys.argv[2] if len(sys.argv) > 2 else 'Fanuc_G6T_cell1_hs'
+    folder = tempfile.mkdtemp()
+    try:
+        script = os.path.join(folder, 'bench_script.py')
+        make_script(script, folder, ninstructions, post)
+        t_exec = run([sys.executable, script])
+        t_load = run([sys.executable, os.path.join(PATH_PYTHON, 'postscript.py'), script])
+        print('Instructions:       %i' % ninstructions)
+        print('Python exec:        %8.2f s  (%8.0f instructions/s)' % (t_exec, ninstructions/t_exec))
+        print('Streaming loader:   %8.2f s  (%8.0f instructions/s)' % (t_load, ninstructions/t_load))
+        print('Speed up:           %8.2fx' % (t_exec/t_load))
+    finally:
+        shutil.rmtree(folder)